@@ -1,66 +1,141 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import socket
+import argparse
 import json
 import time
+from typing import Dict, List, Optional, Tuple
+
+import protocol
+from direct_io import DirectClient
+from metadata_cache import MetadataCache
 
 app = Flask(__name__)
 CORS(app)  
 
 MASTER_HOST = 'localhost'
 MASTER_PORT = 5000
+DIRECT_IO = False
+direct_client = DirectClient(MASTER_HOST, MASTER_PORT)
+# Listings, system info and file metadata are served from here for a
+# couple of seconds (--cache-ttl); writes through this server invalidate.
+metadata_cache = MetadataCache()
 
-def send_command_to_master(cmd: str, fname: str = '', args: str = '') -> str:
+def send_command_to_master(cmd: str, fname: str = '', content: str = '', args: str = '') -> Tuple[str, bytes]:
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        sock.connect((MASTER_HOST, MASTER_PORT))
-        if cmd in ['list', 'system_info']:
-            
-            msg = f"{cmd}::"
-        elif fname:
-            msg = f"{cmd}:{fname}:{args}"
-        else:
-            msg = f"{cmd}::{args}"
-        sock.send(msg.encode())
-        response = sock.recv(65536).decode()  
-        sock.close()
-        return response
+        reply = protocol.call(MASTER_HOST, MASTER_PORT, cmd, fname, args,
+                              payload=content.encode(), timeout=5)
+        return reply.status, reply.payload
     except Exception as e:
-        return f"ERROR: {e}"
+        return f"ERROR: {e}", b''
+
+class MasterError(Exception):
+    pass
+
+def master_json(cmd: str, fname: str = '', args: str = ''):
+    # The parsed payload of an OK reply; raises MasterError otherwise.
+    response, body = send_command_to_master(cmd, fname, args=args)
+    if response.startswith('ERROR'):
+        raise MasterError(response)
+    return json.loads(body)
+
+def fetch_metadata(names: List[str]) -> Dict[str, Optional[dict]]:
+    # Metadata for each name (None if there is no such file): cached entries
+    # first, the rest from the master in batches.
+    found, missing, generation = metadata_cache.lookup_files(names)
+    fetched = {}
+    for start in range(0, len(missing), protocol.METADATA_BATCH_MAX):
+        batch = missing[start:start + protocol.METADATA_BATCH_MAX]
+        fetched.update(master_json('metadata_batch', args=json.dumps(batch)))
+    metadata_cache.store_files(fetched, generation)
+    found.update(fetched)
+    return found
+
+def send_data_command(cmd: str, fname: str, content: str = '',
+                      chunk_size: Optional[int] = None, ec: Optional[str] = None,
+                      compression: Optional[str] = None) -> Tuple[str, bytes]:
+    # With --direct, file bytes go straight to/from the data nodes and the
+    # master only serves chunk locations. Erasure-coded and compressed
+    # writes are encoded by the master, so they always go through it.
+    if not DIRECT_IO or cmd not in ('create', 'write', 'read') or ((ec or compression) and cmd != 'read'):
+        request_args = {}
+        if chunk_size is not None:
+            request_args['chunk_size'] = chunk_size
+        if ec:
+            request_args['ec'] = ec
+        if compression:
+            request_args['compression'] = compression
+        args = json.dumps(request_args) if request_args else ''
+        return send_command_to_master(cmd, fname, content, args)
+    try:
+        if cmd == 'read':
+            return 'OK', direct_client.read(fname)
+        return direct_client.write(fname, content.encode(), chunk_size), b''
+    except Exception as e:
+        return f"ERROR: {e}", b''
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     try:
-        response = send_command_to_master('list', '')
+        send_command_to_master('list', '')
         return jsonify({'status': 'healthy', 'master_available': True}), 200
     except:
         return jsonify({'status': 'unhealthy', 'master_available': False}), 503
 
 @app.route('/api/files', methods=['GET'])
 def list_files():
+    # ?prefix=&after=&limit= returns one page of names in order, plus
+    # `next` (pass it as `after` for the following page) and `total`.
     try:
-        response = send_command_to_master('list', '')
-        if response.startswith('ERROR'):
-            return jsonify({'error': response}), 500
-        files = json.loads(response)
-        return jsonify({'files': files}), 200
+        if not any(key in request.args for key in ('prefix', 'after', 'limit')):
+            files = metadata_cache.view(('list',), lambda: master_json('list'))
+            return jsonify({'files': files}), 200
+        page = {'prefix': request.args.get('prefix', ''), 'after': request.args.get('after', '')}
+        if 'limit' in request.args:
+            page['limit'] = request.args.get('limit', type=int)
+            if page['limit'] is None:
+                return jsonify({'error': 'Invalid limit'}), 400
+        key = ('list', page['prefix'], page['after'], page.get('limit'))
+        return jsonify(metadata_cache.view(key, lambda: master_json('list', args=json.dumps(page)))), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def read_range(fname: str, offset: int, length: Optional[int]) -> Tuple[str, bytes]:
+    if DIRECT_IO:
+        try:
+            return 'OK', direct_client.read_range(fname, offset, length)
+        except Exception as e:
+            return f"ERROR: {e}", b''
+    request_args = {'offset': offset}
+    if length is not None:
+        request_args['length'] = length
+    return send_command_to_master('read_range', fname, args=json.dumps(request_args))
+
 @app.route('/api/files/<path:filename>', methods=['GET'])
 def read_file(filename):
+    # ?offset=N&length=M reads just that byte range (length defaults to
+    # the rest of the file).
     try:
-        response = send_command_to_master('read', filename)
+        offset = request.args.get('offset', type=int)
+        length = request.args.get('length', type=int)
+        if offset is not None or length is not None:
+            if (offset or 0) < 0 or (length is not None and length < 0):
+                return jsonify({'error': 'Invalid range'}), 400
+            response, body = read_range(filename, offset or 0, length)
+            if response.startswith('ERROR'):
+                return jsonify({'error': response}), 404
+            return jsonify({'content': body.decode(errors='replace'), 'filename': filename,
+                            'offset': offset or 0, 'length': len(body)}), 200
+        response, body = send_data_command('read', filename)
         if response.startswith('ERROR'):
             return jsonify({'error': response}), 404
+        content = body.decode(errors='replace')
         if response.startswith('WARNING'):
             
             return jsonify({
-                'content': response,
+                'content': content + response,
                 'warning': True
             }), 200
-        return jsonify({'content': response, 'filename': filename}), 200
+        return jsonify({'content': content, 'filename': filename}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -72,7 +147,9 @@ def create_file(filename):
         if not content:
             return jsonify({'error': 'Content is required'}), 400
         
-        response = send_command_to_master('create', filename, content)
+        response, _ = send_data_command('create', filename, content, data.get('chunk_size'), data.get('ec'),
+                                        data.get('compression'))
+        metadata_cache.invalidate(filename)
         if response.startswith('ERROR'):
             return jsonify({'error': response}), 500
         
@@ -89,7 +166,9 @@ def write_file(filename):
         data = request.get_json()
         content = data.get('content', '')
         
-        response = send_command_to_master('write', filename, content)
+        response, _ = send_data_command('write', filename, content, data.get('chunk_size'), data.get('ec'),
+                                        data.get('compression'))
+        metadata_cache.invalidate(filename)
         if response.startswith('ERROR'):
             return jsonify({'error': response}), 500
         
@@ -100,6 +179,47 @@ def write_file(filename):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Raw byte endpoints. Bodies are streamed a chunk at a time straight
+# between the HTTP connection and the data nodes (always over the direct
+# path, which is the only one that moves single chunks), so the API
+# server holds at most a window of chunks whatever the file size.
+@app.route('/api/files/<path:filename>/content', methods=['GET'])
+def download_file(filename):
+    try:
+        layout = direct_client.locate(filename)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 404
+    try:
+        size = direct_client.file_size(filename, layout)
+        start, stop, status = 0, size, 200
+        headers = {'Accept-Ranges': 'bytes'}
+        if request.range is not None:
+            span = request.range.range_for_length(size)
+            if span is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop, status = span[0], span[1], 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(direct_client.stream(filename, layout, start, stop), status=status,
+                        headers=headers, mimetype='application/octet-stream')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/files/<path:filename>/content', methods=['PUT'])
+def upload_file(filename):
+    # Accepts a Content-Length or a chunked (Transfer-Encoding) body;
+    # ?chunk_size=N picks the chunk size for a new file.
+    try:
+        chunk_size = request.args.get('chunk_size', type=int)
+        try:
+            response, size = direct_client.write_stream(filename, request.stream.read, chunk_size)
+        finally:
+            metadata_cache.invalidate(filename)
+        return jsonify({'message': response, 'filename': filename, 'size': size}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/files/<path:filename>/append', methods=['POST'])
 def append_to_file(filename):
     try:
@@ -108,7 +228,8 @@ def append_to_file(filename):
         if not content:
             return jsonify({'error': 'Content is required'}), 400
         
-        response = send_command_to_master('append', filename, content)
+        response, _ = send_command_to_master('append', filename, content)
+        metadata_cache.invalidate(filename)
         if response.startswith('ERROR'):
             return jsonify({'error': response}), 500
         
@@ -122,7 +243,8 @@ def append_to_file(filename):
 @app.route('/api/files/<path:filename>', methods=['DELETE'])
 def delete_file(filename):
     try:
-        response = send_command_to_master('delete', filename)
+        response, _ = send_command_to_master('delete', filename)
+        metadata_cache.invalidate(filename)
         if response.startswith('ERROR'):
             return jsonify({'error': response}), 500
         
@@ -136,28 +258,50 @@ def delete_file(filename):
 @app.route('/api/files/<path:filename>/metadata', methods=['GET'])
 def get_file_metadata(filename):
     try:
-        response = send_command_to_master('metadata', filename)
-        if response.startswith('ERROR'):
-            return jsonify({'error': response}), 404
-        metadata = json.loads(response)
+        metadata = fetch_metadata([filename])[filename]
+        if metadata is None:
+            return jsonify({'error': 'ERROR: File not found'}), 404
         return jsonify(metadata), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/metadata', methods=['POST'])
+def get_files_metadata():
+    # {"files": [name, ...]} -> {"files": {name: metadata or null}}, in as
+    # few master requests as the cache allows.
+    try:
+        data = request.get_json()
+        names = data.get('files') if isinstance(data, dict) else None
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            return jsonify({'error': 'files must be a list of names'}), 400
+        return jsonify({'files': fetch_metadata(names)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/pools', methods=['GET'])
+def pool_stats():
+    try:
+        response, body = send_command_to_master('pool_stats')
+        if response.startswith('ERROR'):
+            return jsonify({'error': response}), 500
+        return jsonify({'pools': json.loads(body)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/system/status', methods=['GET'])
 def system_status():
     try:
-        file_response = send_command_to_master('list', '')
-        files = json.loads(file_response) if not file_response.startswith('ERROR') else []
-        
-        system_response = send_command_to_master('system_info', '')
-        system_info = json.loads(system_response) if not system_response.startswith('ERROR') else {}
+        try:
+            system_info = metadata_cache.view(('system_info',), lambda: master_json('system_info'))
+        except MasterError:
+            system_info = {}
         
         return jsonify({
             'status': 'operational',
             'master_available': True,
-            'file_count': len(files),
+            'file_count': system_info.get('total_files', 0),
             'system_info': system_info,
+            'api_cache': metadata_cache.stats(),
             'timestamp': time.time()
         }), 200
     except Exception as e:
@@ -169,6 +313,14 @@ def system_status():
         }), 503
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mini DFS REST API server')
+    parser.add_argument('--direct', action='store_true',
+                        help='read and write chunk data directly against the data nodes')
+    parser.add_argument('--cache-ttl', type=float, default=2.0,
+                        help='seconds to serve listings and metadata from cache (0 disables)')
+    args = parser.parse_args()
+    DIRECT_IO = args.direct
+    metadata_cache.ttl = args.cache_ttl
     print("REST API Server starting on http://localhost:8000")
     print("Make sure the master node is running on port 5000")
     app.run(host='localhost', port=8000, debug=True)
@@ -0,0 +1,52 @@
+import argparse
+import sys
+import time
+
+import protocol
+
+MASTER_HOST = 'localhost'
+MASTER_PORT = 5000
+
+# Appends small records to one file against a running cluster and reports
+# the average append latency per batch. With tail-only appends the cost per
+# append stays flat as the file grows instead of rising with its size.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Append throughput benchmark')
+    parser.add_argument('--appends', type=int, default=2000)
+    parser.add_argument('--record-size', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--file', default='bench_append.log')
+    parser.add_argument('--keep', action='store_true', help='keep the file afterwards')
+    args = parser.parse_args()
+
+    record = (b'x' * (args.record_size - 1)) + b'\n'
+    reply = protocol.call(MASTER_HOST, MASTER_PORT, 'write', args.file, payload=b'')
+    if not reply.ok:
+        print(reply.status)
+        sys.exit(1)
+
+    print(f"{'appends':>8} {'file size':>12} {'ms/append':>10} {'appends/s':>10}")
+    total_start = time.time()
+    batch_start = total_start
+    for i in range(1, args.appends + 1):
+        reply = protocol.call(MASTER_HOST, MASTER_PORT, 'append', args.file, payload=record)
+        if not reply.ok:
+            print(f"Append {i} failed: {reply.status}")
+            sys.exit(1)
+        if i % args.batch == 0 or i == args.appends:
+            now = time.time()
+            count = i % args.batch or args.batch
+            elapsed = now - batch_start
+            print(f"{i:>8} {i * args.record_size / 1024:>10.1f}KB {elapsed / count * 1000:>10.2f} {count / elapsed:>10.0f}")
+            batch_start = now
+    total = time.time() - total_start
+    print(f"Total: {args.appends} appends in {total:.2f}s ({args.appends / total:.0f} appends/s)")
+
+    if not args.keep:
+        protocol.call(MASTER_HOST, MASTER_PORT, 'delete', args.file)
+
+
+if __name__ == '__main__':
+    main()
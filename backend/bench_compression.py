@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import protocol
+from compression import CODECS, pack_chunk, unpack_chunk
+
+MASTER_HOST = 'localhost'
+MASTER_PORT = 5000
+
+# Compression ratio against throughput for each chunk codec. By default the
+# codecs are timed in-process on chunks of generated log lines, JSON records
+# and random bytes (or of --file); with --cluster the same data is also
+# written to and read back from a running cluster once per codec, which
+# shows whether the bytes saved on the wire pay for the CPU spent.
+
+
+def log_data(size: int) -> bytes:
+    rng = random.Random(1)
+    levels = ['INFO', 'INFO', 'INFO', 'WARN', 'ERROR']
+    lines = []
+    total = 0
+    while total < size:
+        line = (f'2026-10-17T{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d} '
+                f'{rng.choice(levels)} worker-{rng.randrange(16)} request={rng.getrandbits(32):08x} '
+                f'path=/api/files/{rng.randrange(1000)} status={rng.choice([200, 200, 201, 404, 500])} '
+                f'latency_ms={rng.randrange(500)}\n')
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+def json_data(size: int) -> bytes:
+    rng = random.Random(2)
+    records = []
+    total = 0
+    while total < size:
+        record = json.dumps({'id': rng.getrandbits(48), 'user': f'user{rng.randrange(5000)}',
+                             'tags': rng.sample(['a', 'b', 'c', 'd', 'e', 'f'], 3),
+                             'score': round(rng.random() * 100, 3), 'active': rng.random() < 0.5}) + '\n'
+        records.append(record)
+        total += len(record)
+    return ''.join(records).encode()[:size]
+
+
+def bench_codec(data: bytes, codec, chunk_size: int):
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    start = time.perf_counter()
+    packed = [pack_chunk(chunk, codec) if codec else chunk for chunk in chunks]
+    packed_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for chunk, stored in zip(chunks, packed):
+        if codec and unpack_chunk(stored) != chunk:
+            sys.exit(f'{codec}: chunk did not round-trip')
+    unpacked_time = time.perf_counter() - start
+    stored_bytes = sum(len(stored) for stored in packed)
+    return len(data) / stored_bytes, packed_time, unpacked_time
+
+
+def bench_cluster(data: bytes, codec, chunk_size: int):
+    fname = f'bench_compression_{codec or "none"}.dat'
+    args = json.dumps({'chunk_size': chunk_size, 'compression': codec or 'none'})
+    start = time.perf_counter()
+    reply = protocol.call(MASTER_HOST, MASTER_PORT, 'write', fname, args, payload=data, timeout=300)
+    write_time = time.perf_counter() - start
+    if not reply.status.startswith('SUCCESS'):
+        sys.exit(f'{fname}: {reply.status}')
+    start = time.perf_counter()
+    reply = protocol.call(MASTER_HOST, MASTER_PORT, 'read', fname, timeout=300)
+    read_time = time.perf_counter() - start
+    if reply.payload != data:
+        sys.exit(f'{fname}: read back {len(reply.payload)} bytes that do not match')
+    protocol.call(MASTER_HOST, MASTER_PORT, 'delete', fname)
+    return write_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunk compression benchmark')
+    parser.add_argument('--size', type=int, default=32 * 1024 * 1024, help='bytes per generated dataset')
+    parser.add_argument('--chunk-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--file', help='benchmark this file instead of the generated datasets')
+    parser.add_argument('--cluster', action='store_true',
+                        help='also time writes and reads through a running master')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            datasets = [(os.path.basename(args.file), f.read())]
+    else:
+        datasets = [('logs', log_data(args.size)), ('json', json_data(args.size)),
+                    ('random', os.urandom(args.size))]
+
+    header = f"{'data':>10} {'codec':>6} {'ratio':>7} {'pack MB/s':>10} {'unpack MB/s':>12}"
+    if args.cluster:
+        header += f" {'write MB/s':>11} {'read MB/s':>10}"
+    print(header)
+    for name, data in datasets:
+        mb = len(data) / (1024 * 1024)
+        for codec in [None] + list(CODECS):
+            ratio, packed_time, unpacked_time = bench_codec(data, codec, args.chunk_size)
+            if codec:
+                line = f"{name:>10} {codec:>6} {ratio:>7.2f} {mb / packed_time:>10.1f} {mb / unpacked_time:>12.1f}"
+            else:
+                line = f"{name:>10} {'none':>6} {ratio:>7.2f} {'-':>10} {'-':>12}"
+            if args.cluster:
+                write_time, read_time = bench_cluster(data, codec, args.chunk_size)
+                line += f" {mb / write_time:>11.1f} {mb / read_time:>10.1f}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
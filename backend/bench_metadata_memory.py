@@ -0,0 +1,83 @@
+import argparse
+import gc
+import hashlib
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from chunk_table import HASH_SIZE, ChunkTable
+
+# Builds the same synthetic namespace twice, once as per-chunk tuples in a
+# Dict[str, List[Tuple[int, List[int], bytes, int]]] + sizes and once in a
+# ChunkTable, and reports the traced heap bytes per chunk for each. Every
+# chunk carries its replica list, content hash and CRC, as the master
+# records them. Runs offline; no cluster needed.
+
+
+def placement(cid: int, rf: int, nodes: int) -> List[int]:
+    return [(cid + r) % nodes + 1 for r in range(rf)]
+
+
+def chunk_hash(i: int, cid: int) -> bytes:
+    return hashlib.blake2b(b'%d:%d' % (i, cid), digest_size=HASH_SIZE).digest()
+
+
+def chunk_crc(i: int, cid: int) -> int:
+    return (i * 1000003 + cid) & 0xFFFFFFFF or 1
+
+
+def build_dict(files: int, chunks: int, rf: int, nodes: int):
+    metadata: Dict[str, List[Tuple[int, List[int], bytes, int]]] = {}
+    sizes: Dict[str, int] = {}
+    for i in range(files):
+        fname = f'dir{i % 100}/file{i}.dat'
+        metadata[fname] = [(cid, placement(cid, rf, nodes), chunk_hash(i, cid), chunk_crc(i, cid))
+                           for cid in range(chunks)]
+        sizes[fname] = chunks * 1024
+    return metadata, sizes
+
+
+def build_table(files: int, chunks: int, rf: int, nodes: int):
+    table = ChunkTable(width=rf)
+    for i in range(files):
+        fname = f'dir{i % 100}/file{i}.dat'
+        table.put(fname, [(cid, placement(cid, rf, nodes)) for cid in range(chunks)], chunks * 1024, 1024,
+                  [chunk_hash(i, cid) for cid in range(chunks)])
+        table.set_crcs(fname, {cid: [chunk_crc(i, cid)] for cid in range(chunks)})
+    return table
+
+
+def measure(build: Callable, *args) -> Tuple[int, float, object]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    result = build(*args)
+    elapsed = time.time() - start
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Master metadata memory benchmark')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--chunks-per-file', type=int, default=1000)
+    parser.add_argument('--rf', type=int, default=2)
+    parser.add_argument('--nodes', type=int, default=3)
+    args = parser.parse_args()
+
+    total = args.files * args.chunks_per_file
+    print(f"{args.files} files x {args.chunks_per_file} chunks = {total} chunks, RF={args.rf}")
+    print(f"{'layout':>12} {'total MB':>10} {'bytes/chunk':>12} {'build s':>8}")
+    results = {}
+    for name, build in (('dict/list', build_dict), ('chunk table', build_table)):
+        used, elapsed, result = measure(build, args.files, args.chunks_per_file, args.rf, args.nodes)
+        results[name] = used
+        print(f"{name:>12} {used / 1e6:>10.1f} {used / total:>12.1f} {elapsed:>8.2f}")
+        del result
+    print(f"Chunk table uses {results['dict/list'] / results['chunk table']:.1f}x less memory")
+
+
+if __name__ == '__main__':
+    main()
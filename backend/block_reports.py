@@ -0,0 +1,136 @@
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from chunk_table import ChunkTable
+from dedup import ContentIndex, chunk_key, is_content_name, split_versioned_name, stored_name
+
+# What each data node says it holds, built from the block reports that
+# ride on its heartbeats: a full listing replaces the node's set, an
+# incremental report applies deleted files, then removed and added chunks.
+# A node whose incremental report arrives before any full one (say, after a
+# master restart) is asked for a full listing.
+#
+# The audit compares the reports with the chunk table. A replica the table
+# lists but the node does not hold is missing; a chunk the node holds but
+# the table does not assign to it is an orphan. Writes and copies make both
+# briefly true in normal operation (a chunk lands on a node before it is
+# committed, and is committed before the node's next report), so a
+# discrepancy is only returned once it has persisted for its grace period.
+# Chunks of dedup files are looked up under their content name, and a
+# content object is an orphan on nodes the content index does not list.
+# Chunks stored under a version of a file other than its current one are
+# orphans too.
+
+Suspect = Tuple[str, int, str, int]
+
+
+class BlockMap:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes: Dict[int, Dict[str, Set[int]]] = {}
+        self.reported: Dict[int, float] = {}
+        self.suspects: Dict[Suspect, float] = {}
+        self.missing_found = 0
+        self.orphans_found = 0
+
+    def apply(self, nid: int, report: Dict) -> bool:
+        # Returns True if the node should send a full report next time.
+        with self.lock:
+            if report.get('full'):
+                self.nodes[nid] = {fname: set(cids) for fname, cids in report.get('chunks', {}).items()}
+                self.reported[nid] = time.time()
+                return False
+            held = self.nodes.get(nid)
+            if held is None:
+                return True
+            for fname in report.get('removed_files', []):
+                held.pop(fname, None)
+            for fname, cids in report.get('removed', {}).items():
+                chunks = held.get(fname)
+                if chunks is not None:
+                    chunks.difference_update(cids)
+                    if not chunks:
+                        del held[fname]
+            for fname, cids in report.get('added', {}).items():
+                held.setdefault(fname, set()).update(cids)
+            self.reported[nid] = time.time()
+            return False
+
+    def holds(self, nid: int, fname: str, cid: int) -> Optional[bool]:
+        with self.lock:
+            held = self.nodes.get(nid)
+            return None if held is None else cid in held.get(fname, ())
+
+    def audit(self, table: ChunkTable, alive: List[int], missing_grace: float, orphan_grace: float,
+              content: Optional[ContentIndex] = None, pending: Optional[Set[str]] = None
+              ) -> Tuple[List[Tuple[str, int, int]], List[Tuple[str, int, int]]]:
+        # Returns ([(fname, cid, nid) missing], [(fname, cid, nid) orphaned])
+        # for discrepancies older than their grace period. For erasure-coded
+        # files cid is the fragment's stored chunk id. Chunks stored under
+        # a name in `pending` (direct writes not committed yet) are never
+        # orphans.
+        now = time.time()
+        seen: Set[Suspect] = set()
+        missing: List[Tuple[str, int, int]] = []
+        orphans: List[Tuple[str, int, int]] = []
+
+        def suspect(kind: str, fname: str, cid: int, nid: int, grace: float, out: List) -> None:
+            key = (kind, nid, fname, cid)
+            seen.add(key)
+            if now - self.suspects.setdefault(key, now) >= grace:
+                out.append((fname, cid, nid))
+
+        with self.lock:
+            reported = [nid for nid in alive if nid in self.nodes]
+            for fname, entry in table.items():
+                listed = [nid for nid in reported if nid in entry.slots]
+                if not listed:
+                    continue
+                chunks = entry.chunks()
+                for nid in listed:
+                    held = self.nodes[nid]
+                    if entry.ec is not None:
+                        # Fragments are checked by their stored chunk id.
+                        frags = held.get(stored_name(fname, entry), ())
+                        for key, owner in enumerate(entry.slots):
+                            if owner == nid and key not in frags:
+                                suspect('missing', fname, key, nid, missing_grace, missing)
+                        continue
+                    for cid, replicas in chunks:
+                        name, key = chunk_key(fname, entry, cid)
+                        if nid in replicas and key not in held.get(name, ()):
+                            suspect('missing', fname, cid, nid, missing_grace, missing)
+            for nid in reported:
+                for fname, cids in self.nodes[nid].items():
+                    if is_content_name(fname):
+                        if content is not None and not content.holds(fname, nid):
+                            for cid in cids:
+                                suspect('orphan', fname, cid, nid, orphan_grace, orphans)
+                        continue
+                    if pending is not None and fname in pending:
+                        continue
+                    owner, version = split_versioned_name(fname)
+                    entry = table.entry(owner)
+                    for cid in cids:
+                        if entry is None or entry.version != version or not entry.assigned(cid, nid):
+                            suspect('orphan', fname, cid, nid, orphan_grace, orphans)
+            self.suspects = {key: first for key, first in self.suspects.items() if key in seen}
+            self.missing_found += len(missing)
+            self.orphans_found += len(orphans)
+        return missing, orphans
+
+    def stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                'nodes': {
+                    str(nid): {
+                        'chunks': sum(len(cids) for cids in held.values()),
+                        'last_report': self.reported.get(nid, 0),
+                    }
+                    for nid, held in sorted(self.nodes.items())
+                },
+                'suspects': len(self.suspects),
+                'missing_found': self.missing_found,
+                'orphans_found': self.orphans_found,
+            }
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+# Byte-budgeted LRU cache for chunk contents on a data node. Writes go
+# through it (the new contents replace any cached copy), appends and deletes
+# invalidate. A read miss takes a load ticket before reading the store and
+# only fills the cache if no write or invalidation for that chunk happened
+# in between, so a slow read can never cache contents that are already
+# stale.
+
+Key = Tuple[str, int]
+
+
+class ChunkCache:
+    def __init__(self, budget: int):
+        self.budget = max(0, budget)
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[Key, bytes]' = OrderedDict()
+        self.by_file: Dict[str, Set[int]] = {}
+        self.loads: Dict[Key, int] = {}
+        self.next_ticket = 0
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Key) -> Optional[bytes]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def begin_load(self, key: Key) -> int:
+        with self.lock:
+            self.next_ticket += 1
+            self.loads[key] = self.next_ticket
+            return self.next_ticket
+
+    def fill(self, key: Key, value, ticket: int) -> None:
+        with self.lock:
+            if self.loads.get(key) != ticket:
+                return
+            del self.loads[key]
+            self._store(key, value)
+
+    def end_load(self, key: Key, ticket: int) -> None:
+        # Gives up a load that will not fill the cache (nothing to cache,
+        # or the chunk is sent zero-copy). A no-op after fill().
+        with self.lock:
+            if self.loads.get(key) == ticket:
+                del self.loads[key]
+
+    def put(self, key: Key, value) -> None:
+        with self.lock:
+            self.loads.pop(key, None)
+            self._store(key, value)
+
+    def invalidate(self, key: Key) -> None:
+        with self.lock:
+            self.loads.pop(key, None)
+            self._remove(key)
+
+    def invalidate_file(self, fname: str) -> None:
+        with self.lock:
+            for key in [k for k in self.loads if k[0] == fname]:
+                del self.loads[key]
+            for cid in list(self.by_file.get(fname, ())):
+                self._remove((fname, cid))
+
+    def _store(self, key: Key, value) -> None:
+        self._remove(key)
+        if len(value) > self.budget:
+            return
+        self.entries[key] = value
+        self.by_file.setdefault(key[0], set()).add(key[1])
+        self.used += len(value)
+        while self.used > self.budget:
+            old_key, _ = next(iter(self.entries.items()))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def _remove(self, key: Key) -> None:
+        value = self.entries.pop(key, None)
+        if value is None:
+            return
+        self.used -= len(value)
+        cids = self.by_file.get(key[0])
+        if cids is not None:
+            cids.discard(key[1])
+            if not cids:
+                del self.by_file[key[0]]
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'budget_bytes': self.budget,
+                'used_bytes': self.used,
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
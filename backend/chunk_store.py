@@ -0,0 +1,516 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# Storage backends for data node chunks. Both expose the same calls:
+# write, append (at an explicit offset), read, open_ranges, checksum,
+# delete, delete_file and stats. open_ranges returns open files and the
+# (offset, length) ranges holding a chunk so it can be sent with sendfile;
+# the caller closes the files.
+#
+# Every chunk has the CRC32 of its bytes recorded when it is written (and
+# extended on append), so the node can tell later whether what is on disk
+# is still what it was given; checksum() returns it, or None for a chunk
+# written before checksums were kept.
+#
+# FileChunkStore keeps one `<fname>:<cid>.chunk` file per chunk and its
+# CRC in a `<fname>:<cid>.crc` file next to it. Whole-chunk writes replace
+# the file atomically, so a chunk being sent from an already open file is
+# never torn by an overwrite.
+#
+# SegmentChunkStore is log-structured: every mutation is appended as a
+# record to the active segment file and an in-memory index maps
+# (file, chunk) to the extents holding the chunk's bytes. Appends add an
+# extent rather than rewriting the chunk. Sealed segments whose live bytes
+# fall below `compact_ratio` are compacted by copying their live chunks
+# forward, and the index is rebuilt by scanning the segments on startup.
+#
+# Records carry a store-wide sequence number so replay is order-safe after
+# compaction has moved records between segments: a chunk copied forward
+# keeps the sequence number of the state it captures, and tombstones are
+# copied forward too until the segment holding them is the oldest one.
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+COMPACT_RATIO = 0.5
+COMPACT_INTERVAL = 30
+
+# crc, kind, seq, name_len, cid, offset, data_len; the crc covers the rest
+# of the header, the name and the data.
+RECORD = struct.Struct('!IBQHIQQ')
+PUT = 1
+APPEND = 2
+DELETE = 3
+DELETE_FILE = 4
+
+Extent = Tuple[int, int, int]
+FileRange = Tuple[BinaryIO, int, int]
+
+
+def read_ranges(ranges: List[FileRange]) -> bytes:
+    return b''.join(os.pread(f.fileno(), length, offset) for f, offset, length in ranges)
+
+
+def close_ranges(ranges: List[FileRange]) -> None:
+    for f in {id(f): f for f, _, _ in ranges}.values():
+        f.close()
+
+
+class FileChunkStore:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, fname: str, cid: int) -> str:
+        return os.path.join(self.root, f"{fname}:{cid}.chunk")
+
+    def crc_path(self, fname: str, cid: int) -> str:
+        return os.path.join(self.root, f"{fname}:{cid}.crc")
+
+    def _write_atomic(self, path: str, data) -> None:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def write(self, fname: str, cid: int, data) -> None:
+        full_path = self.path(fname, cid)
+        directory = os.path.dirname(full_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        # A crash between the two replaces leaves a chunk that fails its
+        # check, so it is re-replicated rather than served.
+        self._write_atomic(full_path, data)
+        self._write_atomic(self.crc_path(fname, cid), b'%08x' % zlib.crc32(data))
+
+    def append(self, fname: str, cid: int, offset: int, data) -> bool:
+        full_path = self.path(fname, cid)
+        if not os.path.exists(full_path):
+            if offset != 0:
+                return False
+            self.write(fname, cid, data)
+            return True
+        crc = self.checksum(fname, cid)
+        with open(full_path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < offset:
+                return False
+            if crc is None or size != offset:
+                f.seek(0)
+                crc = zlib.crc32(f.read(offset))
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+        self._write_atomic(self.crc_path(fname, cid), b'%08x' % zlib.crc32(data, crc))
+        return True
+
+    def checksum(self, fname: str, cid: int) -> Optional[int]:
+        try:
+            with open(self.crc_path(fname, cid), 'rb') as f:
+                return int(f.read(), 16)
+        except (OSError, ValueError):
+            return None
+
+    def read(self, fname: str, cid: int) -> Optional[bytes]:
+        path = self.path(fname, cid)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def open_ranges(self, fname: str, cid: int) -> Optional[List[FileRange]]:
+        try:
+            f = open(self.path(fname, cid), 'rb')
+        except FileNotFoundError:
+            return None
+        return [(f, 0, os.fstat(f.fileno()).st_size)]
+
+    def delete(self, fname: str, cid: int) -> None:
+        for path in (self.path(fname, cid), self.crc_path(fname, cid)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def delete_file(self, fname: str) -> int:
+        # Names with a directory part (content and versioned names) keep
+        # their chunks in a subdirectory of the root.
+        removed = 0
+        directory, base = os.path.split(os.path.join(self.root, fname))
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.startswith(f"{base}:") and entry.endswith(('.chunk', '.crc')):
+                try:
+                    os.remove(os.path.join(directory, entry))
+                    removed += entry.endswith('.chunk')
+                except Exception:
+                    pass
+        plain_path = os.path.join(self.root, fname)
+        if os.path.exists(plain_path):
+            try:
+                os.remove(plain_path)
+            except Exception:
+                pass
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def chunk_list(self) -> Dict[str, List[int]]:
+        chunks: Dict[str, List[int]] = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith('.chunk'):
+                    continue
+                rel = os.path.relpath(os.path.join(directory, name), self.root)
+                fname, _, cid = rel[:-len('.chunk')].replace(os.sep, '/').rpartition(':')
+                if fname and cid.isdigit():
+                    chunks.setdefault(fname, []).append(int(cid))
+        return chunks
+
+    def usage(self) -> Tuple[int, int]:
+        # (chunk count, bytes on disk), from a walk of the chunk files.
+        chunks = used = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.chunk'):
+                    try:
+                        used += os.path.getsize(os.path.join(directory, name))
+                    except OSError:
+                        continue
+                    chunks += 1
+        return chunks, used
+
+
+class ChunkEntry:
+    __slots__ = ('seq', 'extents', 'crc')
+
+    def __init__(self, seq: int, extents: List[Extent], crc: int):
+        self.seq = seq
+        self.extents = extents
+        self.crc = crc
+
+    @property
+    def length(self) -> int:
+        return sum(length for _, _, length in self.extents)
+
+
+class SegmentChunkStore:
+    def __init__(self, root: str, segment_size: int = SEGMENT_SIZE,
+                 compact_ratio: float = COMPACT_RATIO):
+        self.root = root
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index: Dict[str, Dict[int, ChunkEntry]] = {}
+        self.seg_size: Dict[int, int] = {}
+        self.seg_live: Dict[int, int] = {}
+        self.seq = 0
+        self.counters = {'compactions': 0, 'reclaimed_bytes': 0}
+        self._rebuild()
+        self.active_id = max(self.seg_size, default=0)
+        if not self.seg_size:
+            self.active_id = 1
+            self.seg_size[1] = 0
+            self.seg_live[1] = 0
+        self.active = open(self._path(self.active_id), 'ab')
+
+    def _path(self, seg: int) -> str:
+        return os.path.join(self.root, f'{seg:08d}.seg')
+
+    def _segment_ids(self) -> List[int]:
+        ids = []
+        for entry in os.listdir(self.root):
+            if entry.endswith('.seg') and entry[:-4].isdigit():
+                ids.append(int(entry[:-4]))
+        return sorted(ids)
+
+    # Index maintenance; callers hold the lock (or are the constructor).
+
+    def _set(self, fname: str, cid: int, seq: int, extents: List[Extent], crc: int) -> None:
+        chunks = self.index.setdefault(fname, {})
+        old = chunks.get(cid)
+        if old is not None:
+            for seg, _, length in old.extents:
+                self.seg_live[seg] -= length
+        for seg, _, length in extents:
+            self.seg_live[seg] = self.seg_live.get(seg, 0) + length
+        chunks[cid] = ChunkEntry(seq, extents, crc)
+
+    def _drop(self, fname: str, cid: int) -> None:
+        chunks = self.index.get(fname)
+        entry = chunks.pop(cid, None) if chunks is not None else None
+        if entry is None:
+            return
+        for seg, _, length in entry.extents:
+            self.seg_live[seg] -= length
+        if not chunks:
+            del self.index[fname]
+
+    def _lookup(self, fname: str, cid: int) -> Optional[ChunkEntry]:
+        chunks = self.index.get(fname)
+        return chunks.get(cid) if chunks is not None else None
+
+    @staticmethod
+    def _trim(extents: List[Extent], offset: int) -> List[Extent]:
+        kept: List[Extent] = []
+        remaining = offset
+        for seg, pos, length in extents:
+            if remaining <= 0:
+                break
+            kept.append((seg, pos, min(length, remaining)))
+            remaining -= length
+        return kept
+
+    def _extended_crc(self, entry: Optional[ChunkEntry], offset: int, data) -> int:
+        # CRC of the chunk after `data` is written at `offset`; only an
+        # append that overlaps the current end has to reread the prefix.
+        if entry is None:
+            return zlib.crc32(data)
+        if entry.length == offset:
+            return zlib.crc32(data, entry.crc)
+        ranges = self._open_extents(self._trim(entry.extents, offset))
+        try:
+            return zlib.crc32(data, zlib.crc32(read_ranges(ranges)))
+        finally:
+            close_ranges(ranges)
+
+    def _append_record(self, kind: int, seq: int, fname: str, cid: int = 0,
+                       offset: int = 0, data=b'') -> Tuple[int, int]:
+        if self.seg_size[self.active_id] >= self.segment_size:
+            self.active.close()
+            self.active_id += 1
+            self.seg_size[self.active_id] = 0
+            self.seg_live[self.active_id] = 0
+            self.active = open(self._path(self.active_id), 'ab')
+        name_b = fname.encode()
+        header = RECORD.pack(0, kind, seq, len(name_b), cid, offset, len(data))[4:]
+        crc = zlib.crc32(data, zlib.crc32(name_b, zlib.crc32(header))) & 0xFFFFFFFF
+        self.active.write(struct.pack('!I', crc) + header + name_b)
+        self.active.write(data)
+        self.active.flush()
+        start = self.seg_size[self.active_id]
+        self.seg_size[self.active_id] += RECORD.size + len(name_b) + len(data)
+        return self.active_id, start + RECORD.size + len(name_b)
+
+    # Chunk operations.
+
+    def write(self, fname: str, cid: int, data) -> None:
+        with self.lock:
+            self.seq += 1
+            seg, pos = self._append_record(PUT, self.seq, fname, cid, 0, data)
+            self._set(fname, cid, self.seq, [(seg, pos, len(data))], zlib.crc32(data))
+
+    def append(self, fname: str, cid: int, offset: int, data) -> bool:
+        with self.lock:
+            entry = self._lookup(fname, cid)
+            if (entry.length if entry is not None else 0) < offset:
+                return False
+            crc = self._extended_crc(entry, offset, data)
+            self.seq += 1
+            seg, pos = self._append_record(APPEND, self.seq, fname, cid, offset, data)
+            extents = self._trim(entry.extents, offset) if entry is not None else []
+            self._set(fname, cid, self.seq, extents + [(seg, pos, len(data))], crc)
+            return True
+
+    def read(self, fname: str, cid: int) -> Optional[bytes]:
+        ranges = self.open_ranges(fname, cid)
+        if ranges is None:
+            return None
+        try:
+            return read_ranges(ranges)
+        finally:
+            close_ranges(ranges)
+
+    def open_ranges(self, fname: str, cid: int) -> Optional[List[FileRange]]:
+        # Segments are only removed under the lock, and written extents never
+        # change, so files opened here stay valid after it is released.
+        with self.lock:
+            entry = self._lookup(fname, cid)
+            if entry is None:
+                return None
+            return self._open_extents(entry.extents)
+
+    def _open_extents(self, extents: List[Extent]) -> List[FileRange]:
+        files: Dict[int, BinaryIO] = {}
+        try:
+            for seg, _, _ in extents:
+                if seg not in files:
+                    files[seg] = open(self._path(seg), 'rb')
+        except OSError:
+            for f in files.values():
+                f.close()
+            raise
+        return [(files[seg], pos, length) for seg, pos, length in extents]
+
+    def checksum(self, fname: str, cid: int) -> Optional[int]:
+        with self.lock:
+            entry = self._lookup(fname, cid)
+            return entry.crc if entry is not None else None
+
+    def delete(self, fname: str, cid: int) -> None:
+        with self.lock:
+            if self._lookup(fname, cid) is None:
+                return
+            self.seq += 1
+            self._append_record(DELETE, self.seq, fname, cid)
+            self._drop(fname, cid)
+
+    def delete_file(self, fname: str) -> int:
+        with self.lock:
+            chunks = self.index.get(fname)
+            if not chunks:
+                return 0
+            cids = list(chunks)
+            self.seq += 1
+            self._append_record(DELETE_FILE, self.seq, fname)
+            for cid in cids:
+                self._drop(fname, cid)
+            return len(cids)
+
+    # Startup and compaction.
+
+    def _scan(self, seg: int, with_data: bool = True):
+        # Yields (kind, seq, fname, cid, offset, data_pos, data_len, data)
+        # and stops at the first torn or corrupt record.
+        with open(self._path(seg), 'rb') as f:
+            pos = 0
+            while True:
+                raw = f.read(RECORD.size)
+                if len(raw) < RECORD.size:
+                    break
+                crc, kind, seq, name_len, cid, offset, data_len = RECORD.unpack(raw)
+                name_b = f.read(name_len)
+                data_pos = pos + RECORD.size + name_len
+                if with_data:
+                    data = f.read(data_len)
+                    if len(name_b) < name_len or len(data) < data_len or \
+                            zlib.crc32(data, zlib.crc32(name_b, zlib.crc32(raw[4:]))) & 0xFFFFFFFF != crc:
+                        break
+                else:
+                    data = b''
+                    f.seek(data_len, os.SEEK_CUR)
+                yield kind, seq, name_b.decode(), cid, offset, data_pos, data_len, data
+                pos = data_pos + data_len
+
+    def _rebuild(self) -> None:
+        deleted: Dict[Tuple[str, int], int] = {}
+        file_deleted: Dict[str, int] = {}
+        for seg in self._segment_ids():
+            end = 0
+            self.seg_live.setdefault(seg, 0)
+            for kind, seq, fname, cid, offset, pos, length, data in self._scan(seg):
+                end = pos + length
+                self.seq = max(self.seq, seq)
+                floor = max(file_deleted.get(fname, 0), deleted.get((fname, cid), 0))
+                entry = self._lookup(fname, cid)
+                current = max(floor, entry.seq if entry is not None else 0)
+                if kind == PUT:
+                    # A compacted copy shares the sequence number of the
+                    # state it captured, so it wins ties.
+                    if seq >= current:
+                        self._set(fname, cid, seq, [(seg, pos, length)], zlib.crc32(data))
+                elif kind == APPEND:
+                    if seq > current and (entry.length if entry is not None else 0) >= offset:
+                        crc = self._extended_crc(entry, offset, data)
+                        extents = self._trim(entry.extents, offset) if entry is not None else []
+                        self._set(fname, cid, seq, extents + [(seg, pos, length)], crc)
+                elif kind == DELETE:
+                    deleted[(fname, cid)] = max(seq, deleted.get((fname, cid), 0))
+                    if entry is not None and entry.seq < seq:
+                        self._drop(fname, cid)
+                elif kind == DELETE_FILE:
+                    file_deleted[fname] = max(seq, file_deleted.get(fname, 0))
+                    for chunk_id, chunk in list(self.index.get(fname, {}).items()):
+                        if chunk.seq < seq:
+                            self._drop(fname, chunk_id)
+            size = os.path.getsize(self._path(seg))
+            if end < size:
+                print(f"Segment {seg}: dropping {size - end} bytes after the last valid record")
+                with open(self._path(seg), 'r+b') as f:
+                    f.truncate(end)
+            self.seg_size[seg] = end
+
+    def compact(self) -> int:
+        with self.lock:
+            victims = [seg for seg in sorted(self.seg_size)
+                       if seg != self.active_id and self.seg_live.get(seg, 0) < self.seg_size[seg] * self.compact_ratio]
+        reclaimed = 0
+        for seg in victims:
+            reclaimed += self._compact_segment(seg)
+        return reclaimed
+
+    def _compact_segment(self, seg: int) -> int:
+        with self.lock:
+            oldest = seg == min(self.seg_size)
+        moved = 0
+        for kind, seq, fname, cid, offset, pos, length, _ in list(self._scan(seg, with_data=False)):
+            with self.lock:
+                if kind in (PUT, APPEND):
+                    entry = self._lookup(fname, cid)
+                    if entry is None or not any(s == seg for s, _, _ in entry.extents):
+                        continue
+                    ranges = self._open_extents(entry.extents)
+                    try:
+                        data = read_ranges(ranges)
+                    finally:
+                        close_ranges(ranges)
+                    # The recorded CRC moves with the data, so damage picked
+                    # up before the copy is still caught by the scrubber.
+                    new_seg, new_pos = self._append_record(PUT, entry.seq, fname, cid, 0, data)
+                    self._set(fname, cid, entry.seq, [(new_seg, new_pos, len(data))], entry.crc)
+                    moved += len(data)
+                elif not oldest:
+                    self._append_record(kind, seq, fname, cid)
+        with self.lock:
+            os.fsync(self.active.fileno())
+            size = self.seg_size.pop(seg)
+            self.seg_live.pop(seg, None)
+            os.remove(self._path(seg))
+            self.counters['compactions'] += 1
+            self.counters['reclaimed_bytes'] += size - moved
+        return size - moved
+
+    def run_compaction(self, interval: float = COMPACT_INTERVAL) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                reclaimed = self.compact()
+                if reclaimed:
+                    print(f"Compaction reclaimed {reclaimed} bytes")
+            except Exception as e:
+                print(f"Compaction failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'segments': len(self.seg_size),
+                'chunks': sum(len(chunks) for chunks in self.index.values()),
+                'live_bytes': sum(self.seg_live.values()),
+                'total_bytes': sum(self.seg_size.values()),
+                'compactions': self.counters['compactions'],
+                'reclaimed_bytes': self.counters['reclaimed_bytes'],
+            }
+
+    def chunk_list(self) -> Dict[str, List[int]]:
+        with self.lock:
+            return {fname: list(chunks) for fname, chunks in self.index.items()}
+
+    def usage(self) -> Tuple[int, int]:
+        # Segment bytes include dead records until they are compacted away.
+        with self.lock:
+            return sum(len(chunks) for chunks in self.index.values()), sum(self.seg_size.values())
+
+    def close(self) -> None:
+        with self.lock:
+            self.active.close()
+
+
+def open_store(kind: str, root: str):
+    if kind == 'segments':
+        return SegmentChunkStore(os.path.join(root, 'segments'))
+    return FileChunkStore(root)
@@ -0,0 +1,301 @@
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Compact in-memory namespace for the master. Chunk ids are dense (chunk i
+# of a file has id i), so no ids are stored at all: each file keeps its
+# replica node ids in one flat array('H') with `width` slots per chunk and
+# 0 marking an unused slot (data node ids start at 1). A chunk costs
+# 2 * width bytes instead of a tuple, a list and their int objects. Each
+# file also records the chunk size it was created with.
+#
+# Files may also record a content hash per chunk (HASH_SIZE bytes each, in
+# one bytearray, all zeros meaning unknown) so an overwrite can skip chunks
+# whose content did not change. Files created in dedup mode are flagged;
+# their chunks are stored under those hashes (see dedup.py).
+#
+# An erasure-coded file records its (k, m) scheme and has k + m slots per
+# chunk, one per fragment position, where 0 marks a lost fragment; row()
+# returns that positional list (see erasure.py).
+#
+# A compressed file records its codec name; its stored chunks carry their
+# own codec header (see compression.py).
+#
+# A file last written by a direct client records the version its chunks
+# are stored under (0 for the plain file name, see dedup.py).
+#
+# Each file also keeps the CRC32 of the bytes stored on the data nodes for
+# every chunk (for every fragment of an erasure-coded chunk), in one
+# array('I') with 0 meaning unknown, so readers can tell a damaged copy
+# from a good one.
+#
+# Readers get plain (cid, [node, ...]) lists back; a file whose replica
+# width has to grow is rebuilt and swapped in, so a reader never sees a
+# half-updated layout.
+#
+# Listings are served in name order from a sorted copy of the names that is
+# rebuilt on the first listing after a file is added or removed, so paging
+# through a large namespace costs a bisect per page, not a sort.
+#
+# The table also indexes which files have chunks on each node, so the
+# chunks a dead node took with it are found without walking the whole
+# namespace. The index may list a file that has since moved off a node;
+# files_on() drops such names as it meets them.
+
+Chunks = List[Tuple[int, List[int]]]
+HASH_SIZE = 16
+UNKNOWN_HASH = bytes(HASH_SIZE)
+
+
+class FileEntry:
+    __slots__ = ('size', 'chunk_size', 'width', 'slots', 'hashes', 'dedup', 'ec', 'codec', 'crcs', 'version')
+
+    def __init__(self, size: Optional[int], chunk_size: int, width: int = 2, dedup: bool = False,
+                 ec: Optional[Tuple[int, int]] = None, codec: Optional[str] = None, version: int = 0):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.width = max(1, width)
+        self.slots = array('H')
+        self.hashes = bytearray()
+        self.dedup = dedup
+        self.ec = ec
+        self.codec = codec
+        self.crcs = array('I')
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.slots) // self.width
+
+    def replicas(self, cid: int) -> List[int]:
+        start = cid * self.width
+        return [nid for nid in self.slots[start:start + self.width] if nid]
+
+    def row(self, cid: int) -> List[int]:
+        # Replicas, or the node per fragment position of an erasure-coded chunk.
+        if self.ec is None:
+            return self.replicas(cid)
+        start = cid * self.width
+        return list(self.slots[start:start + self.width])
+
+    def assigned(self, key: int, nid: int) -> bool:
+        # Whether node nid should hold chunk `key` as named on the data
+        # nodes (the fragment id cid * (k + m) + position if erasure-coded).
+        if self.ec is None:
+            return key < len(self) and nid in self.replicas(key)
+        return key < len(self.slots) and self.slots[key] == nid
+
+    def chunks(self) -> Chunks:
+        width = self.width
+        slots = self.slots
+        return [(cid, [nid for nid in slots[start:start + width] if nid])
+                for cid, start in enumerate(range(0, len(slots), width))]
+
+    def hash(self, cid: int) -> Optional[bytes]:
+        digest = bytes(self.hashes[cid * HASH_SIZE:(cid + 1) * HASH_SIZE])
+        return digest if len(digest) == HASH_SIZE and digest != UNKNOWN_HASH else None
+
+    def set_hash(self, cid: int, digest: Optional[bytes]) -> None:
+        end = (cid + 1) * HASH_SIZE
+        if len(self.hashes) < end:
+            if digest is None:
+                return
+            self.hashes.extend(bytes(end - len(self.hashes)))
+        self.hashes[end - HASH_SIZE:end] = digest or UNKNOWN_HASH
+
+    def crc_width(self) -> int:
+        return self.width if self.ec else 1
+
+    def crc(self, cid: int, pos: int = 0) -> Optional[int]:
+        # CRC of the chunk's stored bytes (of fragment `pos` if erasure-coded).
+        idx = cid * self.crc_width() + pos
+        return (self.crcs[idx] or None) if idx < len(self.crcs) else None
+
+    def chunk_crcs(self, cid: int) -> List[int]:
+        width = self.crc_width()
+        row = list(self.crcs[cid * width:(cid + 1) * width])
+        return row + [0] * (width - len(row))
+
+    def set_crcs(self, cid: int, crcs: List[int]) -> None:
+        width = self.crc_width()
+        end = (cid + 1) * width
+        if len(self.crcs) < end:
+            if not any(crcs):
+                return
+            self.crcs.extend([0] * (end - len(self.crcs)))
+        self.crcs[end - width:end] = array('I', (list(crcs) + [0] * width)[:width])
+
+    def set_replicas(self, cid: int, replicas: List[int]) -> None:
+        row = array('H', replicas)
+        row.extend([0] * (self.width - len(row)))
+        start = cid * self.width
+        if start == len(self.slots):
+            self.slots.extend(row)
+        elif start < len(self.slots):
+            self.slots[start:start + self.width] = row
+        else:
+            raise IndexError(f'Chunk {cid} is past the end of a {len(self)}-chunk file')
+
+
+class ChunkTable:
+    def __init__(self, width: int = 2):
+        self.width = width
+        self.files: Dict[str, FileEntry] = {}
+        # Bumped after every add or remove; the sorted names are tagged with
+        # the generation they were taken at and reused only while it holds.
+        self.generation = 0
+        self.sorted_names: Tuple[int, List[str]] = (-1, [])
+        self.node_files: Dict[int, Set[str]] = {}
+
+    def __contains__(self, fname: str) -> bool:
+        return fname in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def names(self) -> List[str]:
+        return list(self.files)
+
+    def page(self, prefix: str = '', after: str = '', limit: int = 1000) -> Tuple[List[str], Optional[str], int]:
+        # Up to `limit` names starting with `prefix` that sort after
+        # `after`, the name to continue after (None on the last page) and
+        # how many names match `prefix` in all.
+        generation, names = self.sorted_names
+        if generation != self.generation:
+            generation = self.generation
+            names = sorted(self.files)
+            self.sorted_names = (generation, names)
+        first = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + '\U0010ffff', first) if prefix else len(names)
+        start = max(first, bisect_right(names, after, first, end)) if after else first
+        found = names[start:min(end, start + limit)]
+        more = start + limit < end
+        return found, found[-1] if more and found else None, end - first
+
+    def files_on(self, nid: int) -> List[Tuple[str, FileEntry]]:
+        # The files with at least one chunk (or fragment) on node nid.
+        found = []
+        names = self.node_files.get(nid, set())
+        for fname in list(names):
+            entry = self.files.get(fname)
+            if entry is not None and nid in entry.slots:
+                found.append((fname, entry))
+                continue
+            names.discard(fname)
+            # Re-check in case the file was put back on the node meanwhile.
+            entry = self.files.get(fname)
+            if entry is not None and nid in entry.slots:
+                names.add(fname)
+                found.append((fname, entry))
+        return found
+
+    def _index(self, fname: str, nids: Iterable[int]) -> None:
+        for nid in set(nids):
+            if nid:
+                self.node_files.setdefault(nid, set()).add(fname)
+
+    def items(self) -> List[Tuple[str, FileEntry]]:
+        return list(self.files.items())
+
+    def entry(self, fname: str) -> Optional[FileEntry]:
+        return self.files.get(fname)
+
+    def chunk_count(self, fname: str) -> int:
+        entry = self.files.get(fname)
+        return len(entry) if entry is not None else 0
+
+    def chunks(self, fname: str) -> Chunks:
+        entry = self.files.get(fname)
+        return entry.chunks() if entry is not None else []
+
+    def replicas(self, fname: str, cid: int) -> List[int]:
+        entry = self.files.get(fname)
+        if entry is None or cid >= len(entry):
+            return []
+        return entry.replicas(cid)
+
+    def size(self, fname: str) -> Optional[int]:
+        entry = self.files.get(fname)
+        return entry.size if entry is not None else None
+
+    def set_size(self, fname: str, size: Optional[int]) -> None:
+        entry = self.files.get(fname)
+        if entry is not None:
+            entry.size = size
+
+    def chunk_size(self, fname: str) -> Optional[int]:
+        entry = self.files.get(fname)
+        return entry.chunk_size if entry is not None else None
+
+    def hash(self, fname: str, cid: int) -> Optional[bytes]:
+        entry = self.files.get(fname)
+        return entry.hash(cid) if entry is not None else None
+
+    def set_hashes(self, fname: str, hashes: Dict[int, Optional[bytes]]) -> None:
+        entry = self.files.get(fname)
+        if entry is not None:
+            for cid, digest in sorted(hashes.items()):
+                entry.set_hash(cid, digest)
+
+    def set_crcs(self, fname: str, crcs: Dict[int, List[int]]) -> None:
+        entry = self.files.get(fname)
+        if entry is not None:
+            for cid, row in sorted(crcs.items()):
+                entry.set_crcs(cid, row)
+
+    def _build(self, chunks: Iterable[Tuple[int, List[int]]], size: Optional[int],
+               chunk_size: int, width: int, dedup: bool = False,
+               ec: Optional[Tuple[int, int]] = None, codec: Optional[str] = None, version: int = 0) -> FileEntry:
+        entry = FileEntry(size, chunk_size, width, dedup, ec, codec, version)
+        flat: List[int] = []
+        for cid, replicas in chunks:
+            if cid * width != len(flat):
+                raise IndexError(f'Chunk {cid} out of order in a {len(flat) // width}-chunk file')
+            flat.extend(replicas)
+            flat.extend([0] * (width - len(replicas)))
+        entry.slots = array('H', flat)
+        return entry
+
+    def put(self, fname: str, chunks: Chunks, size: Optional[int], chunk_size: int,
+            hashes: Optional[List[Optional[bytes]]] = None, dedup: bool = False,
+            ec: Optional[Tuple[int, int]] = None, codec: Optional[str] = None, version: int = 0) -> None:
+        width = sum(ec) if ec else max([self.width] + [len(replicas) for _, replicas in chunks])
+        entry = self._build(chunks, size, chunk_size, width, dedup, ec, codec, version)
+        if hashes and any(hashes):
+            entry.hashes = bytearray(b''.join(digest or UNKNOWN_HASH for digest in hashes))
+        added = fname not in self.files
+        fname = sys.intern(fname)
+        self.files[fname] = entry
+        self._index(fname, entry.slots)
+        if added:
+            self.generation += 1
+
+    def update(self, fname: str, chunks: Chunks) -> None:
+        # Upsert by chunk id; ids past the end must extend the file in order.
+        # Updates to a file that has been removed meanwhile are dropped.
+        entry = self.files.get(fname)
+        if entry is None:
+            return
+        width = max(len(replicas) for _, replicas in chunks) if chunks else 0
+        if width > entry.width:
+            merged = dict(entry.chunks())
+            merged.update(chunks)
+            rebuilt = self._build(sorted(merged.items()), entry.size, entry.chunk_size, width,
+                                  entry.dedup, entry.ec, entry.codec, entry.version)
+            rebuilt.hashes = entry.hashes
+            rebuilt.crcs = entry.crcs
+            self.files[fname] = rebuilt
+        else:
+            for cid, replicas in chunks:
+                entry.set_replicas(cid, replicas)
+        self._index(fname, [nid for _, replicas in chunks for nid in replicas])
+
+    def set_replicas(self, fname: str, cid: int, replicas: List[int]) -> None:
+        self.update(fname, [(cid, replicas)])
+
+    def remove(self, fname: str) -> None:
+        entry = self.files.pop(fname, None)
+        if entry is not None:
+            self.generation += 1
+            for nid in set(entry.slots):
+                self.node_files.get(nid, set()).discard(fname)
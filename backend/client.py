@@ -1,25 +1,83 @@
-import socket
+import argparse
 import json
 import sys
 
+import protocol
+from direct_io import DirectClient
+
 MASTER_HOST = 'localhost'
 MASTER_PORT = 5000
+direct_client = None
+chunk_size = None
+ec = None
+compression = None
+
+def send_command(cmd: str, fname: str, data: str = ''):
+    # Erasure-coded and compressed writes are encoded by the master, even
+    # with --direct.
+    if direct_client is not None and (cmd == 'read' or (cmd in ('create', 'write') and ec is None and compression is None)):
+        send_direct(cmd, fname, data)
+        return
+    args = ''
+    if cmd in ('create', 'write', 'append'):
+        request_args = {}
+        if chunk_size is not None:
+            request_args['chunk_size'] = chunk_size
+        if ec is not None:
+            request_args['ec'] = ec
+        if compression is not None:
+            request_args['compression'] = compression
+        args = json.dumps(request_args) if request_args else ''
+    try:
+        reply = protocol.call(MASTER_HOST, MASTER_PORT, cmd, fname, args, payload=data.encode())
+        if reply.payload:
+            print(reply.payload.decode(errors='replace'))
+        if reply.status != 'OK' or not reply.payload:
+            print(reply.status)
+    except Exception as e:
+        print(f"ERROR: {e}")
 
-def send_command(cmd: str, fname: str, args: str = ''):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def read_range(fname: str, offset: int, length: int):
     try:
-        sock.connect((MASTER_HOST, MASTER_PORT))
-        msg = f"{cmd}:{fname}:{args}"
-        sock.send(msg.encode())
-        response = sock.recv(4096).decode()
-        print(response)
+        if direct_client is not None:
+            print(direct_client.read_range(fname, offset, length).decode(errors='replace'))
+            return
+        args = json.dumps({'offset': offset, 'length': length})
+        reply = protocol.call(MASTER_HOST, MASTER_PORT, 'read_range', fname, args)
+        if reply.status != 'OK':
+            print(reply.status)
+        else:
+            print(reply.payload.decode(errors='replace'))
+    except Exception as e:
+        print(f"ERROR: {e}")
+
+def send_direct(cmd: str, fname: str, data: str = ''):
+    try:
+        if cmd == 'read':
+            print(direct_client.read(fname).decode(errors='replace'))
+        else:
+            print(direct_client.write(fname, data.encode(), chunk_size))
     except Exception as e:
         print(f"ERROR: {e}")
-    finally:
-        sock.close()
 
 def main():
-    print("Mini DFS Client. Commands: create <file> <content>, read <file>, delete <file>, list, write <file> <data>, append <file> <data>, exit")
+    global direct_client, chunk_size, ec, compression
+    parser = argparse.ArgumentParser(description='Mini DFS client')
+    parser.add_argument('--direct', action='store_true',
+                        help='read and write chunk data directly against the data nodes')
+    parser.add_argument('--chunk-size', type=int,
+                        help='chunk size in bytes for files this client creates (default: cluster default)')
+    parser.add_argument('--ec', metavar='K+M',
+                        help='store files this client creates erasure-coded, e.g. 4+2 (default: replicated)')
+    parser.add_argument('--compression', choices=['none', 'zlib', 'lzma'],
+                        help='compress chunks of files this client writes (default: cluster default)')
+    args = parser.parse_args()
+    chunk_size = args.chunk_size
+    ec = args.ec
+    compression = args.compression
+    if args.direct:
+        direct_client = DirectClient(MASTER_HOST, MASTER_PORT)
+    print("Mini DFS Client. Commands: create <file> <content>, read <file>, read_range <file> <offset> <length>, delete <file>, list, write <file> <data>, append <file> <data>, exit")
     while True:
         try:
             line = input("> ").strip()
@@ -38,6 +96,14 @@ def main():
                 send_command('append', fname, data)
                 continue
 
+            if line.startswith('read_range '):
+                parts = line.split()
+                if len(parts) == 4 and parts[2].isdigit() and parts[3].isdigit():
+                    read_range(parts[1], int(parts[2]), int(parts[3]))
+                else:
+                    print("Invalid command")
+                continue
+
             parts = line.split(maxsplit=2)
             cmd = parts[0].lower()
             if cmd == 'create' and len(parts) >= 3:
@@ -0,0 +1,97 @@
+import lzma
+import threading
+import zlib
+from typing import Dict, Optional
+
+# Transparent chunk compression for files that ask for a codec. Every
+# stored chunk of such a file starts with one byte naming the codec that
+# was actually applied to it, so a chunk that does not compress well is
+# simply stored raw and readers never need more than the chunk itself.
+# Whether to try is decided on a SAMPLE_SIZE prefix first, so incompressible
+# data (media, archives, encrypted blobs) costs one small attempt, not a
+# full pass. A compressed chunk is kept only if it saves at least MIN_SAVING
+# of its size.
+
+RAW = 0
+CODECS = {'zlib': 1, 'lzma': 2}
+NAMES = {tag: name for name, tag in CODECS.items()}
+ZLIB_LEVEL = 6
+LZMA_PRESET = 1
+SAMPLE_SIZE = 64 * 1024
+MIN_SAVING = 0.1
+
+
+def parse_codec(name) -> Optional[str]:
+    # 'zlib' or 'lzma'; None for 'none'/null. Raises ValueError otherwise.
+    if name in (None, '', 'none'):
+        return None
+    if name not in CODECS:
+        raise ValueError(name)
+    return name
+
+
+def compress(data, codec: str) -> bytes:
+    if codec == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    return lzma.compress(data, preset=LZMA_PRESET)
+
+
+def worth_compressing(data, codec: str) -> bool:
+    if len(data) <= SAMPLE_SIZE:
+        return True
+    sample = data[:SAMPLE_SIZE]
+    return len(compress(sample, codec)) <= len(sample) * (1 - MIN_SAVING)
+
+
+def pack_chunk(data, codec: str) -> bytes:
+    if data and worth_compressing(data, codec):
+        packed = compress(data, codec)
+        if len(packed) <= len(data) * (1 - MIN_SAVING):
+            return bytes([CODECS[codec]]) + packed
+    return bytes([RAW]) + bytes(data)
+
+
+def unpack_chunk(stored) -> bytes:
+    # Raises ValueError for a chunk that is not a valid packed chunk.
+    stored = memoryview(stored)
+    if not stored:
+        raise ValueError('empty chunk')
+    tag, body = stored[0], stored[1:]
+    try:
+        if tag == RAW:
+            return bytes(body)
+        if tag == CODECS['zlib']:
+            return zlib.decompress(body)
+        if tag == CODECS['lzma']:
+            return lzma.decompress(body)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f'corrupt {NAMES[tag]} chunk: {e}')
+    raise ValueError(f'unknown chunk codec {tag}')
+
+
+class CodecStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks_compressed = 0
+        self.chunks_raw = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, raw_len: int, stored) -> None:
+        with self.lock:
+            if stored[0] == RAW:
+                self.chunks_raw += 1
+            else:
+                self.chunks_compressed += 1
+            self.bytes_in += raw_len
+            self.bytes_out += len(stored)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                'chunks_compressed': self.chunks_compressed,
+                'chunks_raw': self.chunks_raw,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_in / self.bytes_out, 3) if self.bytes_out else 1.0,
+            }
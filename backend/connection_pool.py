@@ -0,0 +1,289 @@
+import itertools
+import socket
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import protocol
+
+
+class NodeConnection:
+    # One persistent socket to a data node. Requests are tagged with a
+    # request id so many of them can be in flight at once; a reader thread
+    # matches replies back to the waiting futures.
+
+    def __init__(self, address: Tuple[str, int], connect_timeout: float):
+        self.sock = socket.create_connection(address, timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        self.ids = itertools.count(1)
+        self.closed = False
+        self.last_used = time.time()
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    def submit(self, cmd: str, name: str = '', args: str = '', payload=b'') -> Future:
+        fut: Future = Future()
+        request_id = next(self.ids) & 0xFFFFFFFF
+        with self.lock:
+            if self.closed:
+                raise ConnectionError('Connection closed')
+            self.pending[request_id] = fut
+            self.last_used = time.time()
+        try:
+            with self.send_lock:
+                protocol.send_frame(self.sock, cmd, name, args, payload, request_id=request_id)
+        except OSError as e:
+            self.close(e)
+            raise
+        return fut
+
+    def abandon(self, fut: Future) -> bool:
+        # Forgets a request the caller gave up on, so a late reply is
+        # dropped. Returns whether it was in flight on this connection.
+        with self.lock:
+            for request_id, pending in self.pending.items():
+                if pending is fut:
+                    del self.pending[request_id]
+                    return True
+        return False
+
+    def _read_loop(self) -> None:
+        error: Optional[Exception] = None
+        try:
+            while True:
+                frame = protocol.recv_frame(self.sock)
+                if frame is None:
+                    break
+                with self.lock:
+                    fut = self.pending.pop(frame.request_id, None)
+                    self.last_used = time.time()
+                if fut is not None:
+                    fut.set_result(frame)
+        except (OSError, protocol.ProtocolError) as e:
+            error = e
+        self.close(error)
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = self.pending
+            self.pending = {}
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for fut in pending.values():
+            fut.set_exception(ConnectionError(f'Connection lost: {error}' if error else 'Connection closed'))
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.evictions = 0
+        self.requests = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.samples: Deque[float] = deque(maxlen=1024)
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            self.requests += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.samples.append(latency)
+
+    def percentile(self, pct: float) -> float:
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        idx = min(len(samples) - 1, int(len(samples) * pct / 100.0))
+        return samples[idx]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            requests = self.requests
+            result = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'evictions': self.evictions,
+                'requests': requests,
+                'latency_avg_ms': (self.latency_total / requests * 1000) if requests else 0.0,
+                'latency_max_ms': self.latency_max * 1000,
+            }
+        result['latency_p50_ms'] = self.percentile(50) * 1000
+        result['latency_p99_ms'] = self.percentile(99) * 1000
+        return result
+
+
+class ConnectionPool:
+    def __init__(self, address: Tuple[str, int], max_connections: int = 4,
+                 max_in_flight: int = 32, idle_timeout: float = 60.0,
+                 connect_timeout: float = 5.0, request_timeout: float = 10.0):
+        self.address = address
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.connections: List[NodeConnection] = []
+        self.connecting = 0
+        self.lock = threading.Lock()
+        self.stats = PoolStats()
+
+    def _acquire(self) -> NodeConnection:
+        with self.lock:
+            self.connections = [c for c in self.connections if not c.closed]
+            best = min(self.connections, key=lambda c: c.in_flight, default=None)
+            total = len(self.connections) + self.connecting
+            if best is not None and (best.in_flight < self.max_in_flight or total >= self.max_connections):
+                self.stats.hits += 1
+                return best
+            self.connecting += 1
+            self.stats.misses += 1
+        try:
+            conn = NodeConnection(self.address, self.connect_timeout)
+        finally:
+            with self.lock:
+                self.connecting -= 1
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def submit(self, cmd: str, name: str = '', args: str = '', payload=b'') -> Future:
+        start = time.time()
+        try:
+            fut = self._acquire().submit(cmd, name, args, payload)
+        except OSError:
+            with self.stats.lock:
+                self.stats.errors += 1
+            raise
+
+        def done(f: Future) -> None:
+            if f.exception() is None:
+                self.stats.record(time.time() - start)
+            else:
+                with self.stats.lock:
+                    self.stats.errors += 1
+        fut.add_done_callback(done)
+        return fut
+
+    def result(self, fut: Future, timeout: Optional[float] = None) -> protocol.Frame:
+        try:
+            return fut.result(timeout=self.request_timeout if timeout is None else timeout)
+        except futures.TimeoutError:
+            # Only this request is given up on. Other requests share its
+            # connection, which is closed only if it fails a ping as well
+            # (checked in the background, so the caller is not held up).
+            with self.stats.lock:
+                self.stats.timeouts += 1
+            with self.lock:
+                connections = list(self.connections)
+            for conn in connections:
+                if conn.abandon(fut):
+                    threading.Thread(target=self.check, args=(conn,), daemon=True).start()
+                    break
+            raise
+
+    def request(self, cmd: str, name: str = '', args: str = '', payload=b'',
+                timeout: Optional[float] = None) -> protocol.Frame:
+        return self.result(self.submit(cmd, name, args, payload), timeout)
+
+    def maintain(self) -> None:
+        now = time.time()
+        with self.lock:
+            idle = [c for c in self.connections
+                    if not c.closed and c.in_flight == 0 and now - c.last_used > self.idle_timeout]
+            checks = [c for c in self.connections if not c.closed and c.in_flight == 0 and c not in idle]
+        for conn in idle:
+            conn.close()
+            with self.stats.lock:
+                self.stats.evictions += 1
+        for conn in checks:
+            self.check(conn)
+
+    def check(self, conn: NodeConnection) -> None:
+        # Closes the connection unless it answers a ping.
+        try:
+            reply = conn.submit('ping').result(timeout=self.connect_timeout)
+            if reply.status != 'OK':
+                conn.close()
+        except Exception as e:
+            conn.close(e)
+
+    def close(self) -> None:
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+        for conn in connections:
+            conn.close()
+
+    def info(self) -> Dict[str, float]:
+        with self.lock:
+            live = [c for c in self.connections if not c.closed]
+        info = self.stats.snapshot()
+        info['connections'] = len(live)
+        info['in_flight'] = sum(c.in_flight for c in live)
+        return info
+
+
+class PoolManager:
+    def __init__(self, address_of: Callable[[int], Tuple[str, int]], **pool_options):
+        self.address_of = address_of
+        self.pool_options = pool_options
+        self.pools: Dict[int, ConnectionPool] = {}
+        self.lock = threading.Lock()
+
+    def get(self, node_id: int) -> ConnectionPool:
+        with self.lock:
+            pool = self.pools.get(node_id)
+            if pool is None:
+                pool = ConnectionPool(self.address_of(node_id), **self.pool_options)
+                self.pools[node_id] = pool
+            return pool
+
+    def submit(self, node_id: int, cmd: str, name: str = '', args: str = '', payload=b'') -> Future:
+        return self.get(node_id).submit(cmd, name, args, payload)
+
+    def request(self, node_id: int, cmd: str, name: str = '', args: str = '', payload=b'',
+                timeout: Optional[float] = None) -> protocol.Frame:
+        return self.get(node_id).request(cmd, name, args, payload, timeout)
+
+    def drop(self, node_id: int) -> None:
+        with self.lock:
+            pool = self.pools.get(node_id)
+        if pool is not None:
+            pool.close()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            pools = dict(self.pools)
+        return {str(nid): pool.info() for nid, pool in sorted(pools.items())}
+
+    def run_maintenance(self, interval: float = 10.0) -> None:
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                pools = list(self.pools.values())
+            for pool in pools:
+                pool.maintain()
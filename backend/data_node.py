@@ -1,40 +1,180 @@
 import socket
 import threading
+import argparse
+import json
 import os
+import shutil
 import sys
 import time
-from typing import Dict
-
-if len(sys.argv) != 2:
-    print("Usage: python data_node.py <node_id>")
-    sys.exit(1)
-
-node_id = int(sys.argv[1])
-node_dir = f'./data_node_{node_id}'
-os.makedirs(node_dir, exist_ok=True)
-storage: Dict[str, str] = {}  
-
-def save_chunk(fname: str, cid: int, content: str):
-    key = f"{fname}:{cid}"  
-    full_path = os.path.join(node_dir, f"{key}.chunk")  
-    directory = os.path.dirname(full_path)  
-    if directory and not os.path.exists(directory):
-        os.makedirs(directory, exist_ok=True)  
-    print(f"Writing content to {full_path}: '{content}'")
-    with open(full_path, 'w') as f:
-        f.write(content)
-
-def load_chunk(fname: str, cid: int) -> str:
-    key = f"{fname}:{cid}"
-    if key in storage:
-        return storage[key]
-    path = os.path.join(node_dir, f"{key}.chunk")
-    if os.path.exists(path):
-        with open(path, 'r') as f:
-            content = f.read()
-            storage[key] = content
-            return content
-    return ''
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
+
+import protocol
+from chunk_cache import ChunkCache
+from chunk_store import COMPACT_INTERVAL, SegmentChunkStore, close_ranges, open_store, read_ranges
+from replication import Throttle
+
+parser = argparse.ArgumentParser(description='Mini DFS data node')
+parser.add_argument('node_id', type=int)
+parser.add_argument('--store', choices=['files', 'segments'], default='files',
+                    help='files: one file per chunk; segments: append-only segment files with an in-memory index')
+parser.add_argument('--cache-mb', type=float, default=128,
+                    help='memory budget for cached chunk contents in MB (0 disables the cache)')
+parser.add_argument('--capacity-mb', type=float, default=0,
+                    help='storage capacity reported to the master in MB (0: used bytes plus free disk space)')
+parser.add_argument('--scrub-interval', type=float, default=3600,
+                    help='seconds between background scrub passes over all chunks (0 disables scrubbing)')
+parser.add_argument('--scrub-mb-per-sec', type=float, default=8,
+                    help='disk read budget of the scrubber in MB per second')
+
+# Set by configure(): the command line, this node's id and directory, its
+# chunk store and chunk cache, and the scrubber's read budget.
+args = None
+node_id = 0
+node_dir = ''
+store = None
+cache: Optional[ChunkCache] = None
+scrub_throttle: Optional[Throttle] = None
+REQUEST_WORKERS = 16
+REPLICATE_TIMEOUT = 30
+# Chunks at least this large are sent straight from disk with sendfile and
+# left to the page cache; smaller ones are read into the chunk cache.
+ZERO_COPY_MIN = 64 * 1024
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS)
+# Mutations of one chunk are serialized so the store and the cache are
+# always updated in the same order.
+chunk_locks = [threading.Lock() for _ in range(64)]
+in_flight = 0
+in_flight_lock = threading.Lock()
+# Request counters and recent latencies for the heartbeat load report.
+request_count = 0
+latencies: Deque[float] = deque(maxlen=1024)
+# Chunks added (True) or removed (False) since the last block report, plus
+# files deleted outright; a full listing goes out every FULL_REPORT_EVERY
+# heartbeats, on reconnect, or when the master asks for one.
+FULL_REPORT_EVERY = 60
+block_lock = threading.Lock()
+block_changes: Dict[Tuple[str, int], bool] = {}
+removed_files: Set[str] = set()
+# Chunks whose bytes no longer match the CRC recorded when they were
+# written, found by the scrubber and reported on the next heartbeat; the
+# master drops the copy and re-replicates the chunk from a good one.
+corrupt_chunks: Set[Tuple[str, int, int]] = set()
+
+
+def configure(argv: Optional[List[str]] = None) -> None:
+    # Parses the command line (sys.argv by default) and opens the node's
+    # store under ./data_node_<id>. Importing the module does neither.
+    global args, node_id, node_dir, store, cache, scrub_throttle
+    args = parser.parse_args(argv)
+    node_id = args.node_id
+    node_dir = f'./data_node_{node_id}'
+    os.makedirs(node_dir, exist_ok=True)
+    store = open_store(args.store, node_dir)
+    cache = ChunkCache(int(args.cache_mb * 1024 * 1024))
+    scrub_throttle = Throttle(args.scrub_mb_per_sec * 1024 * 1024)
+
+
+def note_block(fname: str, cid: int, present: bool) -> None:
+    with block_lock:
+        block_changes[(fname, cid)] = present
+
+def note_file_removed(fname: str) -> None:
+    with block_lock:
+        for key in [key for key in block_changes if key[0] == fname]:
+            del block_changes[key]
+        removed_files.add(fname)
+
+def chunk_lock(fname: str, cid: int) -> threading.Lock:
+    return chunk_locks[hash((fname, cid)) % len(chunk_locks)]
+
+def save_chunk(fname: str, cid: int, content: bytes):
+    with chunk_lock(fname, cid):
+        store.write(fname, cid, content)
+        if len(content) < ZERO_COPY_MIN:
+            cache.put((fname, cid), content)
+        else:
+            cache.invalidate((fname, cid))
+        note_block(fname, cid, True)
+
+def append_chunk(fname: str, cid: int, offset: int, content: bytes) -> bool:
+    # Writes at an explicit offset so a retried append cannot duplicate
+    # data; a replica holding fewer than `offset` bytes has diverged.
+    with chunk_lock(fname, cid):
+        ok = store.append(fname, cid, offset, content)
+        cache.invalidate((fname, cid))
+        if ok:
+            note_block(fname, cid, True)
+        return ok
+
+def delete_chunk(fname: str, cid: int):
+    with chunk_lock(fname, cid):
+        store.delete(fname, cid)
+        cache.invalidate((fname, cid))
+        note_block(fname, cid, False)
+
+def load_chunk(fname: str, cid: int) -> Optional[Union[bytes, List]]:
+    # Returns the chunk bytes, or for large uncached chunks the open file
+    # ranges holding it (the caller sends and closes them).
+    key = (fname, cid)
+    content = cache.get(key)
+    if content is not None:
+        return content
+    ticket = cache.begin_load(key)
+    try:
+        ranges = store.open_ranges(fname, cid)
+        if ranges is None:
+            return None
+        if sum(length for _, _, length in ranges) >= ZERO_COPY_MIN:
+            return ranges
+        try:
+            content = read_ranges(ranges)
+        finally:
+            close_ranges(ranges)
+        cache.fill(key, content, ticket)
+        return content
+    finally:
+        # Missing chunk, zero-copy send or failed read: nothing was cached.
+        cache.end_load(key, ticket)
+
+def verify_chunk(fname: str, cid: int) -> Optional[Tuple[bool, int]]:
+    # Whether the chunk matches its recorded checksum, and that checksum;
+    # None if the chunk is gone or has no recorded checksum.
+    with chunk_lock(fname, cid):
+        expected = store.checksum(fname, cid)
+        content = store.read(fname, cid) if expected is not None else None
+    if content is None:
+        return None
+    scrub_throttle.acquire(len(content))
+    return zlib.crc32(content) == expected, expected
+
+def run_scrubber(interval: float):
+    # Rereads every chunk once per interval, within the scrub bandwidth, so
+    # bit rot and torn writes are found before a reader or the last other
+    # replica needs the chunk.
+    while True:
+        time.sleep(interval)
+        checked = 0
+        found = []
+        for fname, cids in store.chunk_list().items():
+            for cid in cids:
+                try:
+                    result = verify_chunk(fname, cid)
+                except OSError:
+                    continue
+                if result is None:
+                    continue
+                checked += 1
+                if not result[0]:
+                    # The master only drops the copy if it still expects
+                    # these bytes there, not a newer copy written since.
+                    found.append((fname, cid, result[1]))
+        if found:
+            with block_lock:
+                corrupt_chunks.update(found)
+        print(f"Node {node_id}: scrubbed {checked} chunks, {len(found)} corrupt")
 
 def handle_requests(node_sock):
     while True:
@@ -42,72 +182,202 @@ def handle_requests(node_sock):
         threading.Thread(target=process_request, args=(client_sock,)).start()
 
 def process_request(client_sock):
-    data = client_sock.recv(4096).decode()
-    parts = data.split(':', 3)
-    cmd = parts[0]
+    global in_flight
+    # Connections are persistent and may carry several requests at once;
+    # each one is handled on the worker pool and answered with its own
+    # request id, so replies can go out in any order.
+    send_lock = threading.Lock()
+    client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def run(frame: protocol.Frame):
+        global in_flight, request_count
+        started = time.time()
+        try:
+            response, payload = handle_command(frame)
+        except Exception as e:
+            response, payload = f'ERROR: {e}', b''
+        finally:
+            with in_flight_lock:
+                in_flight -= 1
+                request_count += 1
+                latencies.append(time.time() - started)
+        ranges = payload if isinstance(payload, list) else None
+        try:
+            if ranges is not None:
+                try:
+                    head = protocol.file_frame_head('reply', ranges, args=response, request_id=frame.request_id)
+                except (OSError, protocol.ProtocolError) as e:
+                    close_ranges(ranges)
+                    response, payload, ranges = f'ERROR: {e}', b'', None
+            with send_lock:
+                if ranges is not None:
+                    protocol.send_file_frame(client_sock, head, ranges)
+                else:
+                    protocol.send_reply(client_sock, response, payload, frame.request_id)
+        except protocol.ProtocolError as e:
+            print(f"Node {node_id}: Dropping connection: {e}")
+            try:
+                client_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        except OSError:
+            pass
+        finally:
+            if ranges is not None:
+                close_ranges(ranges)
+
+    try:
+        while True:
+            frame = protocol.recv_frame(client_sock)
+            if frame is None:
+                break
+            with in_flight_lock:
+                in_flight += 1
+            request_executor.submit(run, frame)
+    except (OSError, protocol.ProtocolError) as e:
+        print(f"Node {node_id}: Closing connection: {e}")
+    client_sock.close()
+
+def handle_command(frame: protocol.Frame) -> Tuple[str, Union[bytes, List]]:
+    cmd, fname = frame.cmd, frame.name
     response = ''
+    payload = b''
     
     if cmd == 'write':
-        fname, cid, content = parts[1], int(parts[2]), parts[3]
-        save_chunk(fname, cid, content)
+        cid = int(frame.args)
+        save_chunk(fname, cid, frame.payload)
         response = 'OK'
+    elif cmd == 'append':
+        cid, offset = (int(x) for x in frame.args.split(':'))
+        if append_chunk(fname, cid, offset, frame.payload):
+            response = 'OK'
+        else:
+            response = 'ERROR: Chunk shorter than append offset'
     elif cmd == 'read':
-        fname, cid = parts[1], int(parts[2])
-        response = load_chunk(fname, cid)
+        cid = int(frame.args)
+        content = load_chunk(fname, cid)
+        if content is None:
+            response = 'ERROR: Chunk not found'
+        else:
+            response = 'OK'
+            payload = content
     elif cmd == 'delete':
-        fname, cid = parts[1], int(parts[2])
-        key = f"{fname}:{cid}"
-        storage.pop(key, None)
-        path = os.path.join(node_dir, f"{key}.chunk")
-        if os.path.exists(path):
-            os.remove(path)
+        cid = int(frame.args)
+        delete_chunk(fname, cid)
+        response = 'OK'
+    elif cmd == 'ping':
         response = 'OK'
     elif cmd == 'delete_file':
        
-        fname = parts[1]
-        
-        to_delete_keys = [k for k in list(storage.keys()) if k.startswith(f"{fname}:")]
-        for k in to_delete_keys:
-            storage.pop(k, None)
-        
-        removed = 0
-        for entry in os.listdir(node_dir):
-            if entry.startswith(f"{fname}:") and entry.endswith('.chunk'):
-                try:
-                    os.remove(os.path.join(node_dir, entry))
-                    removed += 1
-                except Exception:
-                    pass
-
-        
-        plain_path = os.path.join(node_dir, fname)
-        if os.path.exists(plain_path):
+        removed = store.delete_file(fname)
+        cache.invalidate_file(fname)
+        note_file_removed(fname)
+        response = f'OK:{removed}'
+    elif cmd == 'replicate':
+        # Re-replication: pull the chunk from the first source replica that
+        # has it; args: {"chunk_id": cid, "sources": [{"host", "port"}, ...]}
+        # plus the chunk's "crc" when the master knows it, in which case a
+        # source whose copy does not match is skipped.
+        request = json.loads(frame.args)
+        cid = int(request['chunk_id'])
+        crc = request.get('crc')
+        response = 'ERROR: No source replica available'
+        for source in request.get('sources', []):
             try:
-                os.remove(plain_path)
-            except Exception:
-                pass
+                reply = protocol.call(source['host'], source['port'], 'read', fname, str(cid),
+                                      timeout=REPLICATE_TIMEOUT)
+            except (OSError, protocol.ProtocolError):
+                continue
+            if reply.status == 'OK' and crc is not None and zlib.crc32(reply.payload) != crc:
+                print(f"Node {node_id}: {fname}:{cid} from port {source['port']} fails its checksum")
+                continue
+            if reply.status == 'OK':
+                save_chunk(fname, cid, reply.payload)
+                response = f'OK:{len(reply.payload)}'
+                break
+    elif cmd == 'cache_stats':
+        response = 'OK'
+        payload = json.dumps(cache.stats()).encode()
+    else:
+        response = f'ERROR: Unknown command {cmd}'
+    return response, payload
 
-        response = f'OK:{removed}'
-    
-    client_sock.send(response.encode())
-    client_sock.close()
+def percentile(samples: List[float], pct: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))] if samples else 0.0
+
+def node_stats(elapsed: float, last_count: int) -> dict:
+    # Load report carried by every heartbeat; the master places new
+    # replicas and rebalances by it.
+    chunks, used = store.usage()
+    capacity = int(args.capacity_mb * 1024 * 1024) or used + shutil.disk_usage(node_dir).free
+    with in_flight_lock:
+        count, pending, samples = request_count, in_flight, sorted(latencies)
+    return {
+        'used_bytes': used,
+        'chunks': chunks,
+        'capacity_bytes': capacity,
+        'in_flight': pending,
+        'queue_depth': max(0, pending - REQUEST_WORKERS),
+        'requests': count,
+        'requests_per_sec': round((count - last_count) / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms': {f'p{pct}': round(percentile(samples, pct) * 1000, 2) for pct in (50, 95, 99)},
+    }
+
+def block_report(full: bool) -> dict:
+    # Changes are taken before the listing, so anything that changes while
+    # the store is walked is sent again in the next incremental report.
+    global block_changes, removed_files, corrupt_chunks
+    with block_lock:
+        changes, block_changes = block_changes, {}
+        files, removed_files = removed_files, set()
+        corrupt, corrupt_chunks = corrupt_chunks, set()
+    if full:
+        return {'full': True, 'chunks': store.chunk_list(), 'corrupt': sorted(corrupt)}
+    added: Dict[str, List[int]] = {}
+    removed: Dict[str, List[int]] = {}
+    for (fname, cid), present in changes.items():
+        (added if present else removed).setdefault(fname, []).append(cid)
+    return {'full': False, 'added': added, 'removed': removed, 'removed_files': sorted(files),
+            'corrupt': sorted(corrupt)}
 
 def send_heartbeat_to_master():
+    # One persistent connection. After a failure (say, the master
+    # restarted) the heartbeat is retried at once on a new connection with
+    # a full block report, since the incremental changes in flight are lost.
+    sock = None
+    beats = 0
+    full = True
+    last_time, last_count = time.time(), 0
     while True:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(('localhost', 5000))  
-            msg = f'heartbeat:{node_id}'
-            sock.send(msg.encode())
-            response = sock.recv(1024).decode()  
-            sock.close()
-            if response != 'OK':
-                print(f"Node {node_id}: Unexpected heartbeat response: {response}")
-        except Exception as e:
-            print(f"Node {node_id}: Heartbeat failed: {e}")
-        time.sleep(5)  
+        now = time.time()
+        stats = node_stats(now - last_time, last_count)
+        last_time, last_count = now, stats['requests']
+        full = full or beats % FULL_REPORT_EVERY == 0
+        beats += 1
+        for attempt in range(2):
+            try:
+                payload = json.dumps({'load': stats, 'blocks': block_report(full)}).encode()
+                if sock is None:
+                    sock = socket.create_connection(('localhost', 5000), timeout=10)
+                protocol.send_frame(sock, 'heartbeat', '', str(node_id), payload)
+                reply = protocol.recv_frame(sock)
+                if reply is None:
+                    raise ConnectionError('master closed the connection')
+                full = reply.status == 'OK:full_report'
+                if not reply.status.startswith('OK'):
+                    print(f"Node {node_id}: Unexpected heartbeat response: {reply.status}")
+                break
+            except Exception as e:
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                full = True
+                if attempt:
+                    print(f"Node {node_id}: Heartbeat failed: {e}")
+        time.sleep(5)
 
 if __name__ == '__main__':
+    configure()
     node_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     node_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     node_sock.bind(('localhost', 5000 + node_id))
@@ -118,6 +388,11 @@ if __name__ == '__main__':
     heartbeat_thread = threading.Thread(target=send_heartbeat_to_master, daemon=True)
     request_thread.start()
     heartbeat_thread.start()
+    if isinstance(store, SegmentChunkStore):
+        print(f"Node {node_id}: segment store with {store.stats()['chunks']} chunks")
+        threading.Thread(target=store.run_compaction, args=(COMPACT_INTERVAL,), daemon=True).start()
+    if args.scrub_interval > 0:
+        threading.Thread(target=run_scrubber, args=(args.scrub_interval,), daemon=True).start()
 
     try:
         while True:
@@ -0,0 +1,163 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Content-addressed chunk storage for files created in dedup mode. Their
+# chunks live on the data nodes under a name derived from the content hash
+# (CONTENT_PREFIX + hex digest, chunk id 0) instead of <file>:<cid>, so a
+# chunk that already exists anywhere in the cluster is referenced rather
+# than written again. The index counts references per content object and
+# remembers every node that was given a copy; when the last reference goes
+# away those copies are reclaimed. It is derived state: the master rebuilds
+# it from the chunk table on startup.
+#
+# A reference is taken before a chunk is written (or its write skipped), so
+# an object in use is never reclaimed. While the copies of an unused object
+# are being deleted, new references to the same content wait, so a fresh
+# write cannot land on a node just before the delete does.
+#
+# Objects of compressed files hold the encoded chunk and are named with a
+# '.<codec>' suffix, so files using different codecs never share them.
+
+CONTENT_PREFIX = '.cas/'
+
+# Files written by direct clients (see direct_io.py) are stored under a
+# fresh name per write, VERSION_PREFIX + '<file>@<version>', so the chunks of
+# a write in progress never replace the ones readers are using; the commit
+# switches the file's entry over to the new version. Version 0 is the plain
+# file name.
+VERSION_PREFIX = '.v/'
+RESERVED_PREFIXES: Tuple[str, ...] = (CONTENT_PREFIX, VERSION_PREFIX)
+
+
+def content_name(digest: bytes, codec: Optional[str] = None) -> str:
+    name = CONTENT_PREFIX + digest.hex()
+    return f'{name}.{codec}' if codec else name
+
+
+def is_content_name(name: str) -> bool:
+    return name.startswith(CONTENT_PREFIX)
+
+
+def is_reserved_name(name: str) -> bool:
+    # Names under the internal prefixes cannot be used for files: the
+    # block audit would take their chunks for internal objects.
+    return name.startswith(RESERVED_PREFIXES)
+
+
+def versioned_name(fname: str, version: int) -> str:
+    return f'{VERSION_PREFIX}{fname}@{version:x}' if version else fname
+
+
+def split_versioned_name(name: str) -> Tuple[str, int]:
+    # (file name, version) of a name chunks are stored under.
+    if name.startswith(VERSION_PREFIX):
+        fname, _, version = name[len(VERSION_PREFIX):].rpartition('@')
+        try:
+            return fname, int(version, 16)
+        except ValueError:
+            pass
+    return name, 0
+
+
+def stored_name(fname: str, entry) -> str:
+    # The name a (non-dedup) file's chunks are stored under.
+    return versioned_name(fname, entry.version) if entry is not None else fname
+
+
+def chunk_key(fname: str, entry, cid: int) -> Tuple[str, int]:
+    # The (name, chunk id) a file's chunk is stored under on the data nodes.
+    if entry is not None and entry.dedup:
+        digest = entry.hash(cid)
+        if digest is not None:
+            return content_name(digest, entry.codec), 0
+    return stored_name(fname, entry), cid
+
+
+class ContentObject:
+    __slots__ = ('refs', 'size', 'nodes', 'reclaiming')
+
+    def __init__(self, size: int):
+        self.refs = 0
+        self.size = size
+        self.nodes: Set[int] = set()
+        self.reclaiming = False
+
+
+class ContentIndex:
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.objects: Dict[str, ContentObject] = {}
+        self.writes_skipped = 0
+        self.bytes_skipped = 0
+
+    def holds(self, name: str, nid: int) -> bool:
+        with self.lock:
+            obj = self.objects.get(name)
+            return obj is not None and not obj.reclaiming and nid in obj.nodes
+
+    def add_ref(self, name: str, size: int, nodes: Iterable[int] = ()) -> List[int]:
+        # Takes a reference and returns the nodes already given a copy.
+        with self.lock:
+            obj = self.objects.get(name)
+            while obj is not None and obj.reclaiming:
+                self.lock.wait()
+                obj = self.objects.get(name)
+            if obj is None:
+                obj = self.objects[name] = ContentObject(size)
+            obj.refs += 1
+            held = sorted(obj.nodes)
+            obj.nodes.update(nodes)
+            return held
+
+    def add_nodes(self, name: str, nodes: Iterable[int]) -> None:
+        with self.lock:
+            obj = self.objects.get(name)
+            if obj is not None:
+                obj.nodes.update(nodes)
+
+    def drop_node(self, name: str, nid: int) -> bool:
+        # Forgets node nid's copy (found damaged) unless it is the only one.
+        with self.lock:
+            obj = self.objects.get(name)
+            if obj is None or nid not in obj.nodes or len(obj.nodes) < 2:
+                return False
+            obj.nodes.discard(nid)
+            return True
+
+    def drop_ref(self, name: str) -> Optional[List[int]]:
+        # Returns the nodes to delete the object from once it is unused; the
+        # caller reports back with reclaimed() when the deletes are done.
+        with self.lock:
+            obj = self.objects.get(name)
+            if obj is None or obj.reclaiming:
+                return None
+            obj.refs -= 1
+            if obj.refs > 0:
+                return None
+            obj.reclaiming = True
+            return sorted(obj.nodes)
+
+    def reclaimed(self, name: str) -> None:
+        with self.lock:
+            self.objects.pop(name, None)
+            self.lock.notify_all()
+
+    def note_skipped(self, size: int) -> None:
+        with self.lock:
+            self.writes_skipped += 1
+            self.bytes_skipped += size
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            live = [obj for obj in self.objects.values() if not obj.reclaiming]
+            unique = sum(obj.size for obj in live)
+            logical = sum(obj.size * obj.refs for obj in live)
+            return {
+                'objects': len(live),
+                'references': sum(obj.refs for obj in live),
+                'unique_bytes': unique,
+                'logical_bytes': logical,
+                'dedup_ratio': round(logical / unique, 3) if unique else 1.0,
+                'writes_skipped': self.writes_skipped,
+                'bytes_skipped': self.bytes_skipped,
+            }
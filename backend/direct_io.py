@@ -0,0 +1,288 @@
+import hashlib
+import json
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import protocol
+from compression import unpack_chunk
+from connection_pool import ConnectionPool
+from erasure import codec
+
+# GFS-style client library: the master is only asked where chunks live
+# (locate) or should go (allocate/commit); chunk bytes move directly
+# between the client and the data nodes. Erasure-coded and compressed files
+# are decoded here on reads; writes always store plain replicated chunks,
+# under a fresh version of the file that replaces the old one at commit.
+# Chunks and fragments are checked against the CRCs the master recorded
+# for them, and a copy that does not match is read from elsewhere.
+
+
+class DirectIOError(Exception):
+    pass
+
+
+def crc_ok(payload, expected: Optional[int]) -> bool:
+    return not expected or zlib.crc32(payload) == expected
+
+
+def read_full(read: Callable[[int], bytes], size: int) -> bytes:
+    # Stream reads may return short; keep reading until size bytes or EOF.
+    parts: List[bytes] = []
+    remaining = size
+    while remaining > 0:
+        part = read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+class DirectClient:
+    def __init__(self, master_host: str = 'localhost', master_port: int = 5000,
+                 window: int = 16, timeout: float = 10.0):
+        self.master_host = master_host
+        self.master_port = master_port
+        self.window = max(1, window)
+        self.timeout = timeout
+        self.pools: Dict[Tuple[str, int], ConnectionPool] = {}
+        self.lock = threading.Lock()
+
+    def master(self, cmd: str, fname: str = '', args: str = '', payload=b'') -> protocol.Frame:
+        reply = protocol.call(self.master_host, self.master_port, cmd, fname, args, payload,
+                              timeout=self.timeout)
+        if reply.status.startswith('ERROR'):
+            raise DirectIOError(reply.status)
+        return reply
+
+    def pool(self, replica: Dict) -> ConnectionPool:
+        address = (replica['host'], replica['port'])
+        with self.lock:
+            pool = self.pools.get(address)
+            if pool is None:
+                pool = ConnectionPool(address, request_timeout=self.timeout)
+                self.pools[address] = pool
+            return pool
+
+    def submit(self, replica: Dict, cmd: str, fname: str, args: str = '', payload=b'') -> Optional[Future]:
+        try:
+            return self.pool(replica).submit(cmd, fname, args, payload)
+        except OSError:
+            return None
+
+    def result(self, replica: Dict, fut: Optional[Future]) -> Optional[protocol.Frame]:
+        if fut is None:
+            return None
+        try:
+            return self.pool(replica).result(fut)
+        except Exception:
+            return None
+
+    def locate(self, fname: str) -> Dict:
+        return json.loads(self.master('locate', fname).payload)
+
+    def read(self, fname: str) -> bytes:
+        layout = self.locate(fname)
+        chunks = self.read_chunks(fname, layout['chunks'], layout)
+        missing = [c['chunk_id'] for c, data in zip(layout['chunks'], chunks) if data is None]
+        if missing:
+            raise DirectIOError(f'Chunks unavailable: {missing}')
+        return b''.join(chunks)
+
+    def file_size(self, fname: str, layout: Dict) -> int:
+        # Files saved before sizes were recorded have no size in the layout;
+        # every chunk but the last is full, so the tail chunk pins it down.
+        if layout.get('size') is not None:
+            return layout['size']
+        chunks = layout['chunks']
+        if not chunks:
+            return 0
+        tail = self.read_chunks(fname, chunks[-1:], layout)[0]
+        if tail is None:
+            raise DirectIOError(f"Chunks unavailable: [{chunks[-1]['chunk_id']}]")
+        return layout['chunk_size'] * (len(chunks) - 1) + len(tail)
+
+    def read_range(self, fname: str, offset: int, length: Optional[int] = None) -> bytes:
+        layout = self.locate(fname)
+        size = self.file_size(fname, layout)
+        stop = size if length is None else min(size, offset + length)
+        return b''.join(self.stream(fname, layout, offset, stop))
+
+    def stream(self, fname: str, layout: Dict, start: int, stop: int) -> Iterator[bytes]:
+        # Yields bytes [start, stop) one chunk at a time, fetching at most a
+        # window of chunks ahead, so memory does not grow with the file.
+        chunk_size = layout['chunk_size']
+        if stop <= start:
+            return
+        first, last = start // chunk_size, (stop - 1) // chunk_size
+        for batch_start in range(first, last + 1, self.window):
+            batch = layout['chunks'][batch_start:min(last + 1, batch_start + self.window)]
+            for idx, data in enumerate(self.read_chunks(fname, batch, layout), batch_start):
+                if data is None:
+                    raise DirectIOError(f"Chunks unavailable: [{layout['chunks'][idx]['chunk_id']}]")
+                base = idx * chunk_size
+                yield bytes(data[max(start - base, 0):stop - base])
+
+    def read_chunks(self, fname: str, chunks: List[Dict], layout: Optional[Dict] = None) -> List[Optional[bytes]]:
+        if layout is not None and layout.get('ec'):
+            return self.read_stripes(fname, chunks, layout)
+        compressed = layout is not None and bool(layout.get('compression'))
+        stored = layout.get('name', fname) if layout is not None else fname
+        results: List[Optional[bytes]] = [None] * len(chunks)
+        in_flight: Deque[Tuple[int, Deque[Dict], Dict, Optional[Future]]] = deque()
+
+        def start(idx: int, replicas: Deque[Dict]) -> None:
+            while replicas:
+                replica = replicas.popleft()
+                # Chunks of dedup files carry the name they are stored under.
+                name, key = chunks[idx].get('key', (stored, chunks[idx]['chunk_id']))
+                fut = self.submit(replica, 'read', name, str(key))
+                if fut is not None:
+                    in_flight.append((idx, replicas, replica, fut))
+                    return
+
+        def finish_oldest() -> None:
+            idx, replicas, replica, fut = in_flight.popleft()
+            reply = self.result(replica, fut)
+            if reply is not None and reply.status == 'OK' and crc_ok(reply.payload, chunks[idx].get('crc')):
+                try:
+                    results[idx] = unpack_chunk(reply.payload) if compressed else reply.payload
+                    return
+                except ValueError:
+                    pass
+            start(idx, replicas)
+
+        for idx, chunk in enumerate(chunks):
+            start(idx, deque(chunk['replicas']))
+            while len(in_flight) >= self.window:
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+        return results
+
+    def read_stripes(self, fname: str, chunks: List[Dict], layout: Dict) -> List[Optional[bytes]]:
+        # Erasure-coded chunks: k fragments are requested per stripe, data
+        # fragments first, and failed ones are replaced from the remaining
+        # positions before the stripe is decoded.
+        code = codec(*layout['ec'])
+        chunk_size = layout['chunk_size']
+        stored = layout.get('name', fname)
+
+        def request(chunk: Dict, positions: List[int]) -> List[Tuple[int, Optional[Future]]]:
+            return [(pos, self.submit(chunk['fragments'][pos], 'read', stored,
+                                      str(chunk['chunk_id'] * code.n + pos))) for pos in positions]
+
+        plans = []
+        for chunk in chunks:
+            live = [pos for pos, replica in enumerate(chunk['fragments']) if replica]
+            plans.append((chunk, deque(live[code.k:]), request(chunk, live[:code.k])))
+        results: List[Optional[bytes]] = []
+        for chunk, spare, pending in plans:
+            fragments: Dict[int, bytes] = {}
+            while pending:
+                for pos, fut in pending:
+                    reply = self.result(chunk['fragments'][pos], fut)
+                    if reply is not None and reply.status == 'OK' and \
+                            crc_ok(reply.payload, chunk.get('fragment_crcs', [0] * code.n)[pos]):
+                        fragments[pos] = reply.payload
+                pending = request(chunk, [spare.popleft() for _ in range(min(code.k - len(fragments), len(spare)))])
+            length = min(chunk_size, layout['size'] - chunk['chunk_id'] * chunk_size)
+            results.append(code.decode(fragments, length) if len(fragments) >= code.k else None)
+        return results
+
+    def write(self, fname: str, data, chunk_size: Optional[int] = None) -> str:
+        # Goes through write_stream so a big write allocates a window at a
+        # time, which keeps its version pending on the master until the
+        # commit.
+        view = memoryview(data)
+        offset = 0
+
+        def read(size: int):
+            nonlocal offset
+            part = view[offset:offset + size]
+            offset += len(part)
+            return part
+
+        return self.write_stream(fname, read, chunk_size)[0]
+
+    def write_stream(self, fname: str, read: Callable[[int], bytes],
+                     chunk_size: Optional[int] = None) -> Tuple[str, int]:
+        # Writes whatever read(n) returns until it returns b'', without
+        # knowing the total size: placements are allocated a window of
+        # chunks at a time, all under the version the first allocation
+        # handed out, and readers keep seeing the previous contents (or no
+        # file) until the commit. A version that goes the master's
+        # PENDING_WRITE_TIMEOUT without an allocate can no longer commit.
+        request = {'size': 0}
+        if chunk_size is not None:
+            request['chunk_size'] = chunk_size
+        reply = self.master('allocate', fname, json.dumps(request))
+        if reply.status != 'OK':
+            return reply.status, 0
+        layout = json.loads(reply.payload)
+        chunk_size, version = layout['chunk_size'], layout['version']
+        committed: List[Dict] = []
+        total = 0
+        eof = False
+        while not eof:
+            batch: List[bytes] = []
+            while len(batch) < self.window:
+                chunk = read_full(read, chunk_size)
+                if chunk:
+                    batch.append(chunk)
+                if len(chunk) < chunk_size:
+                    eof = True
+                    break
+            if not batch:
+                break
+            size = sum(len(chunk) for chunk in batch)
+            request = {'size': size, 'chunk_size': chunk_size, 'first_chunk': len(committed), 'version': version}
+            reply = self.master('allocate', fname, json.dumps(request))
+            if reply.status != 'OK':
+                return reply.status, total
+            layout = json.loads(reply.payload)
+            committed.extend(self.write_chunks(layout['name'], layout['chunks'], batch))
+            total += size
+        commit = {'size': total, 'chunk_size': chunk_size, 'version': version, 'chunks': committed}
+        return self.master('commit', fname, json.dumps(commit)).status, total
+
+    def write_chunks(self, name: str, placements: List[Dict], chunks: List) -> List[Dict]:
+        # Writes each chunk to its placements under `name`, the versioned
+        # name the allocation handed out.
+        committed: List[Dict] = []
+        in_flight: Deque[Tuple[Dict, bytes, List[Tuple[Dict, Optional[Future]]]]] = deque()
+
+        def finish_oldest() -> None:
+            placement, chunk, pending = in_flight.popleft()
+            written = []
+            for replica, fut in pending:
+                reply = self.result(replica, fut)
+                if reply is not None and reply.status == 'OK':
+                    written.append(replica['node'])
+            if not written:
+                raise DirectIOError(f"Write failed for chunk {placement['chunk_id']}")
+            # The content hash lets the master skip unchanged chunks on a
+            # later overwrite; the CRC lets readers verify the stored bytes.
+            committed.append({'chunk_id': placement['chunk_id'], 'replicas': written,
+                              'hash': hashlib.blake2b(chunk, digest_size=16).hexdigest(),
+                              'crc': zlib.crc32(chunk)})
+
+        for placement, chunk in zip(placements, chunks):
+            pending = [(replica, self.submit(replica, 'write', name, str(placement['chunk_id']), chunk))
+                       for replica in placement['replicas']]
+            in_flight.append((placement, chunk, pending))
+            while len(in_flight) >= self.window:
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+        return committed
+
+    def close(self) -> None:
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools = {}
+        for pool in pools:
+            pool.close()
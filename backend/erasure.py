@@ -0,0 +1,126 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Systematic Reed-Solomon coding over GF(2^8) for erasure-coded files. A
+# stripe (one chunk of the file) is cut into k equal data fragments, the
+# last one zero-padded, and m parity fragments are computed from them; any
+# k of the k + m fragments give the stripe back. Parity rows form a Cauchy
+# matrix, so every k x k submatrix of the generator [I; C] is invertible.
+#
+# Pure Python, but never byte-at-a-time: multiplying a fragment by a
+# constant is one bytes.translate() through that constant's 256-byte table,
+# and adding fragments is an XOR of the fragments read as big integers.
+#
+# Fragment i of stripe c is stored on its data node as chunk c * (k + m) + i
+# of the file.
+
+MAX_FRAGMENTS = 256
+
+EXP = [0] * 512
+LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def gf_inv(a: int) -> int:
+    return EXP[255 - LOG[a]]
+
+
+@lru_cache(maxsize=None)
+def mul_table(c: int) -> bytes:
+    return bytes(gf_mul(c, x) for x in range(256))
+
+
+def combine(coeffs: List[int], fragments: List[bytes], size: int) -> bytes:
+    # sum(c_i * fragment_i) over GF(2^8)
+    acc = 0
+    for c, fragment in zip(coeffs, fragments):
+        if c == 0:
+            continue
+        scaled = fragment if c == 1 else fragment.translate(mul_table(c))
+        acc ^= int.from_bytes(scaled, 'little')
+    return acc.to_bytes(size, 'little')
+
+
+def invert(matrix: List[List[int]]) -> List[List[int]]:
+    # Gauss-Jordan elimination over GF(2^8).
+    n = len(matrix)
+    rows = [row[:] + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(scale, v) for v in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [v ^ gf_mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def parse_scheme(text) -> Optional[Tuple[int, int]]:
+    # "k+m" (e.g. "4+2") or a [k, m] pair; None if malformed.
+    try:
+        if isinstance(text, str):
+            k, m = (int(part) for part in text.split('+'))
+        else:
+            k, m = (int(part) for part in text)
+    except (ValueError, TypeError):
+        return None
+    if k < 1 or m < 1 or k + m > MAX_FRAGMENTS:
+        return None
+    return k, m
+
+
+class ErasureCode:
+    def __init__(self, k: int, m: int):
+        self.k = k
+        self.m = m
+        self.n = k + m
+        self.rows = [[int(i == j) for j in range(k)] for i in range(k)]
+        self.rows += [[gf_inv((k + p) ^ j) for j in range(k)] for p in range(m)]
+
+    def fragment_size(self, length: int) -> int:
+        return -(-length // self.k)
+
+    def encode(self, stripe) -> List[bytes]:
+        size = self.fragment_size(len(stripe))
+        data = bytes(stripe).ljust(size * self.k, b'\0')
+        fragments = [data[i * size:(i + 1) * size] for i in range(self.k)]
+        return fragments + [combine(row, fragments, size) for row in self.rows[self.k:]]
+
+    def decode(self, fragments: Dict[int, bytes], length: int) -> bytes:
+        # Rebuilds the stripe from any k fragments {position: bytes}.
+        size = self.fragment_size(length)
+        if all(i in fragments for i in range(self.k)):
+            return b''.join(fragments[i] for i in range(self.k))[:length]
+        used = sorted(fragments)[:self.k]
+        if len(used) < self.k:
+            raise ValueError(f'{len(used)} of {self.k} fragments available')
+        inverse = invert([self.rows[i] for i in used])
+        sources = [fragments[i] for i in used]
+        data = [fragments[i] if i in fragments else combine(inverse[i], sources, size) for i in range(self.k)]
+        return b''.join(data)[:length]
+
+    def rebuild(self, fragments: Dict[int, bytes], length: int, wanted: List[int]) -> Dict[int, bytes]:
+        # Recomputes the fragments at `wanted` positions from any k others.
+        encoded = self.encode(self.decode(fragments, length))
+        return {i: encoded[i] for i in wanted}
+
+
+@lru_cache(maxsize=None)
+def codec(k: int, m: int) -> ErasureCode:
+    return ErasureCode(k, m)
@@ -0,0 +1,91 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Per-file reader/writer locks for the master. Operations on different
+# files never wait for each other; readers of one file share its lock and
+# a writer has it to itself. Writers are preferred so a steady stream of
+# readers cannot starve an overwrite. Locks exist only while someone holds
+# or waits for them, so the table stays as small as the set of busy files.
+
+
+class RWLock:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        with self.cond:
+            while self.writer or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self) -> None:
+        with self.cond:
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self) -> None:
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+
+class FileLocks:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks: Dict[str, List] = {}
+
+    def _checkout(self, name: str) -> RWLock:
+        with self.lock:
+            slot = self.locks.get(name)
+            if slot is None:
+                slot = self.locks[name] = [RWLock(), 0]
+            slot[1] += 1
+            return slot[0]
+
+    def _checkin(self, name: str) -> None:
+        with self.lock:
+            slot = self.locks[name]
+            slot[1] -= 1
+            if not slot[1]:
+                del self.locks[name]
+
+    @contextmanager
+    def read(self, name: str) -> Iterator[None]:
+        lock = self._checkout(name)
+        try:
+            lock.acquire_read()
+            try:
+                yield
+            finally:
+                lock.release_read()
+        finally:
+            self._checkin(name)
+
+    @contextmanager
+    def write(self, name: str) -> Iterator[None]:
+        lock = self._checkout(name)
+        try:
+            lock.acquire_write()
+            try:
+                yield
+            finally:
+                lock.release_write()
+        finally:
+            self._checkin(name)
+
+    def busy(self) -> int:
+        with self.lock:
+            return len(self.locks)
@@ -1,125 +1,1296 @@
 import socket
 import threading
+import argparse
+import asyncio
+import hashlib
+import itertools
 import json
 import time
-import os
 import sys
-from typing import Dict, List, Tuple
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-metadata: Dict[str, List[Tuple[int, List[int]]]] = {}
+import protocol
+from block_reports import BlockMap
+from chunk_table import HASH_SIZE, ChunkTable
+from compression import CODECS, CodecStats, pack_chunk, parse_codec, unpack_chunk
+from connection_pool import PoolManager
+from dedup import (ContentIndex, chunk_key, content_name, is_content_name, is_reserved_name, split_versioned_name,
+                   stored_name, versioned_name)
+from erasure import codec, parse_scheme
+from file_locks import FileLocks
+from metadata_log import MetadataLog
+from placement import POLICIES, PlacementPolicy
+from replication import ReplicationScheduler
+
+metadata = ChunkTable()
 data_nodes_status: Dict[int, bool] = {}
 last_heartbeat: Dict[int, float] = {}
+node_load: Dict[int, Dict] = {}
 data_nodes: List[str] = ['localhost']
 HEARTBEAT_TIMEOUT = 15
-CHUNK_SIZE = 1024
+CHUNK_SIZE = 4 * 1024 * 1024
+LEGACY_CHUNK_SIZE = 1024
+MIN_CHUNK_SIZE = 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
 METADATA_FILE = 'metadata.json'
+METADATA_LOG = 'metadata.log'
+SNAPSHOT_EVERY = 10000
+SNAPSHOT_INTERVAL = 300
+POOL_MAX_CONNECTIONS = 4
+POOL_MAX_IN_FLIGHT = 32
+POOL_IDLE_TIMEOUT = 60
+NODE_RPC_TIMEOUT = 10
+NODE_PING_TIMEOUT = 5
+WRITE_WINDOW = 16
+READ_WINDOW = 32
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 0.002
+HEDGE_MIN_SAMPLES = 20
+SERVER_MODE = 'threaded'
+LISTEN_BACKLOG = 1024
+MASTER_WORKERS = 32
+HEAL_INTERVAL = 10
+HEAL_SWEEP_INTERVAL = 600
+REPLICATION_WORKERS = 4
+REPLICATION_BANDWIDTH = 64 * 1024 * 1024
+PLACEMENT_POLICY = 'least-loaded'
+REBALANCE_INTERVAL = 60
+REBALANCE_THRESHOLD = 0.1
+REBALANCE_MAX_BYTES = 1024 * 1024 * 1024
+BLOCK_AUDIT_INTERVAL = 30
+MISSING_GRACE = 30
+ORPHAN_GRACE = 300
+PENDING_WRITE_TIMEOUT = 600
+DEDUP = False
+COMPRESSION: Optional[str] = None
+# Answered straight from memory on the event loop in async mode; everything
+# else may block on data nodes or the metadata log and goes to the workers.
+INLINE_COMMANDS = {'heartbeat', 'list', 'locate', 'system_info', 'pool_stats'}
+WRITE_LOCKED = {'create', 'write', 'append', 'delete', 'commit'}
+READ_LOCKED = {'read', 'read_range', 'metadata'}
+# Commands that name a file to be created or written (see is_reserved_name).
+NAMING = {'create', 'write', 'append', 'allocate', 'commit'}
+# Heartbeats carrying a full block report are big enough to go to a worker.
+INLINE_PAYLOAD_MAX = 64 * 1024
+# Names per page of a paged `list` (default and cap).
+LIST_PAGE_SIZE = 1000
+LIST_PAGE_MAX = 10000
+read_latencies: Deque[float] = deque(maxlen=1024)
+# Copies that failed their CRC, as (name, chunk id on the node, node, CRC
+# the copy was written with): found by master reads or reported by the data
+# node scrubbers, and handled by the healer outside any file lock.
+corrupt_copies: Deque[Tuple[str, int, int, Optional[int]]] = deque()
+integrity_stats = {'corrupt_reported': 0, 'copies_dropped': 0}
+# Nodes found unreachable by a failed request; the healer queues the chunks
+# they hold (heartbeat timeouts are handled at once by the monitor).
+dead_nodes: Set[int] = set()
+# Nodes being pinged after a failed request (see check_node).
+checking_nodes: Set[int] = set()
+checking_lock = threading.Lock()
+# Versions handed out to direct writers (see dedup.py). They start at the
+# clock so a restarted master never hands out one it gave out before.
+direct_versions = itertools.count(time.time_ns())
+# Direct writes allocated but not committed yet, as (file, version) -> time
+# of the last allocate. The block audit leaves their chunks alone; a write
+# that goes PENDING_WRITE_TIMEOUT without allocating expires and can no
+# longer commit. Not persisted, so a restart fails the writes in flight.
+pending_versions: Dict[Tuple[str, int], float] = {}
+pending_lock = threading.Lock()
 
+node_pools = PoolManager(
+    lambda nid: (data_nodes[0], 5000 + nid),
+    max_connections=POOL_MAX_CONNECTIONS,
+    max_in_flight=POOL_MAX_IN_FLIGHT,
+    idle_timeout=POOL_IDLE_TIMEOUT,
+    request_timeout=NODE_RPC_TIMEOUT,
+)
+metadata_log = MetadataLog(METADATA_FILE, METADATA_LOG, snapshot_every=SNAPSHOT_EVERY)
+placement = PlacementPolicy(PLACEMENT_POLICY)
+block_map = BlockMap()
+file_locks = FileLocks()
+content_index = ContentIndex()
+codec_stats = CodecStats()
+replication = ReplicationScheduler(lambda fname, cid: repair_chunk(fname, cid),
+                                   workers=REPLICATION_WORKERS, bandwidth=REPLICATION_BANDWIDTH)
 
-def load_metadata_from_disk() -> None:
+
+def restore_snapshot(files: Dict, version: int) -> None:
     global metadata
-    if not os.path.exists(METADATA_FILE):
+    loaded = ChunkTable()
+    for fname, entry in files.items():
+        size = None
+        chunk_size = LEGACY_CHUNK_SIZE
+        if version == 1:
+            # Pre-log metadata.json: {fname: [{'cid', 'replicas', 'size'?}, ...]}
+            converted = [(c['cid'], list(c.get('replicas', []))) for c in entry if isinstance(c.get('cid'), int)]
+            if not converted:
+                continue
+            if all('size' in c for c in entry):
+                size = sum(c['size'] for c in entry)
+        else:
+            converted = [(cid, list(replicas)) for cid, replicas in entry['chunks']]
+            size = entry.get('size')
+            chunk_size = entry.get('chunk_size', LEGACY_CHUNK_SIZE)
+        if version == 1:
+            loaded.put(fname, converted, size, chunk_size)
+        else:
+            loaded.put(fname, converted, size, chunk_size, decode_hashes(entry.get('hashes', [])),
+                       entry.get('dedup', False), parse_scheme(entry.get('ec')), entry.get('codec'),
+                       entry.get('version', 0))
+            loaded.set_crcs(fname, dict(enumerate(entry.get('crcs', []))))
+    metadata = loaded
+
+
+def apply_log_record(record: Dict) -> None:
+    fname = record['f']
+    if record['op'] == 'del':
+        metadata.remove(fname)
+        return
+    chunks = [(cid, list(replicas)) for cid, replicas in record['chunks']]
+    hashes = decode_hashes(record.get('hashes', []))
+    if record['op'] == 'put':
+        metadata.put(fname, chunks, None, record.get('chunk_size', LEGACY_CHUNK_SIZE), hashes,
+                     record.get('dedup', False), parse_scheme(record.get('ec')), record.get('codec'),
+                     record.get('version', 0))
+    else:
+        metadata.update(fname, chunks)
+        if hashes:
+            metadata.set_hashes(fname, {cid: digest for (cid, _), digest in zip(chunks, hashes)})
+    metadata.set_crcs(fname, {cid: crcs for (cid, _), crcs in zip(chunks, record.get('crcs', []))})
+    if record.get('size') is not None:
+        metadata.set_size(fname, record['size'])
+
+
+def encode_hashes(entry, cids: List[int]) -> List[str]:
+    # Hex content hashes for the log and snapshots, '' where unknown.
+    return [(entry.hash(cid) or b'').hex() for cid in cids]
+
+
+def decode_hashes(hashes: List[str]) -> List[Optional[bytes]]:
+    return [bytes.fromhex(digest) if len(digest) == 2 * HASH_SIZE else None for digest in hashes]
+
+
+def file_record(fname: str, cids: Optional[List[int]] = None) -> Dict:
+    entry = metadata.entry(fname)
+    if entry is None:
+        return {'op': 'del', 'f': fname}
+    if cids is None:
+        cids = list(range(len(entry)))
+        op = 'put'
+    else:
+        op = 'chunks'
+    chunks = [[cid, entry.row(cid)] for cid in cids if cid < len(entry)]
+    record = {'op': op, 'f': fname, 'size': entry.size,
+              'chunk_size': entry.chunk_size, 'chunks': chunks,
+              'hashes': encode_hashes(entry, [cid for cid, _ in chunks])}
+    if any(entry.crcs):
+        record['crcs'] = [entry.chunk_crcs(cid) for cid, _ in chunks]
+    if entry.dedup:
+        record['dedup'] = True
+    if entry.ec:
+        record['ec'] = list(entry.ec)
+    if entry.codec:
+        record['codec'] = entry.codec
+    if entry.version:
+        record['version'] = entry.version
+    return record
+
+
+def dump_metadata() -> Dict:
+    files = {}
+    for fname, entry in metadata.items():
+        files[fname] = {'size': entry.size, 'chunk_size': entry.chunk_size,
+                        'chunks': [[cid, entry.row(cid)] for cid in range(len(entry))],
+                        'hashes': encode_hashes(entry, list(range(len(entry))))}
+        if any(entry.crcs):
+            files[fname]['crcs'] = [entry.chunk_crcs(cid) for cid in range(len(entry))]
+        if entry.dedup:
+            files[fname]['dedup'] = True
+        if entry.ec:
+            files[fname]['ec'] = list(entry.ec)
+        if entry.codec:
+            files[fname]['codec'] = entry.codec
+        if entry.version:
+            files[fname]['version'] = entry.version
+    return files
+
+
+def log_file(fname: str) -> None:
+    try:
+        metadata_log.append(lambda: file_record(fname))
+    except Exception as e:
+        print(f"Failed to log metadata for {fname}: {e}")
+    queue_changed_chunks(fname)
+
+
+def log_chunks(fname: str, cids: List[int]) -> None:
+    if not cids:
         return
     try:
-        with open(METADATA_FILE, 'r') as f:
-            raw = json.load(f)
-        loaded: Dict[str, List[Tuple[int, List[int]]]] = {}
-        for fname, chunks in raw.items():
-            converted: List[Tuple[int, List[int]]] = []
-            for entry in chunks:
-                cid = entry.get('cid')
-                replicas = entry.get('replicas', [])
-                if isinstance(cid, int):
-                    converted.append((cid, list(replicas)))
-            if converted:
-                loaded[fname] = converted
-        metadata = loaded
-        print(f"Loaded metadata for {len(metadata)} files from {METADATA_FILE}")
+        metadata_log.append(lambda: file_record(fname, cids))
+    except Exception as e:
+        print(f"Failed to log metadata for {fname}: {e}")
+    queue_changed_chunks(fname, cids)
+
+
+def load_metadata_from_disk() -> None:
+    try:
+        replayed = metadata_log.load(restore_snapshot, apply_log_record)
+        print(f"Loaded metadata for {len(metadata)} files from {METADATA_FILE} "
+              f"(+{replayed} log records from {METADATA_LOG})")
+        rebuild_content_index()
     except Exception as e:
         print(f"Failed to load metadata from disk: {e}")
 
 
+def rebuild_content_index() -> None:
+    # One reference per chunk of every dedup file; the nodes listed for
+    # those chunks are the ones holding each object.
+    for fname, entry in metadata.items():
+        if not entry.dedup:
+            continue
+        for (cid, replicas), name in zip(entry.chunks(), content_names(entry, range(len(entry)))):
+            if name is not None:
+                content_index.add_ref(name, chunk_length(entry, cid), replicas)
+
+
+def content_names(entry, cids) -> List[Optional[str]]:
+    # Content object names of a dedup file's chunks, None where unknown.
+    return [content_name(digest, entry.codec) if digest is not None else None
+            for digest in map(entry.hash, cids)]
+
+
+def chunk_length(entry, cid: int) -> int:
+    if entry.size is None:
+        return entry.chunk_size
+    return max(0, min(entry.chunk_size, entry.size - cid * entry.chunk_size))
+
+
 def save_metadata_to_disk() -> None:
     try:
-        serializable: Dict[str, List[Dict[str, List[int]]]] = {}
-        for fname, chunks in metadata.items():
-            serializable[fname] = [
-                {
-                    'cid': cid,
-                    'replicas': replicas,
-                }
-                for cid, replicas in chunks
-            ]
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(serializable, f)
+        metadata_log.checkpoint(dump_metadata)
     except Exception as e:
         print(f"Failed to save metadata to disk: {e}")
 
 
+def file_size(fname: str) -> Optional[int]:
+    # Every chunk but the last is full, so the size pins down the tail
+    # length. Metadata saved before sizes were recorded is probed by
+    # reading the tail chunk. The probed size is not stored, since readers
+    # only hold the file's shared lock; the next append records it.
+    size = metadata.size(fname)
+    if size is None:
+        count = metadata.chunk_count(fname)
+        if not count:
+            return 0
+        tail = read_chunks(fname, [(count - 1, metadata.replicas(fname, count - 1))])[0]
+        if tail is None:
+            return None
+        size = metadata.chunk_size(fname) * (count - 1) + len(tail)
+    return size
+
+
+def chunk_hash(chunk) -> bytes:
+    return hashlib.blake2b(chunk, digest_size=HASH_SIZE).digest()
+
+
+def split_into_chunks(data, chunk_size: int) -> List[memoryview]:
+    view = memoryview(data)
+    return [view[i:i+chunk_size] for i in range(0, len(view), chunk_size)]
+
+
+def chunk_size_for(fname: str, args: str) -> Optional[int]:
+    # An explicit {"chunk_size": N} in the request args wins; otherwise an
+    # existing file keeps its chunk size and a new one gets the default.
+    try:
+        requested = json.loads(args).get('chunk_size') if args else None
+        chunk_size = int(requested) if requested is not None else (metadata.chunk_size(fname) or CHUNK_SIZE)
+    except (ValueError, AttributeError, TypeError):
+        return None
+    return chunk_size if MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE else None
+
+
+def erasure_for(fname: str, args: str) -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+    # {"ec": "k+m"} in the request args stores the file erasure-coded,
+    # {"ec": null} replicated; otherwise an existing file keeps its layout
+    # and a new one is replicated. Returns (scheme, error).
+    try:
+        request = json.loads(args) if args else {}
+    except ValueError:
+        request = {}
+    if not isinstance(request, dict) or 'ec' not in request:
+        entry = metadata.entry(fname)
+        scheme = entry.ec if entry is not None else None
+    elif request['ec'] in (None, '', 'none'):
+        scheme = None
+    else:
+        scheme = parse_scheme(request['ec'])
+        if scheme is None:
+            return None, 'ERROR: Invalid erasure coding scheme (expected k+m)'
+    if scheme is not None and sum(scheme) > len(get_alive_nodes()):
+        return None, f'ERROR: Erasure coding {scheme[0]}+{scheme[1]} needs {sum(scheme)} alive data nodes'
+    return scheme, None
+
+
+def compression_for(fname: str, args: str) -> Tuple[Optional[str], Optional[str]]:
+    # {"compression": "zlib"|"lzma"} in the request args compresses the
+    # file's chunks, {"compression": "none"} stores them as they are;
+    # otherwise an existing file keeps its codec and a new one gets the
+    # --compression default. Returns (codec, error).
+    try:
+        request = json.loads(args) if args else {}
+    except ValueError:
+        request = {}
+    if not isinstance(request, dict) or 'compression' not in request:
+        entry = metadata.entry(fname)
+        return (entry.codec if entry is not None else COMPRESSION), None
+    try:
+        return parse_codec(request['compression']), None
+    except (ValueError, TypeError):
+        return None, f"ERROR: Invalid compression (expected one of none, {', '.join(CODECS)})"
+
+
+def parse_size(text: str) -> int:
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
 def get_alive_nodes() -> List[int]:
-    return [nid for nid, alive in data_nodes_status.items() if alive]
+    return [nid for nid, alive in list(data_nodes_status.items()) if alive]
+
+
+def node_address(node_id: int) -> Dict:
+    return {'node': node_id, 'host': data_nodes[0], 'port': 5000 + node_id}
 
 
-def choose_additional_nodes(exclude: List[int], needed: int) -> List[int]:
+def choose_additional_nodes(exclude: List[int], needed: int, nbytes: int = 0) -> List[int]:
     alive = [n for n in get_alive_nodes() if n not in exclude]
-    return alive[:max(0, needed)]
+    return placement.choose(alive, max(0, needed), nbytes)
 
 
-def write_chunk_to_replicas(fname: str, cid: int, chunk: str, desired_rf: int = 2) -> List[int]:
+def start_chunk_write(fname: str, cid: int, chunk: bytes, desired_rf: int = 2) -> List[Tuple[int, Optional[Future]]]:
+    candidates = choose_additional_nodes([], desired_rf, len(chunk))
+    return [(nid, submit_to_node(nid, 'write', fname, str(cid), chunk)) for nid in candidates]
+
+
+def finish_chunk_write(fname: str, cid: int, chunk: bytes, pending: List[Tuple[int, Optional[Future]]],
+                       desired_rf: int = 2) -> List[int]:
     replicas: List[int] = []
-    candidates = choose_additional_nodes([], desired_rf)
-    if not candidates:
-        return replicas
-    for nid in candidates:
-        ok = get_from_node(nid, f'write:{fname}:{cid}:{chunk}')
-        if ok == 'OK':
+    for nid, fut in pending:
+        reply = wait_for_node(nid, fut)
+        if reply is not None and reply.status == 'OK':
             replicas.append(nid)
         
-    if len(replicas) < desired_rf:
+    if pending and len(replicas) < desired_rf:
         extra_needed = desired_rf - len(replicas)
-        tried = set(candidates)
-        more = [n for n in get_alive_nodes() if n not in tried]
+        tried = set(nid for nid, _ in pending)
+        more = choose_additional_nodes(list(tried), len(data_nodes_status))
         for nid in more:
             if extra_needed <= 0:
                 break
-            ok = get_from_node(nid, f'write:{fname}:{cid}:{chunk}')
-            if ok == 'OK':
+            reply = get_from_node(nid, 'write', fname, str(cid), chunk)
+            if reply is not None and reply.status == 'OK':
+                placement.record(nid, len(chunk))
                 replicas.append(nid)
                 extra_needed -= 1
     return replicas
 
 
-def ensure_replication_for_file(fname: str, desired_rf: int = 2):
-    if fname not in metadata:
+def write_chunk_to_replicas(fname: str, cid: int, chunk: bytes, desired_rf: int = 2) -> List[int]:
+    pending = start_chunk_write(fname, cid, chunk, desired_rf)
+    return finish_chunk_write(fname, cid, chunk, pending, desired_rf)
+
+
+def write_chunks(fname: str, chunks: Iterable[bytes], desired_rf: int = 2,
+                 window: Optional[int] = None, first_cid: int = 0,
+                 cids: Optional[List[int]] = None) -> Optional[List[Tuple[int, List[int]]]]:
+    # Pipelined write: replica writes for up to `window` chunks are in flight
+    # at once. Each chunk still falls back to extra nodes on its own, and the
+    # whole write fails if any chunk ends up with no replica at all. Chunks
+    # get consecutive ids from first_cid unless explicit `cids` are given.
+    window = max(1, window or WRITE_WINDOW)
+    entries: List[Tuple[int, List[int]]] = []
+    in_flight: Deque[Tuple[int, memoryview, List[Tuple[int, Optional[Future]]]]] = deque()
+    failed = False
+
+    def finish_oldest() -> bool:
+        cid, chunk, pending = in_flight.popleft()
+        replicas = finish_chunk_write(fname, cid, chunk, pending, desired_rf)
+        entries.append((cid, replicas))
+        return bool(replicas)
+
+    for cid, chunk in zip(cids, chunks) if cids is not None else enumerate(chunks, first_cid):
+        in_flight.append((cid, chunk, start_chunk_write(fname, cid, chunk, desired_rf)))
+        if len(in_flight) >= window and not finish_oldest():
+            failed = True
+            break
+    while in_flight:
+        if not finish_oldest():
+            failed = True
+    return None if failed else entries
+
+
+def write_content_chunks(chunks: Iterable[bytes], names: List[str], sizes: List[int], desired_rf: int = 2,
+                         window: Optional[int] = None) -> Optional[List[List[int]]]:
+    # Dedup-mode write: every chunk takes a reference on its content object
+    # first. An object that already has desired_rf live copies (or that
+    # appeared earlier in this same write) is not sent again; the rest are
+    # written under their content name, pipelined like write_chunks.
+    # `sizes` are the logical chunk lengths the index accounts for.
+    # Returns the replicas per chunk, or None (with the references dropped
+    # again) if any chunk could not be stored.
+    window = max(1, window or WRITE_WINDOW)
+    placed: List[List[int]] = []
+    # (name, chunk, pending replica writes, live holders); neither is set
+    # for a repeat of an earlier chunk of this write.
+    in_flight: Deque[Tuple[str, bytes, Optional[List], Optional[List[int]]]] = deque()
+    first_seen: Dict[str, int] = {}
+    taken: List[str] = []
+    failed = False
+
+    def finish_oldest() -> bool:
+        name, chunk, pending, live = in_flight.popleft()
+        if pending is not None:
+            replicas = finish_chunk_write(name, 0, chunk, pending, desired_rf)
+            content_index.add_nodes(name, replicas)
+        elif live is None:
+            replicas = placed[first_seen[name]]
+        else:
+            replicas = live
+        placed.append(replicas)
+        return bool(replicas)
+
+    for idx, (chunk, name, size) in enumerate(zip(chunks, names, sizes)):
+        held = content_index.add_ref(name, size)
+        taken.append(name)
+        live = [nid for nid in held if data_nodes_status.get(nid, False)]
+        if name in first_seen:
+            content_index.note_skipped(size)
+            in_flight.append((name, chunk, None, None))
+        elif len(live) >= desired_rf:
+            content_index.note_skipped(size)
+            in_flight.append((name, chunk, None, live[:desired_rf]))
+            first_seen[name] = idx
+        else:
+            in_flight.append((name, chunk, start_chunk_write(name, 0, chunk, desired_rf), None))
+            first_seen[name] = idx
+        if len(in_flight) >= window and not finish_oldest():
+            failed = True
+            break
+    while in_flight:
+        if not finish_oldest():
+            failed = True
+    if failed:
+        release_content(taken)
+        return None
+    return placed
+
+
+def write_stripes(fname: str, chunks: List[memoryview], cids: List[int], scheme: Tuple[int, int],
+                  crcs: Dict[int, List[int]], window: Optional[int] = None) -> Optional[List[Tuple[int, List[int]]]]:
+    # Erasure-coded write: each chunk is encoded into k + m fragments that
+    # go to k + m distinct nodes, with up to `window` stripes in flight. A
+    # fragment whose node fails is retried once on a node outside the
+    # stripe; a stripe missing fragments after that is kept (and left to the
+    # healer) as long as k of them were stored.
+    code = codec(*scheme)
+    window = max(1, window or WRITE_WINDOW)
+    entries: List[Tuple[int, List[int]]] = []
+    in_flight: Deque[Tuple[int, List[bytes], List[Tuple[int, Optional[Future]]]]] = deque()
+    failed = False
+
+    def finish_oldest() -> bool:
+        cid, fragments, pending = in_flight.popleft()
+        row = []
+        for nid, fut in pending:
+            reply = wait_for_node(nid, fut)
+            row.append(nid if reply is not None and reply.status == 'OK' else 0)
+        for pos in [pos for pos, nid in enumerate(row) if not nid]:
+            for nid in choose_additional_nodes([nid for nid, _ in pending] + row, 1, len(fragments[pos])):
+                reply = get_from_node(nid, 'write', fname, str(cid * code.n + pos), fragments[pos])
+                if reply is not None and reply.status == 'OK':
+                    row[pos] = nid
+        entries.append((cid, row))
+        return sum(1 for nid in row if nid) >= code.k
+
+    for cid, chunk in zip(cids, chunks):
+        fragments = code.encode(chunk)
+        crcs[cid] = [zlib.crc32(fragment) for fragment in fragments]
+        nodes = choose_additional_nodes([], code.n, len(fragments[0]))
+        if len(nodes) < code.n:
+            failed = True
+            break
+        in_flight.append((cid, fragments, [(nid, submit_to_node(nid, 'write', fname, str(cid * code.n + pos), fragment))
+                                           for pos, (nid, fragment) in enumerate(zip(nodes, fragments))]))
+        if len(in_flight) >= window and not finish_oldest():
+            failed = True
+            break
+    while in_flight:
+        if not finish_oldest():
+            failed = True
+    return None if failed else entries
+
+
+def checksummed(cids: List[int], chunks: Iterable[bytes], crcs: Dict[int, List[int]]) -> Iterator[bytes]:
+    # Records the CRC of each chunk as it goes out to the data nodes.
+    for cid, chunk in zip(cids, chunks):
+        crcs[cid] = [zlib.crc32(chunk)]
+        yield chunk
+
+
+def pack_chunks(chunks: List[memoryview], compression: str) -> Iterator[bytes]:
+    # Lazily, so each chunk is compressed while earlier ones are in flight.
+    for chunk in chunks:
+        packed = pack_chunk(chunk, compression)
+        codec_stats.record(len(chunk), packed)
+        yield packed
+
+
+def store_chunks(fname: str, chunks: List[memoryview], hashes: List[bytes], dedup: bool,
+                 crcs: Dict[int, List[int]], desired_rf: int = 2, first_cid: int = 0,
+                 cids: Optional[List[int]] = None, ec: Optional[Tuple[int, int]] = None,
+                 compression: Optional[str] = None) -> Optional[List[Tuple[int, List[int]]]]:
+    # `crcs` is filled with the CRCs of the stored bytes per chunk id.
+    if cids is None:
+        cids = list(range(first_cid, first_cid + len(chunks)))
+    if ec is not None:
+        return write_stripes(fname, chunks, cids, ec, crcs)
+    stored = checksummed(cids, pack_chunks(chunks, compression) if compression else chunks, crcs)
+    if not dedup:
+        return write_chunks(fname, stored, desired_rf, cids=cids)
+    names = [content_name(digest, compression) for digest in hashes]
+    placed = write_content_chunks(stored, names, [len(chunk) for chunk in chunks], desired_rf)
+    if placed is None:
+        return None
+    return list(zip(cids, placed))
+
+
+def pieces(name: str, ec: Optional[Tuple[int, int]], cid: int, row: List[int]) -> List[Tuple[str, int, int]]:
+    # (name, chunk id, node) of every stored copy or fragment of a chunk
+    # stored under `name`.
+    if ec is None:
+        return [(name, cid, nid) for nid in row]
+    return [(name, cid * sum(ec) + pos, nid) for pos, nid in enumerate(row) if nid]
+
+
+def delete_pieces(stale: List[Tuple[str, int, int]]) -> None:
+    pending = [(nid, submit_to_node(nid, 'delete', name, str(key))) for name, key, nid in stale]
+    for nid, fut in pending:
+        wait_for_node(nid, fut)
+
+
+def delete_stale(fname: str, old, cids: List[int]) -> None:
+    # Deletes what chunks `cids` of a replaced entry stored that the file's
+    # current entry does not use. When the layout changed, the chunk ids on
+    # the data nodes mean different things, so everything the new entry
+    # stores is kept. A new entry stored under another version shares
+    # nothing with the old one.
+    new = metadata.entry(fname)
+    if old is None or old.dedup:
         return
-    new_entries: List[Tuple[int, List[int]]] = []
-    for cid, replicas in metadata[fname]:
-        alive_replicas = [n for n in replicas if data_nodes_status.get(n, False)]
-        if len(alive_replicas) >= desired_rf:
-            new_entries.append((cid, alive_replicas[:desired_rf]))
+    if new is None:
+        keep = set()
+    else:
+        keep_cids = cids if new.ec == old.ec else range(len(new))
+        keep = {piece for cid in keep_cids if cid < len(new)
+                for piece in pieces(stored_name(fname, new), new.ec, cid, new.row(cid))}
+    delete_pieces([piece for cid in cids if cid < len(old)
+                   for piece in pieces(stored_name(fname, old), old.ec, cid, old.row(cid)) if piece not in keep])
+
+
+def release_content(names: List[Optional[str]]) -> None:
+    # Drops one reference per content object and deletes objects nothing
+    # uses any more from every node that was given a copy. Copies on nodes
+    # that are down are left to the block audit.
+    for name in names:
+        if name is None:
             continue
-       
-        chunk_data = ''
-        for nid in alive_replicas:
-            chunk_data = get_from_node(nid, f'read:{fname}:{cid}')
-            if chunk_data:
-                break
-        if chunk_data == '':
-            
-            new_entries.append((cid, alive_replicas))
+        nodes = content_index.drop_ref(name)
+        if nodes is None:
+            continue
+        try:
+            delete_pieces([(name, 0, nid) for nid in nodes if data_nodes_status.get(nid, False)])
+        finally:
+            content_index.reclaimed(name)
+
+
+def release_file(entry) -> None:
+    if entry is not None and entry.dedup:
+        release_content(content_names(entry, range(len(entry))))
+
+
+def create_file(fname: str, content, chunk_size: int, ec: Optional[Tuple[int, int]] = None,
+                compression: Optional[str] = None, desired_rf: int = 2) -> Optional[List[Tuple[int, List[int]]]]:
+    # Writes a new file (or replaces one) from scratch. New files are dedup
+    # files when the master runs with --dedup; a replaced file keeps its mode
+    # and the version its chunks are stored under. Erasure-coded files are
+    # never deduplicated or compressed.
+    chunks = split_into_chunks(content, chunk_size)
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    old = metadata.entry(fname)
+    dedup = (old.dedup if old is not None else DEDUP) and ec is None
+    version = old.version if old is not None else 0
+    compression = compression if ec is None else None
+    metadata.put(fname, [], 0, chunk_size, dedup=dedup, ec=ec, codec=compression, version=version)
+    crcs: Dict[int, List[int]] = {}
+    entries = store_chunks(versioned_name(fname, version), chunks, hashes, dedup, crcs, desired_rf, ec=ec,
+                           compression=compression)
+    if entries is None:
+        return None
+    metadata.put(fname, entries, len(content), chunk_size, hashes, dedup, ec, compression, version)
+    metadata.set_crcs(fname, crcs)
+    release_file(old)
+    log_file(fname)
+    return entries
+
+
+def append_to_file(fname: str, data, desired_rf: int = 2) -> str:
+    # Only the tail is touched: the last partial chunk is topped up in place
+    # on its replicas and whatever does not fit goes into new chunks. The
+    # new chunks are written first, while nothing refers to them, so a
+    # failed append leaves the file's metadata (and size) as it was.
+    entry = metadata.entry(fname)
+    if entry is not None and (entry.dedup or entry.ec or entry.codec):
+        return rewrite_tail(fname, entry, data, desired_rf)
+    count = metadata.chunk_count(fname)
+    chunk_size = metadata.chunk_size(fname)
+    size = file_size(fname)
+    if size is None:
+        return 'ERROR: Tail chunk unavailable'
+    view = memoryview(data)
+    name = stored_name(fname, entry)
+    tail_len = size - chunk_size * (count - 1) if count else chunk_size
+    fill = max(0, min(len(view), chunk_size - tail_len))
+    new_chunks = split_into_chunks(view[fill:], chunk_size)
+    new_cids = list(range(count, count + len(new_chunks)))
+    crcs: Dict[int, List[int]] = {}
+    added = write_chunks(name, checksummed(new_cids, new_chunks, crcs), desired_rf, first_cid=count)
+    if added is None:
+        return 'ERROR: Write failed'
+    if fill:
+        cid = count - 1
+        pending = [(nid, submit_to_node(nid, 'append', name, f'{cid}:{tail_len}', view[:fill]))
+                   for nid in metadata.replicas(fname, cid) if data_nodes_status.get(nid, False)]
+        updated = []
+        for nid, fut in pending:
+            reply = wait_for_node(nid, fut)
+            if reply is not None and reply.status == 'OK':
+                updated.append(nid)
+        if not updated:
+            return 'ERROR: Write failed'
+        tail_crc = entry.crc(cid) if entry is not None else None
+        metadata.set_replicas(fname, cid, updated)
+        metadata.set_hashes(fname, {cid: None})
+        metadata.set_crcs(fname, {cid: [zlib.crc32(view[:fill], tail_crc) if tail_crc is not None else 0]})
+    touched = [count - 1] if fill else []
+    metadata.update(fname, added)
+    metadata.set_hashes(fname, {cid: chunk_hash(chunk) for cid, chunk in enumerate(new_chunks, count)})
+    metadata.set_crcs(fname, crcs)
+    metadata.set_size(fname, size + len(view))
+    log_chunks(fname, touched + [cid for cid, _ in added])
+    return f'SUCCESS: Appended {len(view)} bytes'
+
+
+def rewrite_tail(fname: str, entry, data, desired_rf: int = 2) -> str:
+    # A dedup file's tail object may be shared, an erasure-coded tail
+    # stripe has parity to recompute and a compressed tail has to be
+    # compressed again, so none is appended to in place: the partial tail
+    # is read back and stored again with the new data.
+    count = len(entry)
+    chunk_size = entry.chunk_size
+    size = entry.size or 0
+    tail_len = size - chunk_size * (count - 1) if count else chunk_size
+    first = count
+    tail = b''
+    if tail_len < chunk_size:
+        first = count - 1
+        tail = read_chunks(fname, [(first, entry.replicas(first))])[0]
+        if tail is None:
+            return 'ERROR: Tail chunk unavailable'
+    chunks = split_into_chunks(tail + bytes(data), chunk_size)
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    cids = list(range(first, first + len(chunks)))
+    crcs: Dict[int, List[int]] = {}
+    added = store_chunks(stored_name(fname, entry), chunks, hashes, entry.dedup, crcs, desired_rf, cids=cids,
+                         ec=entry.ec, compression=entry.codec)
+    if added is None:
+        return 'ERROR: Write failed'
+    old_tail = content_names(entry, [first])[0] if first < count else None
+    old_row = entry.row(first) if first < count else []
+    metadata.update(fname, added)
+    metadata.set_hashes(fname, dict(zip(cids, hashes)))
+    metadata.set_crcs(fname, crcs)
+    metadata.set_size(fname, size + len(data))
+    if entry.dedup:
+        release_content([old_tail])
+    else:
+        current = metadata.entry(fname)
+        name = stored_name(fname, entry)
+        kept = set(pieces(name, current.ec, first, current.row(first)))
+        delete_pieces([piece for piece in pieces(name, entry.ec, first, old_row) if piece not in kept])
+    log_chunks(fname, cids)
+    return f'SUCCESS: Appended {len(data)} bytes'
+
+
+def overwrite_file(fname: str, content, chunk_size: int, ec: Optional[Tuple[int, int]] = None,
+                   compression: Optional[str] = None, desired_rf: int = 2) -> str:
+    # Delta overwrite: a chunk whose content hash matches the one recorded
+    # for the same chunk id (same chunk size) and that still has a live
+    # replica is kept as is; only the other chunks are written. Replicas of
+    # rewritten chunks that the new placement no longer uses, and chunks
+    # past the new end of the file, are deleted afterwards (for dedup files,
+    # their content references are dropped instead).
+    chunks = split_into_chunks(content, chunk_size)
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    old = metadata.entry(fname)
+    old_count = len(old) if old is not None else 0
+    dedup = (old.dedup if old is not None else DEDUP) and ec is None
+    version = old.version if old is not None else 0
+    compression = compression if ec is None else None
+    # An erasure-coded chunk is kept if k of its fragments are live.
+    needed = ec[0] if ec is not None else 1
+    kept: Dict[int, List[int]] = {}
+    if old is not None and old.chunk_size == chunk_size and old.ec == ec and old.dedup == dedup \
+            and old.codec == compression:
+        for cid in range(min(old_count, len(chunks))):
+            row = old.row(cid)
+            if old.hash(cid) == hashes[cid] and sum(1 for nid in row if data_nodes_status.get(nid, False)) >= needed:
+                kept[cid] = row
+    changed = [cid for cid in range(len(chunks)) if cid not in kept]
+    crcs = {cid: old.chunk_crcs(cid) for cid in kept}
+    written = store_chunks(versioned_name(fname, version), [chunks[cid] for cid in changed],
+                           [hashes[cid] for cid in changed], dedup, crcs, desired_rf, cids=changed, ec=ec,
+                           compression=compression)
+    if written is None:
+        # Some replicas may already hold new bytes; forget their hashes so a
+        # retry rewrites them. Dedup files never overwrite stored content.
+        if not dedup:
+            metadata.set_hashes(fname, {cid: None for cid in changed})
+        return 'ERROR: Write failed'
+    entries = dict(written)
+    entries.update(kept)
+    metadata.put(fname, sorted(entries.items()), len(content), chunk_size, hashes, dedup, ec, compression, version)
+    metadata.set_crcs(fname, crcs)
+    replaced = [cid for cid in range(old_count) if cid not in kept]
+    if old is not None and old.dedup:
+        release_content(content_names(old, replaced))
+    else:
+        delete_stale(fname, old, replaced)
+    log_file(fname)
+    return f'SUCCESS: Replaced file with {len(content)} bytes ({len(changed)} of {len(chunks)} chunks rewritten)'
+
+
+def hedge_delay() -> Optional[float]:
+    if HEDGE_PERCENTILE <= 0 or len(read_latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    samples = sorted(read_latencies)
+    idx = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100.0))
+    return max(HEDGE_MIN_DELAY, samples[idx])
+
+
+def read_chunks(fname: str, entries: List[Tuple[int, List[int]]],
+                window: Optional[int] = None) -> List[Optional[bytes]]:
+    # Fetch up to `window` chunks concurrently, each from its first alive
+    # replica. A failed read moves on to the next replica; a read slower than
+    # the observed HEDGE_PERCENTILE latency gets a second, hedged request to
+    # another replica and whichever answers first wins. Results come back in
+    # chunk order, with None for chunks no replica could serve.
+    window = max(1, window or READ_WINDOW)
+    entry = metadata.entry(fname)
+    if entry is not None and entry.ec:
+        return read_stripes(fname, entry, [cid for cid, _ in entries], window)
+    delay = hedge_delay()
+    keys = [chunk_key(fname, entry, cid) for cid, _ in entries]
+    results: List[Optional[bytes]] = [None] * len(entries)
+    todo: Deque[int] = deque(range(len(entries)))
+    remaining: Dict[int, Deque[int]] = {}
+    active: Dict[int, List[Future]] = {}
+    hedged: Set[int] = set()
+    outstanding: Dict[Future, Tuple[int, int, float]] = {}
+
+    def issue(idx: int) -> bool:
+        while remaining[idx]:
+            nid = remaining[idx].popleft()
+            name, key = keys[idx]
+            fut = submit_to_node(nid, 'read', name, str(key))
+            if fut is not None:
+                outstanding[fut] = (idx, nid, time.time())
+                active[idx].append(fut)
+                return True
+        return False
+
+    def finish(idx: int) -> None:
+        for fut in active.pop(idx):
+            outstanding.pop(fut, None)
+
+    while todo or outstanding:
+        while todo and len(active) < window:
+            idx = todo.popleft()
+            remaining[idx] = deque(n for n in entries[idx][1] if data_nodes_status.get(n, False))
+            active[idx] = []
+            if not issue(idx):
+                finish(idx)
+        if not outstanding:
+            continue
+        now = time.time()
+        deadlines = [start + NODE_RPC_TIMEOUT for _, _, start in outstanding.values()]
+        if delay is not None:
+            deadlines += [start + delay for idx, _, start in outstanding.values()
+                          if idx not in hedged and remaining[idx]]
+        done, _ = wait(list(outstanding), timeout=max(0.0, min(deadlines) - now),
+                       return_when=FIRST_COMPLETED)
+        now = time.time()
+        for fut in done:
+            if fut not in outstanding:
+                continue
+            idx, nid, start = outstanding.pop(fut)
+            active[idx].remove(fut)
+            data = chunk_data(fname, entry, entries[idx][0], nid, wait_for_node(nid, fut))
+            if data is not None:
+                read_latencies.append(now - start)
+                results[idx] = data
+                finish(idx)
+            elif not active[idx] and not issue(idx):
+                finish(idx)
+        for fut, (idx, nid, start) in list(outstanding.items()):
+            if fut not in outstanding:
+                continue
+            if now - start >= NODE_RPC_TIMEOUT:
+                outstanding.pop(fut)
+                active[idx].remove(fut)
+                wait_for_node(nid, fut, timeout=0)
+                if not active[idx] and not issue(idx):
+                    finish(idx)
+            elif delay is not None and now - start >= delay and idx not in hedged and remaining[idx]:
+                hedged.add(idx)
+                issue(idx)
+    return results
+
+
+def verified(payload, expected: Optional[int], name: str, key: int, nid: int) -> bool:
+    # Checks a copy read from node nid against the CRC recorded when it was
+    # written; a copy that fails is queued for the healer to replace.
+    if expected is None or zlib.crc32(payload) == expected:
+        return True
+    print(f"Checksum mismatch for {name}:{key} on node {nid}")
+    corrupt_copies.append((name, key, nid, expected))
+    return False
+
+
+def chunk_data(fname: str, entry, cid: int, nid: int, reply: Optional[protocol.Frame]) -> Optional[bytes]:
+    # The chunk bytes of a successful read reply, checked against the
+    # chunk's CRC and decompressed for a compressed file. A chunk that fails
+    # either counts as a failed read, so the next replica is tried.
+    if reply is None or reply.status != 'OK':
+        return None
+    if entry is not None and not verified(reply.payload, entry.crc(cid), *chunk_key(fname, entry, cid), nid):
+        return None
+    if entry is None or not entry.codec:
+        return reply.payload
+    try:
+        return unpack_chunk(reply.payload)
+    except ValueError as e:
+        print(f"Undecodable chunk of {fname}: {e}")
+        return None
+
+
+def read_stripes(fname: str, entry, cids: List[int], window: int) -> List[Optional[bytes]]:
+    # Degraded-capable read of erasure-coded chunks, `window` stripes at a
+    # time: k fragments are requested per stripe from live nodes, data
+    # fragments first (those decode by concatenation), and each failed
+    # or damaged fragment is replaced by a request for another one until k
+    # arrive or the stripe runs out of fragments. None for stripes that
+    # cannot be rebuilt.
+    code = codec(*entry.ec)
+    name = stored_name(fname, entry)
+    results: List[Optional[bytes]] = [None] * len(cids)
+
+    def request(cid: int, row: List[int], positions: List[int]) -> List[Tuple[int, int, Optional[Future]]]:
+        return [(pos, row[pos], submit_to_node(row[pos], 'read', name, str(cid * code.n + pos))) for pos in positions]
+
+    for start in range(0, len(cids), window):
+        batch = []
+        for cid in cids[start:start + window]:
+            row = entry.row(cid)
+            live = [pos for pos, nid in enumerate(row) if nid and data_nodes_status.get(nid, False)]
+            batch.append((cid, row, deque(live[code.k:]), request(cid, row, live[:code.k])))
+        for idx, (cid, row, spare, pending) in enumerate(batch, start):
+            fragments: Dict[int, bytes] = {}
+            while pending:
+                for pos, nid, fut in pending:
+                    reply = wait_for_node(nid, fut)
+                    if reply is not None and reply.status == 'OK' and \
+                            verified(reply.payload, entry.crc(cid, pos), name, cid * code.n + pos, nid):
+                        fragments[pos] = reply.payload
+                more = min(code.k - len(fragments), len(spare))
+                pending = request(cid, row, [spare.popleft() for _ in range(more)])
+            if len(fragments) >= code.k:
+                results[idx] = code.decode(fragments, chunk_length(entry, cid))
+    return results
+
+
+def chunk_unchanged(fname: str, cid: int, entry, size: Optional[int], replicas: List[int]) -> bool:
+    # Compare-and-swap check for background jobs that copy chunk data
+    # without holding the file lock; call it with the file's write lock
+    # held. Overwrites replace the file's entry and appends change its size,
+    # so an unchanged entry, size and replica list mean the chunk bytes
+    # that were copied are still current.
+    return metadata.entry(fname) is entry and entry.size == size and entry.replicas(cid) == replicas
+
+
+def repair_chunk(fname: str, cid: int, desired_rf: int = 2) -> Optional[int]:
+    # Called by the replication workers. New replicas pull the chunk
+    # straight from a live replica, so no chunk bytes pass through the
+    # master. Returns bytes copied, 0 if nothing was needed, None if the
+    # chunk cannot be healed yet.
+    entry = metadata.entry(fname)
+    if entry is None or cid >= len(entry):
+        return 0
+    if entry.ec:
+        return repair_stripe(fname, entry, cid)
+    size = entry.size
+    replicas = entry.replicas(cid)
+    alive = [n for n in replicas if data_nodes_status.get(n, False)]
+    if len(alive) >= desired_rf:
+        if alive[:desired_rf] != replicas:
+            with file_locks.write(fname):
+                if chunk_unchanged(fname, cid, entry, size, replicas):
+                    metadata.set_replicas(fname, cid, alive[:desired_rf])
+                    log_chunks(fname, [cid])
+        return 0
+    targets = choose_additional_nodes(replicas, desired_rf - len(alive), entry.chunk_size)
+    if not alive or not targets:
+        return None
+    # Sources whose block report lacks the chunk are only tried last.
+    name, key = chunk_key(fname, entry, cid)
+    sources = sorted(alive, key=lambda nid: block_map.holds(nid, name, key) is False)
+    request = json.dumps({'chunk_id': key, 'sources': [node_address(nid) for nid in sources], 'crc': entry.crc(cid)})
+    added: List[int] = []
+    copied = 0
+    for nid in targets:
+        reply = get_from_node(nid, 'replicate', name, request)
+        if reply is not None and reply.status.startswith('OK'):
+            added.append(nid)
+            copied += int(reply.status.partition(':')[2] or 0)
+    if not added:
+        return None
+    if entry.dedup:
+        content_index.add_nodes(name, added)
+    # If the file was rewritten or appended to while the chunk was copied,
+    # the copy may be stale; the next scan retries the chunk instead and
+    # the block audit removes the unused copy.
+    with file_locks.write(fname):
+        if chunk_unchanged(fname, cid, entry, size, replicas):
+            metadata.set_replicas(fname, cid, alive + added)
+            log_chunks(fname, [cid])
+    return copied
+
+
+def repair_stripe(fname: str, entry, cid: int) -> Optional[int]:
+    # Erasure-coded chunks are healed by reconstruction rather than copying:
+    # the stripe is decoded from k live fragments, the fragments on dead or
+    # lost positions are re-encoded and written to live nodes outside the
+    # stripe. Fragment bytes pass through the master here.
+    code = codec(*entry.ec)
+    size = entry.size
+    row = entry.row(cid)
+    live = [pos for pos, nid in enumerate(row) if nid and data_nodes_status.get(nid, False)]
+    lost = [pos for pos in range(code.n) if pos not in live]
+    if not lost:
+        return 0
+    if len(live) < code.k:
+        return None
+    length = chunk_length(entry, cid)
+    targets = choose_additional_nodes([row[pos] for pos in live], len(lost), code.fragment_size(length))
+    if not targets:
+        return None
+    stripe = read_stripes(fname, entry, [cid], 1)[0]
+    if stripe is None:
+        return None
+    fragments = code.encode(stripe)
+    new_row = list(row)
+    written = 0
+    for pos, nid in zip(lost, targets):
+        reply = get_from_node(nid, 'write', stored_name(fname, entry), str(cid * code.n + pos), fragments[pos])
+        if reply is not None and reply.status == 'OK':
+            new_row[pos] = nid
+            written += len(fragments[pos])
+    if not written:
+        return None
+    with file_locks.write(fname):
+        if chunk_unchanged(fname, cid, entry, size, [nid for nid in row if nid]):
+            metadata.set_replicas(fname, cid, new_row)
+            log_chunks(fname, [cid])
+    return written
+
+
+def queue_short_chunks(fname: str, entry, cids: Iterable[int], alive: Set[int], desired_rf: int = 2) -> int:
+    # Queues the chunks among `cids` with fewer than desired_rf live
+    # replicas (fewer than k + m live fragments if erasure-coded).
+    queued = 0
+    for cid in cids:
+        row = entry.row(cid)
+        live = sum(1 for nid in row if nid in alive)
+        if entry.ec:
+            # Priority is the fragments left beyond k, plus one, so a stripe
+            # down to k fragments ranks with a chunk down to one copy.
+            k, m = entry.ec
+            if live < k + m:
+                replication.enqueue(fname, cid, live - k + 1)
+                queued += 1
+        elif live < desired_rf:
+            replication.enqueue(fname, cid, live)
+            queued += 1
+    return queued
+
+
+def queue_changed_chunks(fname: str, cids: Optional[List[int]] = None) -> None:
+    # Every metadata change is logged, so this is where a chunk written,
+    # appended or repaired short of its replicas joins the queue.
+    entry = metadata.entry(fname)
+    if entry is not None:
+        cids = range(len(entry)) if cids is None else [cid for cid in cids if cid < len(entry)]
+        queue_short_chunks(fname, entry, cids, set(get_alive_nodes()))
+
+
+def queue_under_replicated(node_id: Optional[int] = None) -> int:
+    # Metadata-only scan that feeds the replication queue. With node_id set
+    # (a node died) only the chunks on that node are looked at, found
+    # through the chunk table's per-node file index; without it every file
+    # is, which the healer only does as an occasional consistency sweep.
+    alive = set(get_alive_nodes())
+    queued = 0
+    files = metadata.items() if node_id is None else metadata.files_on(node_id)
+    for fname, entry in files:
+        cids = range(len(entry))
+        if node_id is not None:
+            cids = [cid for cid in cids if node_id in entry.row(cid)]
+        queued += queue_short_chunks(fname, entry, cids, alive)
+    return queued
+
+
+def mark_node_dead(node_id: int) -> None:
+    was_alive = data_nodes_status.get(node_id, False)
+    data_nodes_status[node_id] = False
+    if was_alive:
+        dead_nodes.add(node_id)
+
+
+def version_pending(fname: str, version: int) -> bool:
+    # Whether a direct write's version is pending and not expired; called
+    # under pending_lock.
+    last = pending_versions.get((fname, version))
+    return last is not None and time.time() - last < PENDING_WRITE_TIMEOUT
+
+
+def allocate_version(fname: str, version: int) -> int:
+    # Hands out a new version to a direct write (version 0) or keeps a
+    # pending one alive. Returns 0 for a version that is not pending
+    # (committed, expired or never handed out).
+    with pending_lock:
+        if not version:
+            version = next(direct_versions)
+        elif not version_pending(fname, version):
+            return 0
+        pending_versions[(fname, version)] = time.time()
+        return version
+
+
+def finish_version(fname: str, version: int) -> bool:
+    # Takes a direct write's version out of the pending table at its
+    # commit. Returns whether it was pending, so a version commits once.
+    with pending_lock:
+        pending = version_pending(fname, version)
+        pending_versions.pop((fname, version), None)
+        return pending
+
+
+def pending_names() -> Set[str]:
+    # Stored names of the pending direct writes, dropping the expired ones.
+    with pending_lock:
+        for fname, version in [key for key in pending_versions if not version_pending(*key)]:
+            del pending_versions[(fname, version)]
+        return {versioned_name(fname, version) for fname, version in pending_versions}
+
+
+def audit_blocks() -> None:
+    # Reconciles block reports with the metadata. A replica a live node no
+    # longer holds is dropped from the chunk's replica list (never the last
+    # one) and the chunk is queued for re-replication; a chunk a node holds
+    # that the metadata does not assign to it is deleted from that node.
+    # That includes chunks stored under a version of a file other than its
+    # current one: those of replaced versions, and those of direct writes
+    # that expired without being committed.
+    missing, orphans = block_map.audit(metadata, get_alive_nodes(), MISSING_GRACE, ORPHAN_GRACE, content_index,
+                                       pending_names())
+    for fname, cid, nid in missing:
+        if not drop_replica(fname, cid, nid):
+            print(f"Chunk {fname}:{cid} missing on node {nid}")
+    for fname, cid, nid in orphans:
+        if is_content_name(fname):
+            if not content_index.holds(fname, nid):
+                send_to_node(nid, 'delete', fname, str(cid))
+            continue
+        owner, version = split_versioned_name(fname)
+        with file_locks.write(owner):
+            entry = metadata.entry(owner)
+            with pending_lock:
+                pending = version_pending(owner, version)
+            if not pending and (entry is None or entry.version != version or not entry.assigned(cid, nid)):
+                send_to_node(nid, 'delete', fname, str(cid))
+    if missing or orphans:
+        print(f"Block audit: {len(missing)} missing replicas, {len(orphans)} orphaned chunks")
+
+
+def holds_copy(entry, key: int, nid: int, crc: Optional[int] = None, version: Optional[int] = None) -> bool:
+    # Whether node nid holds chunk `key` (as numbered on the data nodes) of
+    # the file. Given the CRC a reported copy was written with, also whether
+    # the chunk table still records that CRC (or none), so a report about a
+    # copy that was overwritten or replaced since never hits the new one.
+    # Given the version the copy is stored under, also whether that is
+    # still the file's current one.
+    if entry is None or not entry.assigned(key, nid):
+        return False
+    if version is not None and entry.version != version:
+        return False
+    if crc is None:
+        return True
+    current = entry.crc(*divmod(key, sum(entry.ec))) if entry.ec else entry.crc(key)
+    return current is None or current == crc
+
+
+def drop_replica(fname: str, key: int, nid: int, delete: bool = False, crc: Optional[int] = None,
+                 version: Optional[int] = None) -> bool:
+    # Takes node nid's copy of chunk `key` (as numbered on the data nodes)
+    # out of the file's metadata and queues the chunk for repair; with
+    # `delete` the copy is also deleted from the node, under the file lock
+    # so a newer copy written there meanwhile is never hit. With `crc` (and
+    # `version`), only a copy the chunk table still expects to hold those
+    # bytes is dropped (see holds_copy). A lost fragment's position is cleared and the stripe
+    # rebuilt; the last replica of a replicated chunk is never dropped.
+    # Returns whether the copy was dropped.
+    with file_locks.write(fname):
+        entry = metadata.entry(fname)
+        if not holds_copy(entry, key, nid, crc, version):
+            return False
+        if entry.ec:
+            cid, pos = divmod(key, sum(entry.ec))
+            row = entry.row(cid)
+            row[pos] = 0
+        else:
+            cid = key
+            row = [n for n in entry.replicas(cid) if n != nid]
+            if not row:
+                return False
+        metadata.set_replicas(fname, cid, row)
+        log_chunks(fname, [cid])
+        if delete:
+            send_to_node(nid, 'delete', stored_name(fname, entry), str(key))
+    live = sum(1 for n in row if n and data_nodes_status.get(n, False))
+    replication.enqueue(fname, cid, live - entry.ec[0] + 1 if entry.ec else live)
+    return True
+
+
+def handle_corrupt_copies() -> None:
+    # A damaged copy of a file's chunk is dropped and deleted once another
+    # copy exists, and the chunk re-replicated from a good one. A damaged
+    # content object is only dropped from the content index: the block
+    # audit then deletes it as an orphan and heals the files using it.
+    while corrupt_copies:
+        name, key, nid, crc = corrupt_copies.popleft()
+        integrity_stats['corrupt_reported'] += 1
+        if is_content_name(name):
+            if content_index.drop_node(name, nid):
+                integrity_stats['copies_dropped'] += 1
             continue
-        needed = desired_rf - len(alive_replicas)
-        add_nodes = choose_additional_nodes(alive_replicas, needed)
-        for nid in add_nodes:
-            ok = get_from_node(nid, f'write:{fname}:{cid}:{chunk_data}')
-            if ok == 'OK':
-                alive_replicas.append(nid)
-        new_entries.append((cid, alive_replicas))
-    metadata[fname] = new_entries
+        fname, version = split_versioned_name(name)
+        if drop_replica(fname, key, nid, delete=True, crc=crc, version=version):
+            integrity_stats['copies_dropped'] += 1
+        elif holds_copy(metadata.entry(fname), key, nid, crc, version):
+            print(f"Corrupt copy of {name}:{key} on node {nid} kept: no other copy to repair from")
+        # Otherwise the copy was already dropped, rewritten or deleted with
+        # its file since it was reported.
+
+
+def run_block_audit(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            audit_blocks()
+        except Exception as e:
+            print(f"Block audit failed: {e}")
 
 
-def ensure_replication_all(desired_rf: int = 2):
-    for fname in list(metadata.keys()):
-        ensure_replication_for_file(fname, desired_rf)
+def move_chunk(fname: str, cid: int, source: int, target: int) -> int:
+    # Copies one replica from `source` to `target` node-to-node, points the
+    # metadata at the new copy and drops the old one. Returns bytes moved.
+    entry = metadata.entry(fname)
+    if entry is None or cid >= len(entry):
+        return 0
+    size = entry.size
+    replicas = entry.replicas(cid)
+    if source not in replicas or target in replicas:
+        return 0
+    sources = [source] + [nid for nid in replicas if nid != source and data_nodes_status.get(nid, False)]
+    request = json.dumps({'chunk_id': cid, 'sources': [node_address(nid) for nid in sources], 'crc': entry.crc(cid)})
+    name = stored_name(fname, entry)
+    reply = get_from_node(target, 'replicate', name, request)
+    if reply is None or not reply.status.startswith('OK'):
+        return 0
+    with file_locks.write(fname):
+        if not chunk_unchanged(fname, cid, entry, size, replicas):
+            return 0
+        metadata.set_replicas(fname, cid, [target if nid == source else nid for nid in replicas])
+        log_chunks(fname, [cid])
+        send_to_node(source, 'delete', name, str(cid))
+    return int(reply.status.partition(':')[2] or 0)
+
+
+def rebalance_once() -> int:
+    # Moves chunks from the fullest alive node to the emptiest one until
+    # their reported fill ratios even out (at most REBALANCE_MAX_BYTES per
+    # round), sharing the re-replication bandwidth budget. Dedup files are
+    # skipped (their content objects are shared with other files), and so
+    # are erasure-coded ones.
+    plan = placement.imbalance(get_alive_nodes(), REBALANCE_THRESHOLD)
+    if plan is None:
+        return 0
+    hot, cold, goal = plan
+    goal = min(goal, REBALANCE_MAX_BYTES)
+    moved = 0
+    for fname, entry in metadata.items():
+        if entry.dedup or entry.ec or hot not in entry.slots:
+            continue
+        for cid, replicas in entry.chunks():
+            if moved >= goal:
+                break
+            if hot in replicas and cold not in replicas:
+                copied = move_chunk(fname, cid, hot, cold)
+                if copied:
+                    moved += copied
+                    placement.record(cold, copied)
+                    placement.record(hot, -copied)
+                    replication.throttle.acquire(copied)
+        if moved >= goal:
+            break
+    if moved:
+        print(f"Rebalanced {moved} bytes from node {hot} to node {cold}")
+    return moved
+
+
+def run_rebalancer(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            rebalance_once()
+        except Exception as e:
+            print(f"Rebalance failed: {e}")
 
 
 def handle_connections(master_sock):
@@ -128,184 +1299,420 @@ def handle_connections(master_sock):
         threading.Thread(target=process_connection, args=(client_sock,)).start()
 
 
+async def process_connection_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                   executor: ThreadPoolExecutor, slots: asyncio.Semaphore) -> None:
+    # Serves requests on one connection until the peer closes it. Blocking
+    # commands wait for a free worker slot, so a burst of clients queues up
+    # here instead of piling work onto the executor.
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                frame = await protocol.read_frame_async(reader)
+            except protocol.ProtocolError as e:
+                print(f"Dropping malformed request: {e}")
+                break
+            if frame is None:
+                break
+            if frame.cmd in INLINE_COMMANDS and len(frame.payload) <= INLINE_PAYLOAD_MAX:
+                response, payload = handle_request(frame)
+            else:
+                async with slots:
+                    response, payload = await loop.run_in_executor(executor, handle_request, frame)
+            await protocol.write_reply_async(writer, response, payload, frame.request_id)
+    except OSError as e:
+        print(f"Connection error: {e}")
+    except Exception as e:
+        print(f"Failed to handle request: {e}")
+    finally:
+        writer.close()
+
+
+async def serve_async(master_sock: socket.socket, workers: int) -> None:
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='master-worker')
+    slots = asyncio.Semaphore(workers)
+    server = await asyncio.start_server(
+        lambda reader, writer: process_connection_async(reader, writer, executor, slots),
+        sock=master_sock, backlog=LISTEN_BACKLOG)
+    async with server:
+        await server.serve_forever()
+
+
+def handle_connections_async(master_sock: socket.socket, workers: int) -> None:
+    asyncio.run(serve_async(master_sock, workers))
+
+
 def process_connection(client_sock):
-    data = client_sock.recv(4096).decode()
-    if not data:
-        client_sock.close()
-        return
-    if data.startswith('heartbeat:'):
+    # Serves requests until the peer closes; one-shot clients send a single
+    # request, data nodes keep their heartbeat connection open.
+    while True:
         try:
-            node_id = int(data.split(':')[1])
-            data_nodes_status[node_id] = True
-            last_heartbeat[node_id] = time.time()
-            print(f"Node {node_id} is alive (heartbeat received)")
-            client_sock.send('OK'.encode())
-        except:
-            pass
-        client_sock.close()
-        return
-    parts = data.split(':', 2)
-    if len(parts) < 2:
-        client_sock.send('ERROR: Invalid request'.encode())
-        client_sock.close()
-        return
-    cmd, fname = parts[0], parts[1]
-    args = parts[2] if len(parts) > 2 else ''
+            frame = protocol.recv_frame(client_sock)
+        except (OSError, protocol.ProtocolError) as e:
+            print(f"Dropping malformed request: {e}")
+            break
+        if frame is None:
+            break
+        response, payload = handle_request(frame)
+        try:
+            protocol.send_reply(client_sock, response, payload, frame.request_id)
+        except OSError as e:
+            print(f"Failed to send reply for {frame.cmd}: {e}")
+            break
+    client_sock.close()
+
+
+def handle_heartbeat(frame: protocol.Frame) -> Tuple[str, bytes]:
+    try:
+        node_id = int(frame.args)
+    except ValueError:
+        return 'ERROR: Invalid heartbeat', b''
+    # The payload carries the node's load and a full or incremental block
+    # report; 'OK:full_report' asks for a full listing next time.
+    response = 'OK'
+    if frame.payload:
+        try:
+            report = json.loads(frame.payload)
+            node_load[node_id] = report.get('load', {})
+            placement.report(node_id, node_load[node_id])
+            if 'blocks' in report and block_map.apply(node_id, report['blocks']):
+                response = 'OK:full_report'
+            # Chunks the node's scrubber found damaged, with the CRC each
+            # copy was written with.
+            for name, key, crc in report.get('blocks', {}).get('corrupt', []):
+                corrupt_copies.append((name, int(key), node_id, int(crc)))
+        except (ValueError, TypeError, AttributeError):
+            response = 'OK:full_report'
+    rejoined = not data_nodes_status.get(node_id, False)
+    data_nodes_status[node_id] = True
+    last_heartbeat[node_id] = time.time()
+    if rejoined:
+        replication.retry_deferred()
+    print(f"Node {node_id} is alive (heartbeat received)")
+    return response, b''
+
+
+def file_metadata(fname: str, entry) -> Dict:
+    # Erasure-coded chunks list one node per fragment (0 = lost).
+    entries = [(cid, entry.row(cid)) for cid in range(len(entry))]
+    return {
+        'filename': fname,
+        'chunks': len(entries),
+        'size': file_size(fname),
+        'chunk_size': entry.chunk_size,
+        'dedup': entry.dedup,
+        'ec': entry.ec,
+        'compression': entry.codec,
+        'replicas': [
+            {'chunk_id': cid, 'replica_nodes': replicas, 'replica_count': len(replicas)}
+            for cid, replicas in entries
+        ]
+    }
+
+
+def handle_request(frame: protocol.Frame) -> Tuple[str, bytes]:
+    # Commands that change a file hold its write lock for the whole
+    # operation (chunk I/O included, since replicas are overwritten in
+    # place); commands that read it share the lock. Other files are never
+    # blocked. locate and allocate stay lock-free: direct clients move
+    # chunk data outside the master anyway.
+    if frame.cmd == 'heartbeat':
+        return handle_heartbeat(frame)
+    if frame.cmd in NAMING and is_reserved_name(frame.name):
+        return 'ERROR: reserved name', b''
+    if frame.cmd in WRITE_LOCKED:
+        with file_locks.write(frame.name):
+            return execute_request(frame)
+    if frame.cmd in READ_LOCKED:
+        with file_locks.read(frame.name):
+            return execute_request(frame)
+    return execute_request(frame)
+
+
+def execute_request(frame: protocol.Frame) -> Tuple[str, bytes]:
+    cmd, fname = frame.cmd, frame.name
     response = ''
+    payload = b''
     if cmd == 'create':
-        content = args
-        chunks = [content[i:i+CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)]
-        metadata[fname] = []
+        content = frame.payload
+        chunk_size = chunk_size_for(fname, frame.args)
+        ec, ec_error = erasure_for(fname, frame.args)
+        compression, compression_error = compression_for(fname, frame.args)
         alive = get_alive_nodes()
-        if len(alive) == 0:
+        if chunk_size is None:
+            response = 'ERROR: Invalid chunk size'
+        elif ec_error or compression_error:
+            response = ec_error or compression_error
+        elif len(alive) == 0:
             response = 'ERROR: No alive data nodes'
         else:
-            for cid, chunk in enumerate(chunks):
-                replicas = write_chunk_to_replicas(fname, cid, chunk, desired_rf=2)
-                if not replicas:
-                    client_sock.send('ERROR: Write failed'.encode())
-                    client_sock.close()
-                    return
-                metadata[fname].append((cid, replicas))
-            save_metadata_to_disk()
-            response = f'SUCCESS: Created {fname} with {len(chunks)} chunks (RF={len(metadata[fname][0][1]) if metadata[fname] else 0})'
+            entries = create_file(fname, content, chunk_size, ec, compression)
+            if entries is None:
+                return 'ERROR: Write failed', b''
+            if ec is not None:
+                response = f'SUCCESS: Created {fname} with {len(entries)} chunks (EC {ec[0]}+{ec[1]})'
+            else:
+                response = f'SUCCESS: Created {fname} with {len(entries)} chunks (RF={len(entries[0][1]) if entries else 0})'
     elif cmd == 'read':
         if fname not in metadata:
             response = 'ERROR: File not found'
         else:
-            chunks_data = []
-            for cid, replicas in metadata[fname]:
-                chunk_found = False
-                for nid in replicas:
-                    if data_nodes_status.get(nid, False):
-                        chunk = get_from_node(nid, f'read:{fname}:{cid}')
-                        if chunk:
-                            chunks_data.append(chunk)
-                            chunk_found = True
-                            break
-                if not chunk_found:
-                    response += f'WARNING: Chunk {cid} unavailable (node failure)\n'
-            if chunks_data:
-                response = ''.join(chunks_data) + (response or '')
+            entries = metadata.chunks(fname)
+            chunks_data = read_chunks(fname, entries)
+            warnings = ''.join(f'WARNING: Chunk {cid} unavailable (node failure)\n'
+                               for (cid, _), chunk in zip(entries, chunks_data) if chunk is None)
+            payload = b''.join(chunk for chunk in chunks_data if chunk is not None)
+            response = warnings or 'OK'
+    elif cmd == 'read_range':
+        # args: {"offset": o, "length": n}; a missing length reads to the end.
+        # Only the chunks covering [o, o+n) are fetched, in parallel.
+        try:
+            request = json.loads(frame.args or '{}')
+            offset = int(request.get('offset', 0))
+            length = request.get('length')
+            length = None if length is None else int(length)
+        except (ValueError, TypeError, AttributeError):
+            offset, length = -1, None
+        if fname not in metadata:
+            response = 'ERROR: File not found'
+        elif offset < 0 or (length is not None and length < 0):
+            response = 'ERROR: Invalid range'
+        else:
+            size = file_size(fname)
+            if size is None:
+                response = f'ERROR: Chunk {metadata.chunk_count(fname) - 1} unavailable (node failure)'
+            else:
+                stop = size if length is None else min(size, offset + length)
+                response = 'OK'
+                if stop > offset:
+                    chunk_size = metadata.chunk_size(fname)
+                    first, last = offset // chunk_size, (stop - 1) // chunk_size
+                    entries = [(cid, metadata.replicas(fname, cid)) for cid in range(first, last + 1)]
+                    chunks_data = read_chunks(fname, entries)
+                    missing = [cid for (cid, _), chunk in zip(entries, chunks_data) if chunk is None]
+                    if missing:
+                        response = f'ERROR: Chunk {missing[0]} unavailable (node failure)'
+                    else:
+                        base = first * chunk_size
+                        payload = b''.join(chunks_data)[offset - base:stop - base]
     elif cmd == 'delete':
-        if fname in metadata:
-            for cid, replicas in metadata[fname]:
-                for nid in replicas:
-                    send_to_node(nid, f'delete:{fname}:{cid}')
-            del metadata[fname]
-            save_metadata_to_disk()
+        entry = metadata.entry(fname)
+        if entry is not None:
+            metadata.remove(fname)
+            if entry.dedup:
+                release_file(entry)
+            else:
+                delete_stale(fname, entry, list(range(len(entry))))
+            log_file(fname)
           
             for nid in list(data_nodes_status.keys()):
-                try:
-                    send_to_node(nid, f'delete_file:{fname}')
-                except Exception:
-                    pass
+                for name in {fname, stored_name(fname, entry)}:
+                    try:
+                        send_to_node(nid, 'delete_file', name)
+                    except Exception:
+                        pass
             response = 'SUCCESS: Deleted'
         else:
             
             for nid in list(data_nodes_status.keys()):
                 try:
-                    send_to_node(nid, f'delete_file:{fname}')
+                    send_to_node(nid, 'delete_file', fname)
                 except Exception:
                     pass
             response = 'SUCCESS: Deleted (metadata missing; purged replicas)'
     elif cmd == 'write':
         
-        new_content = args
-       
-        if fname in metadata:
-            for cid, replicas in metadata[fname]:
-                for nid in replicas:
-                    send_to_node(nid, f'delete:{fname}:{cid}')
-        
-        chunks = [new_content[i:i+CHUNK_SIZE] for i in range(0, len(new_content), CHUNK_SIZE)]
-        metadata[fname] = []
-        if len(get_alive_nodes()) == 0:
+        new_content = frame.payload
+        chunk_size = chunk_size_for(fname, frame.args)
+        ec, ec_error = erasure_for(fname, frame.args)
+        compression, compression_error = compression_for(fname, frame.args)
+        if chunk_size is None:
+            response = 'ERROR: Invalid chunk size'
+        elif ec_error or compression_error:
+            response = ec_error or compression_error
+        elif len(get_alive_nodes()) == 0:
             response = 'ERROR: No alive data nodes'
         else:
-            for cid, chunk in enumerate(chunks):
-                replicas = write_chunk_to_replicas(fname, cid, chunk, desired_rf=2)
-                if not replicas:
-                    client_sock.send('ERROR: Write failed'.encode())
-                    client_sock.close()
-                    return
-                metadata[fname].append((cid, replicas))
-            save_metadata_to_disk()
-            response = f'SUCCESS: Replaced file with {len(new_content)} bytes'
+            response = overwrite_file(fname, new_content, chunk_size, ec, compression)
     elif cmd == 'append':
         
-        new_data = args
+        new_data = frame.payload
         if fname not in metadata:
            
             content = new_data
-            chunks = [content[i:i+CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)]
-            metadata[fname] = []
-            available_nodes = [nid for nid, alive in data_nodes_status.items() if alive]
-            if len(get_alive_nodes()) == 0:
+            chunk_size = chunk_size_for(fname, frame.args)
+            ec, ec_error = erasure_for(fname, frame.args)
+            compression, compression_error = compression_for(fname, frame.args)
+            available_nodes = get_alive_nodes()
+            if chunk_size is None:
+                response = 'ERROR: Invalid chunk size'
+            elif ec_error or compression_error:
+                response = ec_error or compression_error
+            elif len(get_alive_nodes()) == 0:
                 response = 'ERROR: No alive data nodes'
             else:
-                for cid, chunk in enumerate(chunks):
-                    replicas = write_chunk_to_replicas(fname, cid, chunk, desired_rf=2)
-                    if not replicas:
-                        client_sock.send('ERROR: Write failed'.encode())
-                        client_sock.close()
-                        return
-                    metadata[fname].append((cid, replicas))
-                save_metadata_to_disk()
-                response = f'SUCCESS: Created {fname} with {len(chunks)} chunks'
+                entries = create_file(fname, content, chunk_size, ec, compression)
+                if entries is None:
+                    return 'ERROR: Write failed', b''
+                response = f'SUCCESS: Created {fname} with {len(entries)} chunks'
         else:
-            
-            current = []
-            for cid, replicas in metadata[fname]:
-                chunk_found = False
-                for nid in replicas:
-                    if data_nodes_status.get(nid, False):
-                        chunk = get_from_node(nid, f'read:{fname}:{cid}')
-                        if chunk:
-                            current.append(chunk)
-                            chunk_found = True
-                            break
-                if not chunk_found:
-                    current.append('')
-            current_data = ''.join(current)
-            new_content = current_data + new_data
-           
-            for cid, replicas in metadata[fname]:
-                for nid in replicas:
-                    send_to_node(nid, f'delete:{fname}:{cid}')
-            
-            chunks = [new_content[i:i+CHUNK_SIZE] for i in range(0, len(new_content), CHUNK_SIZE)]
-            metadata[fname] = []
             if len(get_alive_nodes()) == 0:
                 response = 'ERROR: No alive data nodes'
             else:
-                for cid, chunk in enumerate(chunks):
-                    replicas = write_chunk_to_replicas(fname, cid, chunk, desired_rf=2)
-                    if not replicas:
-                        client_sock.send('ERROR: Write failed'.encode())
-                        client_sock.close()
-                        return
-                    metadata[fname].append((cid, replicas))
-                save_metadata_to_disk()
-                response = f'SUCCESS: Appended {len(new_data)} bytes'
+                response = append_to_file(fname, new_data, desired_rf=2)
     elif cmd == 'list':
-        response = json.dumps(list(metadata.keys()))
+        # Without args: every name. With {"prefix", "after", "limit"}: one
+        # page of names in order, where to continue and the match count.
+        if not frame.args:
+            response = 'OK'
+            payload = json.dumps(metadata.names()).encode()
+        else:
+            try:
+                request = json.loads(frame.args)
+                prefix, after = str(request.get('prefix', '')), str(request.get('after', ''))
+                limit = int(request.get('limit', LIST_PAGE_SIZE))
+            except (ValueError, TypeError, AttributeError):
+                limit = -1
+            if not 0 <= limit <= LIST_PAGE_MAX:
+                response = 'ERROR: Invalid list request'
+            else:
+                names, next_after, total = metadata.page(prefix, after, limit)
+                response = 'OK'
+                payload = json.dumps({'files': names, 'next': next_after, 'total': total}).encode()
     elif cmd == 'metadata':
-        if fname not in metadata:
+        entry = metadata.entry(fname)
+        if entry is None:
+            response = 'ERROR: File not found'
+        else:
+            response = 'OK'
+            payload = json.dumps(file_metadata(fname, entry)).encode()
+    elif cmd == 'metadata_batch':
+        # args is a JSON list of names; the reply maps each to its metadata
+        # (null for a missing file). Each file is read under its own lock.
+        try:
+            names = [str(name) for name in json.loads(frame.args)]
+        except (ValueError, TypeError):
+            names = None
+        if names is None or len(names) > protocol.METADATA_BATCH_MAX:
+            response = 'ERROR: Invalid metadata batch'
+        else:
+            batch = {}
+            for name in names:
+                with file_locks.read(name):
+                    entry = metadata.entry(name)
+                    batch[name] = file_metadata(name, entry) if entry is not None else None
+            response = 'OK'
+            payload = json.dumps(batch).encode()
+    elif cmd == 'locate':
+        entry = metadata.entry(fname)
+        if entry is None:
             response = 'ERROR: File not found'
         else:
-            file_metadata = {
+            layout = {
                 'filename': fname,
-                'chunks': len(metadata[fname]),
-                'replicas': []
+                'chunk_size': entry.chunk_size,
+                'size': entry.size,
+                'chunks': [
+                    {
+                        'chunk_id': cid,
+                        'replicas': [node_address(nid) for nid in replicas if data_nodes_status.get(nid, False)],
+                        'crc': entry.crc(cid)
+                    }
+                    for cid, replicas in entry.chunks()
+                ]
             }
-            for cid, replicas in metadata[fname]:
-                file_metadata['replicas'].append({
-                    'chunk_id': cid,
-                    'replica_nodes': replicas,
-                    'replica_count': len(replicas)
-                })
-            response = json.dumps(file_metadata)
+            if entry.version:
+                # The name the chunks are stored under on the data nodes.
+                layout['name'] = stored_name(fname, entry)
+            if entry.dedup:
+                # Where each chunk is stored on the data nodes.
+                for chunk in layout['chunks']:
+                    chunk['key'] = chunk_key(fname, entry, chunk['chunk_id'])
+            if entry.codec:
+                # Every stored chunk starts with a codec header byte.
+                layout['compression'] = entry.codec
+            if entry.ec:
+                # One address (or None) per fragment position; fragment i of
+                # chunk c is stored as chunk c * (k + m) + i.
+                layout['ec'] = list(entry.ec)
+                for chunk in layout['chunks']:
+                    del chunk['crc']
+                    chunk['fragments'] = [node_address(nid) if nid and data_nodes_status.get(nid, False) else None
+                                          for nid in entry.row(chunk['chunk_id'])]
+                    chunk['fragment_crcs'] = entry.chunk_crcs(chunk['chunk_id'])
+            response = 'OK'
+            payload = json.dumps(layout).encode()
+    elif cmd == 'allocate':
+        # Streaming writers that do not know the total size up front
+        # allocate a batch at a time, numbering each batch from first_chunk
+        # and passing back the version the first batch was given. The chunks
+        # are written under that version's name, which no reader uses until
+        # the commit; each allocate keeps the version pending.
+        try:
+            request = json.loads(frame.args or '{}')
+            size = int(request.get('size', 0))
+            first = int(request.get('first_chunk', 0))
+            version = int(request.get('version') or 0)
+        except (ValueError, TypeError, AttributeError):
+            size = first = version = -1
+        chunk_size = chunk_size_for(fname, frame.args)
+        if size < 0 or first < 0 or version < 0 or chunk_size is None:
+            response = 'ERROR: Invalid allocation request'
+        elif size and len(get_alive_nodes()) == 0:
+            response = 'ERROR: No alive data nodes'
+        else:
+            version = allocate_version(fname, version)
+            if not version:
+                response = 'ERROR: Version not pending'
+            else:
+                count = -(-size // chunk_size)
+                placements = [
+                    {'chunk_id': cid,
+                     'replicas': [node_address(nid) for nid in choose_additional_nodes([], 2, chunk_size)]}
+                    for cid in range(first, first + count)
+                ]
+                response = 'OK'
+                payload = json.dumps({'filename': fname, 'chunk_size': chunk_size, 'version': version,
+                                      'name': versioned_name(fname, version), 'chunks': placements}).encode()
+    elif cmd == 'commit':
+        try:
+            request = json.loads(frame.args)
+            size = int(request['size'])
+            version = int(request['version'])
+            entries = [(int(c['chunk_id']), [int(n) for n in c['replicas']]) for c in request['chunks']]
+            # Every chunk carries the hash and CRC the client wrote it with;
+            # without them reads and the scrubber could not verify it.
+            hashes = decode_hashes([c['hash'] for c in request['chunks']])
+            crcs = {cid: [int(c['crc'])] for (cid, _), c in zip(entries, request['chunks'])}
+        except (ValueError, KeyError, TypeError):
+            entries = None
+        chunk_size = chunk_size_for(fname, frame.args)
+        old = metadata.entry(fname)
+        if entries is None or chunk_size is None or version <= 0 \
+                or [cid for cid, _ in entries] != list(range(-(-size // chunk_size))) \
+                or any(not replicas for _, replicas in entries) or None in hashes:
+            response = 'ERROR: Invalid commit request'
+        elif not finish_version(fname, version):
+            response = 'ERROR: Version not pending'
+        elif old is not None and version <= old.version:
+            # A write allocated before the file's current version was
+            # committed lost the race; committing it would bring back older
+            # contents (and, for the same version, delete the file's own
+            # chunks). Its chunks are left to the block audit.
+            response = 'ERROR: Stale version'
+        else:
+            # Direct clients write plain chunks under the version they were
+            # allocated, so a committed file is always replicated,
+            # uncompressed and never a dedup file. Readers switch to the new
+            # chunks here, and the previous version's chunks are deleted.
+            metadata.put(fname, entries, size, chunk_size, hashes, version=version)
+            metadata.set_crcs(fname, crcs)
+            if old is not None and old.dedup:
+                release_file(old)
+            else:
+                delete_stale(fname, old, list(range(len(old))) if old is not None else [])
+            log_file(fname)
+            response = f'SUCCESS: Committed {fname} with {len(entries)} chunks'
     elif cmd == 'system_info':
         known_ids = set(data_nodes_status.keys()) | set(last_heartbeat.keys())
         system_info = {
@@ -313,43 +1720,81 @@ def process_connection(client_sock):
                 str(nid): {
                     'status': 'alive' if data_nodes_status.get(nid, False) else 'dead',
                     'last_heartbeat': last_heartbeat.get(nid, 0),
-                    'port': 5000 + nid
+                    'port': 5000 + nid,
+                    'load': node_load.get(nid, {})
                 }
                 for nid in sorted(known_ids)
             },
             'total_files': len(metadata),
-            'alive_nodes': len(get_alive_nodes())
+            'alive_nodes': len(get_alive_nodes()),
+            'replication': replication.stats(),
+            'placement': placement.stats(),
+            'blocks': block_map.stats(),
+            'dedup': dict(content_index.stats(), enabled=DEDUP),
+            'compression': dict(codec_stats.stats(), default=COMPRESSION),
+            'integrity': dict(integrity_stats, pending=len(corrupt_copies))
         }
-        response = json.dumps(system_info)
-    client_sock.send(response.encode())
-    client_sock.close()
+        response = 'OK'
+        payload = json.dumps(system_info).encode()
+    elif cmd == 'pool_stats':
+        response = 'OK'
+        payload = json.dumps(node_pools.stats()).encode()
+    else:
+        response = f'ERROR: Unknown command {cmd}'
+    return response, payload
+
+
+def send_to_node(node_id: int, cmd: str, fname: str, args: str = '') -> bool:
+    reply = get_from_node(node_id, cmd, fname, args)
+    return reply is not None and reply.status.startswith('OK')
 
 
-def send_to_node(node_id: int, msg: str):
+def get_from_node(node_id: int, cmd: str, fname: str, args: str = '', payload=b'') -> Optional[protocol.Frame]:
+    return wait_for_node(node_id, submit_to_node(node_id, cmd, fname, args, payload))
+
+
+def submit_to_node(node_id: int, cmd: str, fname: str, args: str = '', payload=b'') -> Optional[Future]:
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        port = 5000 + node_id
-        sock.connect((data_nodes[0], port))
-        sock.send(msg.encode())
-        sock.close()
+        return node_pools.submit(node_id, cmd, fname, args, payload)
     except Exception as e:
         print(f"Failed to send to node {node_id}: {e}")
-        data_nodes_status[node_id] = False
+        check_node(node_id)
+        return None
 
 
-def get_from_node(node_id: int, msg: str) -> str:
+def wait_for_node(node_id: int, fut: Optional[Future],
+                  timeout: Optional[float] = None) -> Optional[protocol.Frame]:
+    if fut is None:
+        return None
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        port = 5000 + node_id
-        sock.connect((data_nodes[0], port))
-        sock.send(msg.encode())
-        data = sock.recv(4096).decode()
-        sock.close()
-        return data
+        return node_pools.get(node_id).result(fut, timeout)
     except Exception as e:
         print(f"Failed to get from node {node_id}: {e}")
-        data_nodes_status[node_id] = False
-        return ''
+        check_node(node_id)
+        return None
+
+
+def check_node(node_id: int) -> None:
+    # A failed request alone does not make a node dead (it may have been
+    # one slow request): the node is marked dead if it fails a ping too.
+    # The ping runs in the background, one per node at a time; the caller
+    # moves on to another replica meanwhile.
+    with checking_lock:
+        if not data_nodes_status.get(node_id, False) or node_id in checking_nodes:
+            return
+        checking_nodes.add(node_id)
+    threading.Thread(target=ping_node, args=(node_id,), daemon=True).start()
+
+
+def ping_node(node_id: int) -> None:
+    try:
+        if node_pools.request(node_id, 'ping', timeout=NODE_PING_TIMEOUT).status != 'OK':
+            mark_node_dead(node_id)
+    except Exception:
+        mark_node_dead(node_id)
+    finally:
+        with checking_lock:
+            checking_nodes.discard(node_id)
 
 
 def monitor_heartbeats():
@@ -360,34 +1805,114 @@ def monitor_heartbeats():
             if node_id not in last_heartbeat or (current_time - last_heartbeat[node_id] > HEARTBEAT_TIMEOUT):
                 if data_nodes_status.get(node_id, False):
                     data_nodes_status[node_id] = False
-                    print(f"Node {node_id} failed (heartbeat timeout). Re-replicate affected chunks.")
-                    ensure_replication_all(desired_rf=2)
+                    queued = queue_under_replicated(node_id)
+                    print(f"Node {node_id} failed (heartbeat timeout). Queued {queued} chunks for re-replication.")
 
 
-def periodic_healer():
+def periodic_healer(sweep_interval: float):
+    # Chunks join the replication queue as they go short: when their node
+    # dies, when a replica is dropped and when a write or repair leaves
+    # them short. The full metadata walk is only a consistency sweep, run
+    # once nodes have had time to report after startup and then every
+    # sweep_interval seconds (0 disables it).
+    next_sweep = time.time() + HEARTBEAT_TIMEOUT
     while True:
-        time.sleep(10)
-        ensure_replication_all(desired_rf=2)
+        time.sleep(HEAL_INTERVAL)
+        handle_corrupt_copies()
+        while dead_nodes:
+            node_id = dead_nodes.pop()
+            if not data_nodes_status.get(node_id, False):
+                queued = queue_under_replicated(node_id)
+                print(f"Node {node_id} unreachable. Queued {queued} chunks for re-replication.")
+        if sweep_interval > 0 and time.time() >= next_sweep:
+            next_sweep = time.time() + sweep_interval
+            queued = queue_under_replicated()
+            if queued:
+                print(f"Consistency sweep queued {queued} under-replicated chunks")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Mini DFS master node')
+    parser.add_argument('--server', choices=['threaded', 'async'], default=SERVER_MODE,
+                        help='threaded: one thread per connection; async: asyncio event loop with a bounded worker pool')
+    parser.add_argument('--workers', type=int, default=MASTER_WORKERS,
+                        help='worker threads for blocking requests in async mode')
+    parser.add_argument('--chunk-size', type=parse_size, default=CHUNK_SIZE,
+                        help='default chunk size for new files, e.g. 4M or 64M (per-file overrides allowed)')
+    parser.add_argument('--write-window', type=int, default=WRITE_WINDOW,
+                        help='max chunks with replica writes in flight per file write')
+    parser.add_argument('--read-window', type=int, default=READ_WINDOW,
+                        help='max chunks fetched concurrently per file read')
+    parser.add_argument('--hedge-percentile', type=float, default=HEDGE_PERCENTILE,
+                        help='latency percentile after which a read is hedged to a second replica (0 disables)')
+    parser.add_argument('--repl-workers', type=int, default=REPLICATION_WORKERS,
+                        help='max concurrent re-replication copies')
+    parser.add_argument('--heal-sweep-interval', type=float, default=HEAL_SWEEP_INTERVAL,
+                        help='seconds between full metadata sweeps for under-replicated chunks (0 disables)')
+    parser.add_argument('--repl-bandwidth', type=parse_size, default=REPLICATION_BANDWIDTH,
+                        help='re-replication bandwidth budget in bytes per second, e.g. 64M (0 = unlimited)')
+    parser.add_argument('--placement', choices=POLICIES, default=PLACEMENT_POLICY,
+                        help='replica placement: least-loaded or two-choices (power of two random choices)')
+    parser.add_argument('--rebalance-interval', type=float, default=REBALANCE_INTERVAL,
+                        help='seconds between background rebalancing rounds (0 disables)')
+    parser.add_argument('--rebalance-threshold', type=float, default=REBALANCE_THRESHOLD,
+                        help='fill ratio gap between the fullest and emptiest node that triggers rebalancing')
+    parser.add_argument('--dedup', action='store_true', default=DEDUP,
+                        help='store chunks of new files by content hash so identical chunks are kept once')
+    parser.add_argument('--compression', choices=['none'] + list(CODECS), default='none',
+                        help='codec for chunks of new files; chunks that do not compress are stored as is')
+    parser.add_argument('--snapshot-every', type=int, default=SNAPSHOT_EVERY,
+                        help='metadata log records between metadata.json snapshots')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    if not MIN_CHUNK_SIZE <= args.chunk_size <= MAX_CHUNK_SIZE:
+        sys.exit(f"--chunk-size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes")
+    CHUNK_SIZE = args.chunk_size
+    WRITE_WINDOW = args.write_window
+    READ_WINDOW = args.read_window
+    HEDGE_PERCENTILE = args.hedge_percentile
+    metadata_log.snapshot_every = args.snapshot_every
+    replication.workers = max(1, args.repl_workers)
+    replication.throttle.rate = args.repl_bandwidth
+    placement.policy = args.placement
+    REBALANCE_THRESHOLD = args.rebalance_threshold
+    DEDUP = args.dedup
+    COMPRESSION = parse_codec(args.compression)
     load_metadata_from_disk()
+    metadata_log.open()
     master_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     master_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     master_sock.bind(('localhost', 5000))
-    master_sock.listen(5)
-    print("Master started on port 5000")
-
-    connection_thread = threading.Thread(target=handle_connections, args=(master_sock,), daemon=True)
+    master_sock.listen(LISTEN_BACKLOG)
+    if args.server == 'async':
+        print(f"Master started on port 5000 (async, {args.workers} workers)")
+        connection_thread = threading.Thread(target=handle_connections_async,
+                                             args=(master_sock, max(1, args.workers)), daemon=True)
+    else:
+        print("Master started on port 5000")
+        connection_thread = threading.Thread(target=handle_connections, args=(master_sock,), daemon=True)
     heartbeat_thread = threading.Thread(target=monitor_heartbeats, daemon=True)
-    healer_thread = threading.Thread(target=periodic_healer, daemon=True)
+    healer_thread = threading.Thread(target=periodic_healer, args=(args.heal_sweep_interval,), daemon=True)
+    pool_thread = threading.Thread(target=node_pools.run_maintenance, daemon=True)
+    snapshot_thread = threading.Thread(target=metadata_log.run_checkpoints,
+                                       args=(dump_metadata, SNAPSHOT_INTERVAL), daemon=True)
     connection_thread.start()
     heartbeat_thread.start()
     healer_thread.start()
+    pool_thread.start()
+    snapshot_thread.start()
+    replication.start()
+    threading.Thread(target=run_block_audit, args=(BLOCK_AUDIT_INTERVAL,), daemon=True).start()
+    if args.rebalance_interval > 0:
+        threading.Thread(target=run_rebalancer, args=(args.rebalance_interval,), daemon=True).start()
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("Master shutting down gracefully...")
         master_sock.close()
+        save_metadata_to_disk()
         sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+# Short-lived cache of master metadata for the REST API server. Dashboards
+# poll the same listings, system info and per-file metadata over and over;
+# for `ttl` seconds those are answered from here instead of costing a master
+# round trip each. A write made through the API server invalidates the
+# file's metadata and every listing at once, so its own clients read their
+# writes; changes made by other clients show up within `ttl`.
+#
+# Every invalidation bumps a generation, and a reply fetched while one
+# happened is handed back but not stored, so a slow lookup can never put
+# back what a write just dropped. Concurrent misses on one listing share a
+# single master call.
+
+
+class MetadataCache:
+    def __init__(self, ttl: float = 2.0, max_files: int = 100000):
+        self.ttl = ttl
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.generation = 0
+        # fname -> (expiry, metadata), oldest first
+        self.files: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        # Listings and system info: key -> (expiry, value)
+        self.views: Dict[Hashable, Tuple[float, Any]] = {}
+        self.loading: Dict[Hashable, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def view(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        # The cached value for `key`, or load()'s result. Exceptions from
+        # load() propagate and are never cached.
+        if self.ttl <= 0:
+            return load()
+        while True:
+            with self.lock:
+                cached = self.views.get(key)
+                if cached is not None and cached[0] > time.monotonic():
+                    self.hits += 1
+                    return cached[1]
+                pending = self.loading.get(key)
+                if pending is None:
+                    self.misses += 1
+                    done = self.loading[key] = threading.Event()
+                    generation = self.generation
+                    break
+            pending.wait()
+            # The loader stored its value, or failed: look again (and load
+            # it ourselves in the second case).
+        try:
+            value = load()
+            with self.lock:
+                if generation == self.generation:
+                    self.views[key] = (time.monotonic() + self.ttl, value)
+            return value
+        finally:
+            with self.lock:
+                del self.loading[key]
+            done.set()
+
+    def lookup_files(self, names: List[str]) -> Tuple[Dict[str, Any], List[str], int]:
+        # The fresh cached metadata among `names`, the names still to fetch
+        # and the generation to hand back to store_files.
+        found: Dict[str, Any] = {}
+        missing: List[str] = []
+        now = time.monotonic()
+        with self.lock:
+            for name in names:
+                cached = self.files.get(name) if self.ttl > 0 else None
+                if cached is not None and cached[0] > now:
+                    found[name] = cached[1]
+                else:
+                    missing.append(name)
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing, self.generation
+
+    def store_files(self, metadata: Dict[str, Any], generation: int) -> None:
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            expiry = time.monotonic() + self.ttl
+            for name, value in metadata.items():
+                self.files.pop(name, None)
+                self.files[name] = (expiry, value)
+            while len(self.files) > self.max_files:
+                self.files.popitem(last=False)
+
+    def invalidate(self, fname: str) -> None:
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.files.pop(fname, None)
+            self.views.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'files': len(self.files),
+                'views': len(self.views),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
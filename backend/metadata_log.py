@@ -0,0 +1,179 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Durable master metadata: an append-only operation log plus periodic
+# snapshots. Every mutation appends one JSON line and waits until it is
+# fsynced; concurrent writers share fsyncs (group commit). A checkpoint
+# rotates the log, writes a snapshot atomically and drops the rotated
+# segments, so startup only replays operations logged since the snapshot.
+#
+# Records must be idempotent (they carry resulting state, not deltas):
+# replaying a record that the snapshot already reflects is harmless. That
+# is what lets the snapshot be dumped without the log lock: only the
+# rotation is locked, and the dump that follows may already include
+# changes logged after it, which startup replays over it again.
+
+SNAPSHOT_VERSION = 2
+
+
+class MetadataLog:
+    def __init__(self, snapshot_path: str, log_path: str, snapshot_every: int = 10000):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.snapshot_every = snapshot_every
+        self.cond = threading.Condition()
+        # Checkpoints run one at a time, so snapshots are written in order.
+        self.checkpoint_lock = threading.Lock()
+        self.file = None
+        self.seq = 0
+        self.durable_seq = 0
+        self.flushing = False
+        self.since_snapshot = 0
+        self.checkpoint_due = threading.Event()
+        self.stats = {'records': 0, 'fsyncs': 0, 'snapshots': 0}
+
+    def load(self, restore: Callable[[Dict, int], None], apply: Callable[[Dict], None]) -> int:
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                raw = json.load(f)
+            if isinstance(raw, dict) and raw.get('version') == SNAPSHOT_VERSION:
+                snapshot_seq = int(raw.get('seq', 0))
+                restore(raw.get('files', {}), SNAPSHOT_VERSION)
+            else:
+                restore(raw, 1)
+        self.seq = snapshot_seq
+        replayed = 0
+        for path in self._segments() + [self.log_path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append.
+                        break
+                    seq = int(record.get('seq', 0))
+                    if seq <= snapshot_seq:
+                        continue
+                    apply(record)
+                    self.seq = max(self.seq, seq)
+                    replayed += 1
+        self.durable_seq = self.seq
+        self.since_snapshot = replayed
+        return replayed
+
+    def open(self) -> None:
+        self.file = open(self.log_path, 'a')
+
+    def _segments(self) -> List[str]:
+        paths = glob.glob(glob.escape(self.log_path) + '.*')
+        segments = [p for p in paths if p.rsplit('.', 1)[1].isdigit()]
+        return sorted(segments, key=lambda p: int(p.rsplit('.', 1)[1]))
+
+    def append(self, build: Callable[[], Optional[Dict]]) -> int:
+        # `build` runs under the log lock so the logged state is the latest
+        # one when several threads log the same file.
+        with self.cond:
+            record = build()
+            if record is None:
+                return self.seq
+            self.seq += 1
+            seq = self.seq
+            record['seq'] = seq
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self.stats['records'] += 1
+            self.since_snapshot += 1
+            if self.since_snapshot >= self.snapshot_every:
+                self.checkpoint_due.set()
+            while self.durable_seq < seq:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+                self._flush_locked()
+        return seq
+
+    def _flush_locked(self) -> None:
+        # Called with the lock held. The fsync itself runs unlocked so other
+        # writers can queue their records behind it and share the next one.
+        self.flushing = True
+        target = self.seq
+        try:
+            self.file.flush()
+            fd = self.file.fileno()
+            self.cond.release()
+            try:
+                os.fsync(fd)
+            finally:
+                self.cond.acquire()
+            self.durable_seq = max(self.durable_seq, target)
+            self.stats['fsyncs'] += 1
+        finally:
+            self.flushing = False
+            self.cond.notify_all()
+
+    def checkpoint(self, dump: Callable[[], Dict]) -> None:
+        # Every change logged up to `seq` was made before the rotation, so a
+        # dump taken after it reflects them all.
+        with self.checkpoint_lock:
+            with self.cond:
+                while self.flushing:
+                    self.cond.wait()
+                seq = self.seq
+                if self.file is not None:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    self.durable_seq = seq
+                    self.cond.notify_all()
+                    self.file.close()
+                    if os.path.getsize(self.log_path):
+                        os.replace(self.log_path, f'{self.log_path}.{seq}')
+                    self.file = open(self.log_path, 'a')
+                self.since_snapshot = 0
+                self.checkpoint_due.clear()
+            self._write_snapshot({'version': SNAPSHOT_VERSION, 'seq': seq, 'files': dump()})
+            for path in self._segments():
+                if int(path.rsplit('.', 1)[1]) <= seq:
+                    os.remove(path)
+            with self.cond:
+                self.stats['snapshots'] += 1
+
+    def _write_snapshot(self, snapshot: Dict) -> None:
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.snapshot_path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+    def run_checkpoints(self, dump: Callable[[], Dict], interval: float = 300.0) -> None:
+        while True:
+            self.checkpoint_due.wait(timeout=interval)
+            if self.since_snapshot == 0:
+                continue
+            try:
+                start = time.time()
+                self.checkpoint(dump)
+                print(f"Metadata snapshot written in {time.time() - start:.2f}s")
+            except Exception as e:
+                print(f"Metadata snapshot failed: {e}")
+                time.sleep(1)
+
+    def close(self) -> None:
+        with self.cond:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
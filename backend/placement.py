@@ -0,0 +1,107 @@
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Replica placement for the master. Data nodes report their used bytes,
+# chunk count, capacity and in-flight requests with every heartbeat; bytes
+# placed on a node since its last report are charged locally so a burst of
+# allocations between heartbeats still spreads out. A node's load is its
+# fill ratio plus a small penalty per in-flight request, and nodes past
+# FULL_RATIO only get replicas when nothing else is left.
+#
+# 'least-loaded' always picks the lowest loads; 'two-choices' samples two
+# candidates per replica and keeps the lighter one, which avoids herding
+# onto one node when reports are stale.
+
+FULL_RATIO = 0.95
+IN_FLIGHT_WEIGHT = 0.01
+POLICIES = ('least-loaded', 'two-choices')
+
+
+class NodeLoad:
+    __slots__ = ('used_bytes', 'chunks', 'capacity', 'in_flight', 'pending')
+
+    def __init__(self):
+        self.used_bytes = 0
+        self.chunks = 0
+        self.capacity = 0
+        self.in_flight = 0
+        self.pending = 0
+
+    def fill(self) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        return (self.used_bytes + self.pending) / self.capacity
+
+    def score(self) -> float:
+        return self.fill() + IN_FLIGHT_WEIGHT * self.in_flight
+
+
+class PlacementPolicy:
+    def __init__(self, policy: str = 'least-loaded'):
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.nodes: Dict[int, NodeLoad] = {}
+
+    def _load(self, nid: int) -> NodeLoad:
+        load = self.nodes.get(nid)
+        if load is None:
+            load = self.nodes[nid] = NodeLoad()
+        return load
+
+    def report(self, nid: int, stats: Dict) -> None:
+        with self.lock:
+            load = self._load(nid)
+            load.used_bytes = int(stats.get('used_bytes', load.used_bytes))
+            load.chunks = int(stats.get('chunks', load.chunks))
+            load.capacity = int(stats.get('capacity_bytes', load.capacity))
+            load.in_flight = int(stats.get('in_flight', load.in_flight))
+            load.pending = 0
+
+    def record(self, nid: int, nbytes: int) -> None:
+        with self.lock:
+            self._load(nid).pending += nbytes
+
+    def choose(self, candidates: List[int], needed: int, nbytes: int = 0) -> List[int]:
+        with self.lock:
+            scores = {nid: self._load(nid).score() for nid in candidates}
+            roomy = [nid for nid in candidates if self.nodes[nid].fill() < FULL_RATIO]
+            pool = roomy if len(roomy) >= needed else list(candidates)
+            chosen: List[int] = []
+            while pool and len(chosen) < needed:
+                if self.policy == 'two-choices' and len(pool) > 2:
+                    pick = min(random.sample(pool, 2), key=lambda nid: scores[nid])
+                else:
+                    pick = min(pool, key=lambda nid: (scores[nid], nid))
+                pool.remove(pick)
+                chosen.append(pick)
+            for nid in chosen:
+                self.nodes[nid].pending += nbytes
+            return chosen
+
+    def imbalance(self, candidates: List[int], threshold: float) -> Optional[Tuple[int, int, int]]:
+        # The fullest and emptiest nodes and the bytes to move between them
+        # to even them out, if their fill ratios are more than `threshold`
+        # apart or only the fuller one is past FULL_RATIO.
+        with self.lock:
+            loads = [(self._load(nid).fill(), nid) for nid in candidates if self._load(nid).capacity > 0]
+            if len(loads) < 2:
+                return None
+            (low, cold), (high, hot) = min(loads), max(loads)
+            if high - low <= threshold and not low < FULL_RATIO <= high:
+                return None
+            capacity = min(self.nodes[hot].capacity, self.nodes[cold].capacity)
+            return hot, cold, int((high - low) / 2 * capacity)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                str(nid): {
+                    'used_bytes': load.used_bytes + load.pending,
+                    'chunks': load.chunks,
+                    'capacity_bytes': load.capacity,
+                    'in_flight': load.in_flight,
+                    'fill': round(load.fill(), 4),
+                }
+                for nid, load in sorted(self.nodes.items())
+            }
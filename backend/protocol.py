@@ -0,0 +1,232 @@
+import asyncio
+import mmap
+import socket
+import struct
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Frame layout (network byte order):
+#   magic(2) version(1) opcode(1) flags(1) request_id(4)
+#   name_len(2) args_len(4) payload_len(8) checksum(4)
+# followed by name (utf-8), args (utf-8) and the raw payload bytes.
+# The checksum is a CRC32 over name + args + payload.
+MAGIC = b'DF'
+VERSION = 1
+HEADER = struct.Struct('!2sBBBIHIQI')
+HEADER_SIZE = HEADER.size
+MAX_ARGS_LEN = 64 * 1024 * 1024
+MAX_PAYLOAD_LEN = 1 << 32
+RECV_PREALLOC = 16 * 1024 * 1024
+# Most files a single metadata_batch request may name.
+METADATA_BATCH_MAX = 1000
+
+OPCODES: Dict[str, int] = {
+    'reply': 0,
+    'heartbeat': 1,
+    'create': 2,
+    'read': 3,
+    'write': 4,
+    'append': 5,
+    'delete': 6,
+    'delete_file': 7,
+    'list': 8,
+    'metadata': 9,
+    'system_info': 10,
+    'ping': 11,
+    'pool_stats': 12,
+    'locate': 13,
+    'allocate': 14,
+    'commit': 15,
+    'cache_stats': 16,
+    'read_range': 17,
+    'replicate': 18,
+    'metadata_batch': 19,
+}
+COMMANDS: Dict[int, str] = {code: name for name, code in OPCODES.items()}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Frame(NamedTuple):
+    cmd: str
+    name: str = ''
+    args: str = ''
+    payload: bytes = b''
+    request_id: int = 0
+    flags: int = 0
+
+    @property
+    def status(self) -> str:
+        return self.args
+
+    @property
+    def ok(self) -> bool:
+        return self.cmd == 'reply' and not self.args.startswith('ERROR')
+
+
+def checksum(name: bytes, args: bytes, payload) -> int:
+    return zlib.crc32(payload, zlib.crc32(args, zlib.crc32(name))) & 0xFFFFFFFF
+
+
+def encode_header(cmd: str, name: bytes, args: bytes, payload_len: int, crc: int,
+                  request_id: int = 0, flags: int = 0) -> bytes:
+    if cmd not in OPCODES:
+        raise ProtocolError(f'Unknown command: {cmd}')
+    if len(name) > 0xFFFF:
+        raise ProtocolError('Name too long')
+    if len(args) > MAX_ARGS_LEN or payload_len > MAX_PAYLOAD_LEN:
+        raise ProtocolError('Frame too large')
+    return HEADER.pack(MAGIC, VERSION, OPCODES[cmd], flags, request_id,
+                       len(name), len(args), payload_len, crc)
+
+
+def _sendall_parts(sock: socket.socket, parts: List) -> None:
+    views = [memoryview(p).cast('B') for p in parts if len(p)]
+    if not hasattr(sock, 'sendmsg'):
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+
+def frame_parts(cmd: str, name: str = '', args: str = '', payload=b'',
+                request_id: int = 0, flags: int = 0) -> List:
+    name_b = name.encode()
+    args_b = args.encode()
+    header = encode_header(cmd, name_b, args_b, len(payload),
+                           checksum(name_b, args_b, payload), request_id, flags)
+    return [header, name_b, args_b, payload]
+
+
+def send_frame(sock: socket.socket, cmd: str, name: str = '', args: str = '',
+               payload=b'', request_id: int = 0, flags: int = 0) -> None:
+    _sendall_parts(sock, frame_parts(cmd, name, args, payload, request_id, flags))
+
+
+def send_reply(sock: socket.socket, status: str, payload=b'', request_id: int = 0) -> None:
+    send_frame(sock, 'reply', args=status, payload=payload, request_id=request_id)
+
+
+def range_checksum(crc: int, f, offset: int, length: int) -> int:
+    if not length:
+        return crc
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view, view[offset:offset + length] as part:
+            if len(part) < length:
+                raise ProtocolError('File range past end of file')
+            return zlib.crc32(part, crc)
+
+
+def file_frame_head(cmd: str, ranges: List[Tuple], name: str = '', args: str = '',
+                    request_id: int = 0, flags: int = 0) -> List[bytes]:
+    # Header, name and args for a frame whose payload is the concatenation
+    # of (file, offset, length) ranges. The checksum is taken over mmaps of
+    # the ranges, so the payload is never copied into Python buffers.
+    name_b = name.encode()
+    args_b = args.encode()
+    crc = checksum(name_b, args_b, b'')
+    for f, offset, length in ranges:
+        crc = range_checksum(crc, f, offset, length)
+    total = sum(length for _, _, length in ranges)
+    return [encode_header(cmd, name_b, args_b, total, crc & 0xFFFFFFFF, request_id, flags), name_b, args_b]
+
+
+def send_file_frame(sock: socket.socket, head: List[bytes], ranges: List[Tuple]) -> None:
+    # The payload goes out with sendfile. A range that shrank after the head
+    # was built leaves the stream corrupt, so the caller must drop the
+    # connection on ProtocolError.
+    _sendall_parts(sock, head)
+    for f, offset, length in ranges:
+        if length and sock.sendfile(f, offset, length) != length:
+            raise ProtocolError('File range shrank while sending')
+
+
+def recv_exact(sock: socket.socket, n: int) -> bytearray:
+    # Only RECV_PREALLOC bytes are allocated up front; past that the buffer
+    # doubles as the bytes actually arrive, so a header claiming a huge
+    # payload costs the receiver nothing until the peer sends it.
+    buf = bytearray(min(n, RECV_PREALLOC))
+    received = 0
+    while received < n:
+        if received == len(buf):
+            buf.extend(bytes(min(n - received, len(buf))))
+        got = sock.recv_into(memoryview(buf)[received:], len(buf) - received)
+        if got == 0:
+            raise ProtocolError(f'Connection closed after {received} of {n} bytes')
+        received += got
+    return buf
+
+
+def decode_header(header) -> Tuple[int, int, int, int, int, int, int]:
+    magic, version, opcode, flags, request_id, name_len, args_len, payload_len, crc = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError('Bad frame header')
+    if opcode not in COMMANDS:
+        raise ProtocolError(f'Unknown opcode: {opcode}')
+    if args_len > MAX_ARGS_LEN or payload_len > MAX_PAYLOAD_LEN:
+        raise ProtocolError('Frame too large')
+    return opcode, flags, request_id, name_len, args_len, payload_len, crc
+
+
+def make_frame(opcode: int, flags: int, request_id: int, name_b: bytes, args_b: bytes,
+               payload, crc: int) -> Frame:
+    if checksum(name_b, args_b, payload) != crc:
+        raise ProtocolError('Checksum mismatch')
+    return Frame(COMMANDS[opcode], name_b.decode(), args_b.decode(), payload, request_id, flags)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Frame]:
+    header = sock.recv(HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        header += recv_exact(sock, HEADER_SIZE - len(header))
+    opcode, flags, request_id, name_len, args_len, payload_len, crc = decode_header(header)
+    name_b = bytes(recv_exact(sock, name_len)) if name_len else b''
+    args_b = bytes(recv_exact(sock, args_len)) if args_len else b''
+    payload = recv_exact(sock, payload_len) if payload_len else b''
+    return make_frame(opcode, flags, request_id, name_b, args_b, payload, crc)
+
+
+async def read_frame_async(reader: asyncio.StreamReader) -> Optional[Frame]:
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError(f'Connection closed after {len(e.partial)} of {HEADER_SIZE} bytes')
+    opcode, flags, request_id, name_len, args_len, payload_len, crc = decode_header(header)
+    try:
+        name_b = await reader.readexactly(name_len) if name_len else b''
+        args_b = await reader.readexactly(args_len) if args_len else b''
+        payload = await reader.readexactly(payload_len) if payload_len else b''
+    except asyncio.IncompleteReadError as e:
+        raise ProtocolError(f'Connection closed mid-frame ({len(e.partial)} bytes of a field)')
+    return make_frame(opcode, flags, request_id, name_b, args_b, payload, crc)
+
+
+async def write_reply_async(writer: asyncio.StreamWriter, status: str, payload=b'',
+                            request_id: int = 0) -> None:
+    writer.writelines(frame_parts('reply', args=status, payload=payload, request_id=request_id))
+    await writer.drain()
+
+
+def call(host: str, port: int, cmd: str, name: str = '', args: str = '',
+         payload=b'', timeout: Optional[float] = None) -> Frame:
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        send_frame(sock, cmd, name, args, payload)
+        reply = recv_frame(sock)
+        if reply is None:
+            raise ProtocolError('Connection closed without reply')
+        return reply
+    finally:
+        sock.close()
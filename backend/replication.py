@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Re-replication scheduler for the master. Chunks that lost replicas are
+# queued once per (file, chunk id) and handed to a fixed pool of workers
+# fewest-live-replicas first, so a chunk down to its last copy heals before
+# one that still has two. The repair callback does the copy and returns the
+# bytes it moved, 0 if nothing was needed, or None if the chunk cannot be
+# healed right now (no live source or no spare node); those are parked
+# until a node (re)joins. The worker count bounds concurrent copies and a
+# byte-rate throttle bounds their bandwidth, so healing a dead node cannot
+# starve client I/O.
+
+Key = Tuple[str, int]
+
+
+class Throttle:
+    # Reserves transfer time on a single timeline: a copy of n bytes pushes
+    # the next start n / rate seconds out. rate <= 0 means unlimited.
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def acquire(self, nbytes: int) -> None:
+        if self.rate <= 0 or nbytes <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_free)
+            self.next_free = start + nbytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class ReplicationScheduler:
+    def __init__(self, repair: Callable[[str, int], Optional[int]],
+                 workers: int = 4, bandwidth: float = 0):
+        self.repair = repair
+        self.workers = max(1, workers)
+        self.throttle = Throttle(bandwidth)
+        self.cond = threading.Condition()
+        self.heap: List[Tuple[int, int, Key]] = []
+        self.queued: Dict[Key, int] = {}
+        self.in_flight: Set[Key] = set()
+        self.deferred: Set[Key] = set()
+        self.seq = itertools.count()
+        self.copies = 0
+        self.bytes_copied = 0
+        self.failures = 0
+
+    def enqueue(self, fname: str, cid: int, live: int) -> None:
+        # A chunk already queued only moves up if it lost more replicas;
+        # the superseded heap entry is skipped when popped.
+        key = (fname, cid)
+        with self.cond:
+            if key in self.in_flight or self.queued.get(key, live + 1) <= live:
+                return
+            self.deferred.discard(key)
+            self.queued[key] = live
+            heapq.heappush(self.heap, (live, next(self.seq), key))
+            self.cond.notify()
+
+    def retry_deferred(self) -> None:
+        with self.cond:
+            deferred, self.deferred = self.deferred, set()
+            for key in deferred:
+                if key not in self.queued and key not in self.in_flight:
+                    self.queued[key] = 0
+                    heapq.heappush(self.heap, (0, next(self.seq), key))
+            self.cond.notify_all()
+
+    def next_task(self) -> Key:
+        with self.cond:
+            while True:
+                while not self.heap:
+                    self.cond.wait()
+                live, _, key = heapq.heappop(self.heap)
+                if self.queued.get(key) == live:
+                    del self.queued[key]
+                    self.in_flight.add(key)
+                    return key
+
+    def run(self) -> None:
+        while True:
+            key = self.next_task()
+            try:
+                copied = self.repair(*key)
+            except Exception as e:
+                print(f"Re-replication of {key[0]} chunk {key[1]} failed: {e}")
+                copied = None
+            with self.cond:
+                self.in_flight.discard(key)
+                if copied is None:
+                    self.deferred.add(key)
+                    self.failures += 1
+                elif copied:
+                    self.copies += 1
+                    self.bytes_copied += copied
+            if copied:
+                self.throttle.acquire(copied)
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def stats(self) -> Dict[str, float]:
+        with self.cond:
+            return {
+                'queued': len(self.queued),
+                'in_flight': len(self.in_flight),
+                'deferred': len(self.deferred),
+                'copies': self.copies,
+                'bytes_copied': self.bytes_copied,
+                'failures': self.failures,
+                'workers': self.workers,
+                'bandwidth_bytes_per_sec': self.throttle.rate,
+            }
@@ -0,0 +1,75 @@
+import importlib
+import os
+import tempfile
+import unittest
+
+from chunk_cache import ChunkCache
+
+# Run with `python -m pytest` (or `python -m unittest`) from backend/.
+
+
+class ChunkCacheTest(unittest.TestCase):
+    def test_fill_after_load(self):
+        cache = ChunkCache(1024)
+        ticket = cache.begin_load(('f', 0))
+        cache.fill(('f', 0), b'abc', ticket)
+        self.assertEqual(cache.get(('f', 0)), b'abc')
+        self.assertEqual(cache.loads, {})
+
+    def test_write_during_load_wins(self):
+        cache = ChunkCache(1024)
+        ticket = cache.begin_load(('f', 0))
+        cache.put(('f', 0), b'new')
+        cache.fill(('f', 0), b'old', ticket)
+        self.assertEqual(cache.get(('f', 0)), b'new')
+
+    def test_end_load_keeps_newer_ticket(self):
+        cache = ChunkCache(1024)
+        first = cache.begin_load(('f', 0))
+        second = cache.begin_load(('f', 0))
+        cache.end_load(('f', 0), first)
+        cache.fill(('f', 0), b'abc', second)
+        self.assertEqual(cache.get(('f', 0)), b'abc')
+        self.assertEqual(cache.loads, {})
+
+
+class LoadChunkTest(unittest.TestCase):
+    # The data node is configured as node 1 inside a scratch directory.
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls.tmp.name)
+        cls.node = importlib.import_module('data_node')
+        cls.node.configure(['1'])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        cls.tmp.cleanup()
+
+    def test_missing_chunk_releases_ticket(self):
+        self.assertIsNone(self.node.load_chunk('missing', 0))
+        self.assertEqual(self.node.cache.loads, {})
+
+    def test_zero_copy_read_releases_ticket(self):
+        data = os.urandom(self.node.ZERO_COPY_MIN)
+        self.node.store.write('big', 0, data)
+        ranges = self.node.load_chunk('big', 0)
+        try:
+            self.assertIsInstance(ranges, list)
+            self.assertEqual(self.node.read_ranges(ranges), data)
+        finally:
+            self.node.close_ranges(ranges)
+        self.assertEqual(self.node.cache.loads, {})
+        self.assertIsNone(self.node.cache.get(('big', 0)))
+
+    def test_small_chunk_is_cached(self):
+        self.node.store.write('small', 0, b'hello')
+        self.assertEqual(self.node.load_chunk('small', 0), b'hello')
+        self.assertEqual(self.node.cache.loads, {})
+        self.assertEqual(self.node.cache.get(('small', 0)), b'hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,7 +12,7 @@ function FileNodeAnalytics() {
         setLoading(true);
         setError(null);
 
-        const filesRes = await fetch('/api/files');
+        const filesRes = await fetch('/api/files?limit=20'); // limit for dashboard view
         if (!filesRes.ok) throw new Error('Failed to fetch files');
         const filesData = await filesRes.json();
         const files = filesData.files || [];
@@ -23,30 +23,29 @@ function FileNodeAnalytics() {
           return;
         }
 
-        const limitedFiles = files.slice(0, 20); // limit for dashboard view
-
-        const metadataPromises = limitedFiles.map(async (fname) => {
-          try {
-            const res = await fetch(`/api/files/${encodeURIComponent(fname)}/metadata`);
-            if (!res.ok) return { filename: fname, chunks: 0, nodes: [], replicas: 0 };
-            const meta = await res.json();
-            const replicas = meta.replicas || [];
-            const nodeSet = new Set();
-            replicas.forEach((r) => {
-              (r.replica_nodes || []).forEach((nid) => nodeSet.add(nid));
-            });
-            return {
-              filename: fname,
-              chunks: meta.chunks || replicas.length || 0,
-              nodes: Array.from(nodeSet).sort((a, b) => a - b),
-              replicas: replicas.length,
-            };
-          } catch {
-            return { filename: fname, chunks: 0, nodes: [], replicas: 0 };
-          }
+        const metaRes = await fetch('/api/metadata', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ files }),
         });
+        if (!metaRes.ok) throw new Error('Failed to fetch metadata');
+        const metadata = (await metaRes.json()).files || {};
 
-        const results = await Promise.all(metadataPromises);
+        const results = files.map((fname) => {
+          const meta = metadata[fname];
+          if (!meta) return { filename: fname, chunks: 0, nodes: [], replicas: 0 };
+          const replicas = meta.replicas || [];
+          const nodeSet = new Set();
+          replicas.forEach((r) => {
+            (r.replica_nodes || []).forEach((nid) => nodeSet.add(nid));
+          });
+          return {
+            filename: fname,
+            chunks: meta.chunks || replicas.length || 0,
+            nodes: Array.from(nodeSet).sort((a, b) => a - b),
+            replicas: replicas.length,
+          };
+        });
         setRows(results);
       } catch (err) {
         setError(err.message || 'Failed to load analytics');